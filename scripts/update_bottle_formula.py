@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 """Inject bottle do block into Homebrew formula from brew bottle --json output."""
+import hashlib
 import json
+import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 TAG_ORDER = ["arm64_tahoe", "arm64_sequoia"]
 
+# Read size when hashing bottles; hashlib releases the GIL for large updates,
+# so threads hash several bottles on separate cores
+CHUNK_SIZE = 4 * 1024 * 1024
+
 
 def collect_bottles(bottles_dir):
     """Return (tags, root_url, rebuild) from all .bottle.json files in the directory."""
@@ -24,10 +31,56 @@ def collect_bottles(bottles_dir):
                 tags[tag] = {
                     "sha256": tag_data["sha256"],
                     "cellar": tag_data.get("cellar", ":any_skip_relocation"),
+                    "files": [
+                        json_file.parent / name
+                        for name in (tag_data.get("local_filename"), tag_data.get("filename"))
+                        if name
+                    ],
                 }
     return tags, root_url, rebuild
 
 
+def sha256_file(path):
+    """Hash a file in large chunks, reusing one buffer."""
+    digest = hashlib.sha256()
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while n := f.readinto(buffer):
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+def verify_bottles(tags, workers=None):
+    """Hash each tag's bottle tarball in parallel and compare it with the JSON sha256.
+
+    The tarball is looked up next to its JSON, under brew's local filename or
+    the release filename.
+
+    Raises:
+        RuntimeError: Listing every bottle that is missing or does not match
+    """
+    paths = {}
+    problems = []
+    for tag, info in sorted(tags.items()):
+        found = [p for p in info["files"] if p.is_file()]
+        if found:
+            paths[tag] = found[0]
+        else:
+            names = ", ".join(p.name for p in info["files"]) or "no filename in JSON"
+            problems.append(f"{tag}: bottle not found ({names})")
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        digests = dict(zip(paths, pool.map(sha256_file, paths.values())))
+
+    for tag, digest in digests.items():
+        if digest != tags[tag]["sha256"]:
+            expected = tags[tag]["sha256"]
+            problems.append(f"{tag}: {paths[tag].name} has sha256 {digest}, JSON says {expected}")
+    if problems:
+        raise RuntimeError("Bottle verification failed:\n  " + "\n  ".join(problems))
+
+
 def build_bottle_block(tags, root_url, rebuild):
     lines = ["  bottle do\n"]
     if root_url:
@@ -44,10 +97,12 @@ def build_bottle_block(tags, root_url, rebuild):
     return "".join(lines)
 
 
-def update_formula(formula_path, bottles_dir):
+def update_formula(formula_path, bottles_dir, verify=False):
     tags, root_url, rebuild = collect_bottles(bottles_dir)
     if not tags:
         raise RuntimeError(f"No .bottle.json files found in {bottles_dir}")
+    if verify:
+        verify_bottles(tags)
 
     content = Path(formula_path).read_text()
 
@@ -62,8 +117,13 @@ def update_formula(formula_path, bottles_dir):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print(f"Usage: {sys.argv[0]} <bottles_dir> <formula_path>", file=sys.stderr)
+    args = [a for a in sys.argv[1:] if a != "--verify"]
+    if len(args) != 2:
+        print(f"Usage: {sys.argv[0]} [--verify] <bottles_dir> <formula_path>", file=sys.stderr)
+        sys.exit(1)
+    try:
+        update_formula(args[1], args[0], verify="--verify" in sys.argv)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
         sys.exit(1)
-    update_formula(sys.argv[2], sys.argv[1])
     print("Formula updated with bottle block.")
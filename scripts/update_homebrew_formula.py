@@ -1,27 +1,133 @@
 #!/usr/bin/env python3
 """Update Homebrew formula: main url/sha256 + all resource blocks."""
+import http.client
 import json
+import os
 import re
 import subprocess
 import sys
+import threading
 import time
-import urllib.request
+import tomllib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
 
 PACKAGE = "mct-cli"
 
+LOCK_PATH = Path(__file__).resolve().parent.parent / "uv.lock"
+
+# Environment the formula is installed into, for evaluating lock markers.
+# python_version comes from the formula's own `depends_on "python@X.Y"`, not
+# from whichever interpreter runs this script.
+MARKER_ENV = {
+    "sys_platform": "darwin",
+    "platform_system": "Darwin",
+    "os_name": "posix",
+    "implementation_name": "cpython",
+    "platform_python_implementation": "CPython",
+    "extra": "",  # Resources cover the runtime deps only, never extras
+}
+
+# Overridable so tests can point the resolver at a local stand-in index
+PYPI_BASE_URL = os.environ.get("PYPI_BASE_URL", "https://pypi.org/pypi")
+CACHE_DIR = Path(os.environ.get("PYPI_CACHE_DIR", Path.home() / ".cache" / "mct-release" / "pypi"))
+
+
+class PyPIResolver:
+    """Fetch PyPI JSON metadata concurrently, over keep-alive connections.
+
+    Responses are cached on disk by name and version and revalidated with
+    their ETag, so unchanged metadata costs a 304 instead of a full body.
+    """
+
+    def __init__(self, base_url=PYPI_BASE_URL, cache_dir=CACHE_DIR, workers=8):
+        self.base_url = base_url.rstrip("/")
+        self.cache_dir = Path(cache_dir)
+        self.workers = workers
+        self._local = threading.local()
+
+    def _connection(self, scheme, netloc):
+        """Return this thread's pooled connection to scheme://netloc."""
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get((scheme, netloc))
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conn = conns[(scheme, netloc)] = cls(netloc, timeout=30)
+        return conn
+
+    def _get(self, url, headers, redirects=5):
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        for attempt in (1, 2):
+            conn = self._connection(parts.scheme, parts.netloc)
+            try:
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionError):
+                # The server closed an idle keep-alive connection; reconnect once
+                conn.close()
+                if attempt == 2:
+                    raise
+        if resp.status in (301, 302, 307, 308) and redirects:
+            return self._get(urljoin(url, resp.getheader("Location")), headers, redirects - 1)
+        return resp.status, resp.getheader("ETag"), body
+
+    def _cache_path(self, name, version):
+        return self.cache_dir / f"{name.lower()}-{version}.json"
+
+    def json(self, name, version):
+        """Return the PyPI JSON metadata for name==version."""
+        cache_path = self._cache_path(name, version)
+        try:
+            cached = json.loads(cache_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            cached = None
+
+        headers = {"Accept": "application/json", "Connection": "keep-alive"}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+
+        status, etag, body = self._get(f"{self.base_url}/{name}/{version}/json", headers)
+        if status == 304 and cached:
+            return cached["data"]
+        if status != 200:
+            raise RuntimeError(f"PyPI returned {status} for {name}=={version}")
+
+        data = json.loads(body)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = cache_path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps({"etag": etag, "data": data}))
+        tmp.replace(cache_path)
+        return data
+
+    def sdist_url_sha256(self, name, version):
+        data = self.json(name, version)
+        for u in data["urls"]:
+            if u["packagetype"] == "sdist":
+                return u["url"], u["digests"]["sha256"]
+        raise RuntimeError(f"No sdist for {name}=={version}")
+
+    def resolve(self, deps):
+        """Return {name: (url, sha256)} for {name: version}, fetched concurrently."""
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = pool.map(lambda item: self.sdist_url_sha256(*item), deps.items())
+            return dict(zip(deps, results))
+
+
+_resolver = PyPIResolver()
+
 
 def pypi_json(name, version):
-    url = f"https://pypi.org/pypi/{name}/{version}/json"
-    with urllib.request.urlopen(url) as f:
-        return json.loads(f.read())
+    return _resolver.json(name, version)
 
 
 def sdist_url_sha256(name, version):
-    data = pypi_json(name, version)
-    for u in data["urls"]:
-        if u["packagetype"] == "sdist":
-            return u["url"], u["digests"]["sha256"]
-    raise RuntimeError(f"No sdist for {name}=={version}")
+    return _resolver.sdist_url_sha256(name, version)
 
 
 def get_deps(package, version, retries=20, delay=15):
@@ -55,6 +161,169 @@ def get_deps(package, version, retries=20, delay=15):
     }
 
 
+_MARKER_TOKEN = re.compile(
+    r"\s*(\(|\)|and\b|or\b|not in\b|in\b|[<>=!~]=?=?|'[^']*'|\"[^\"]*\"|[A-Za-z_.]+)"
+)
+
+
+def _version(value):
+    try:
+        return tuple(int(p) for p in value.split("."))
+    except ValueError:
+        return None
+
+
+def _compare(left, op, right):
+    if op in ("in", "not in"):
+        return (left in right) == (op == "in")
+    left_v, right_v = _version(left), _version(right)
+    if left_v is None or right_v is None:
+        if op not in ("==", "!=", "==="):
+            raise ValueError(f"cannot order {left!r} {op} {right!r}")
+        left_v, right_v = left, right
+    if op == "~=":
+        # Compatible release: ~=3.10.2 means >=3.10.2 and ==3.10.*
+        if len(right_v) < 2:
+            raise ValueError(f"~= needs at least two release segments, not {right!r}")
+        prefix = right_v[:-1]
+        return _compare(left, ">=", right) and (left_v + (0,) * len(prefix))[:len(prefix)] == prefix
+    if isinstance(left_v, tuple):
+        # Release segments compare as if zero-padded: 3.12 == 3.12.0
+        width = max(len(left_v), len(right_v))
+        left_v += (0,) * (width - len(left_v))
+        right_v += (0,) * (width - len(right_v))
+    ops = {
+        "==": left_v == right_v,
+        "===": left_v == right_v,
+        "!=": left_v != right_v,
+        "<": left_v < right_v,
+        "<=": left_v <= right_v,
+        ">": left_v > right_v,
+        ">=": left_v >= right_v,
+    }
+    if op not in ops:
+        raise ValueError(f"unsupported marker operator {op!r}")
+    return ops[op]
+
+
+def marker_matches(marker, env=MARKER_ENV):
+    """Evaluate a PEP 508 environment marker against env.
+
+    Raises:
+        ValueError: If the marker is malformed or uses a variable env lacks,
+            since guessing could silently add or drop a resource
+    """
+    tokens = _MARKER_TOKEN.findall(marker)
+    pos = 0
+
+    def value(token):
+        if token[0] in "'\"":
+            return token[1:-1]
+        if token not in env:
+            raise ValueError(f"unknown marker variable {token!r} in {marker!r}")
+        return env[token]
+
+    def expr():
+        nonlocal pos
+        result = term()
+        while pos < len(tokens) and tokens[pos] == "or":
+            pos += 1
+            result = term() or result
+        return result
+
+    def term():
+        nonlocal pos
+        result = atom()
+        while pos < len(tokens) and tokens[pos] == "and":
+            pos += 1
+            result = atom() and result
+        return result
+
+    def atom():
+        nonlocal pos
+        if tokens[pos] == "(":
+            pos += 1
+            result = expr()
+            if tokens[pos] != ")":
+                raise ValueError(f"malformed marker {marker!r}")
+            pos += 1
+            return result
+        left, op, right = tokens[pos:pos + 3]
+        pos += 3
+        return _compare(value(left), op, value(right))
+
+    try:
+        result = expr()
+    except IndexError:
+        raise ValueError(f"malformed marker {marker!r}") from None
+    if pos != len(tokens):
+        raise ValueError(f"malformed marker {marker!r}")
+    return result
+
+
+def formula_python_version(formula_path):
+    """Return the X.Y of the formula's python@X.Y dependency, or None."""
+    with open(formula_path) as f:
+        match = re.search(r'^\s*depends_on "python@(\d+\.\d+)"', f.read(), flags=re.MULTILINE)
+    return match.group(1) if match else None
+
+
+def get_deps_from_lock(package, version, lock_path=LOCK_PATH, python_version=None):
+    """Return {name: (version, sdist_url, sha256)} for package's runtime closure.
+
+    Reads uv.lock directly, so no network or pip subprocess is needed. Returns
+    None if the lock is missing or pins a different version of the package.
+    sdist_url and sha256 are None for packages the lock has no sdist for.
+
+    Raises:
+        ValueError: If a dependency marker cannot be evaluated, e.g. one on
+            python_version when python_version is None
+    """
+    env = dict(MARKER_ENV)
+    if python_version is not None:
+        env["python_version"] = python_version
+    try:
+        with open(lock_path, "rb") as f:
+            lock = tomllib.load(f)
+    except FileNotFoundError:
+        return None
+
+    by_name = {}
+    for pkg in lock.get("package", []):
+        by_name.setdefault(pkg["name"], []).append(pkg)
+
+    def find(name, ver=None):
+        candidates = by_name.get(name, [])
+        for pkg in candidates:
+            if ver is None or pkg["version"] == ver:
+                return pkg
+        raise RuntimeError(f"{name} {ver or ''} not found in {lock_path}")
+
+    root = next((p for p in by_name.get(package, []) if p["version"] == version), None)
+    if root is None:
+        return None
+
+    deps = {}
+    stack = [root]
+    seen = {(root["name"], root["version"])}
+    while stack:
+        pkg = stack.pop()
+        # Only [package].dependencies: dev groups and extras are not runtime deps
+        for dep in pkg.get("dependencies", []):
+            if "marker" in dep and not marker_matches(dep["marker"], env):
+                continue
+            found = find(dep["name"], dep.get("version"))
+            ident = (found["name"], found["version"])
+            if ident in seen:
+                continue
+            seen.add(ident)
+            stack.append(found)
+            sdist = found.get("sdist") or {}
+            sha256 = sdist["hash"].removeprefix("sha256:") if "hash" in sdist else None
+            deps[found["name"]] = (found["version"], sdist.get("url"), sha256)
+    return deps
+
+
 def update_formula(formula_path, main_url, main_sha256, resources):
     with open(formula_path) as f:
         content = f.read()
@@ -79,27 +348,41 @@ def update_formula(formula_path, main_url, main_sha256, resources):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print(f"Usage: {sys.argv[0]} <version> <formula_path>", file=sys.stderr)
+    args = [a for a in sys.argv[1:] if a != "--pip"]
+    if len(args) != 2:
+        print(f"Usage: {sys.argv[0]} [--pip] <version> <formula_path>", file=sys.stderr)
         sys.exit(1)
 
-    version = sys.argv[1]
-    formula_path = sys.argv[2]
+    version = args[0]
+    formula_path = args[1]
 
     print(f"Fetching {PACKAGE}=={version} from PyPI...")
     main_url, main_sha256 = sdist_url_sha256(PACKAGE, version)
     print(f"URL: {main_url}")
     print(f"SHA256: {main_sha256}")
 
-    print("Resolving dependencies...")
-    deps = get_deps(PACKAGE, version)
+    locked = None
+    if "--pip" not in sys.argv:
+        try:
+            locked = get_deps_from_lock(
+                PACKAGE, version, python_version=formula_python_version(formula_path)
+            )
+        except ValueError as e:
+            print(f"Cannot resolve from {LOCK_PATH.name} ({e}), falling back to pip")
+    if locked is not None:
+        print(f"Resolving dependencies from {LOCK_PATH.name}...")
+        deps = {name: ver for name, (ver, _, _) in locked.items()}
+    else:
+        print("Resolving dependencies with pip...")
+        deps = get_deps(PACKAGE, version)
     for name, ver in deps.items():
         print(f"  {name}=={ver}")
 
     resources = {}
-    for name, ver in deps.items():
-        url, sha256 = sdist_url_sha256(name, ver)
-        resources[name] = (url, sha256)
+    if locked is not None:
+        resources = {name: (url, sha256) for name, (_, url, sha256) in locked.items() if url}
+    missing = {name: ver for name, ver in deps.items() if name not in resources}
+    resources.update(_resolver.resolve(missing))
 
     update_formula(formula_path, main_url, main_sha256, resources)
     print("Formula updated successfully.")
@@ -1,5 +1,11 @@
 """macOS Configuration Tools - A CLI for managing macOS settings declaratively."""
 
-from importlib.metadata import version
 
-__version__ = version("mct-cli")
+def __getattr__(name: str):
+    # Resolved lazily: importlib.metadata is slow to import and scan, and
+    # shell completion imports this package on every keypress
+    if name == "__version__":
+        from importlib.metadata import version
+
+        return version("mct-cli")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
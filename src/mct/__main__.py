@@ -0,0 +1,21 @@
+"""Entry point for the mct command."""
+
+import os
+
+
+def main():
+    # Serve shell completion from the cache before importing the CLI
+    instruction = os.environ.get("_MCT_COMPLETE")
+    if instruction:
+        from . import completion
+
+        if completion.serve(instruction):
+            return
+
+    from .cli import main as cli_main
+
+    cli_main()
+
+
+if __name__ == "__main__":
+    main()
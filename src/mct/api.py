@@ -0,0 +1,379 @@
+"""Async API for embedding mct in asyncio programs.
+
+Example:
+    from mct import api
+
+    state = await api.read_state(["dock.autohide", "finder.show_hidden"])
+    diffs = await api.apply({"dock.autohide": True}, dry_run=True)
+
+Configs are flattened dicts, as returned by `config.flatten_config`, and
+results are the same `ConfigDiff` objects the CLI uses. System access goes
+through a backend: by default `SubprocessBackend`, which runs `defaults` as
+asyncio subprocesses with bounded concurrency. Cancelling a call kills the
+subprocesses it started. Other backends, such as `MemoryBackend` for tests,
+can be passed to any function.
+"""
+
+import asyncio
+import copy
+import errno
+import os
+import plistlib
+import secrets
+import stat
+from collections.abc import Awaitable, Iterable
+from typing import Any, Protocol
+
+from . import defaults, prefs_helper
+from .config import (
+    SETTINGS,
+    ConfigDiff,
+    apps_to_restart,
+    check_values,
+    compute_diff,
+    extract_state,
+    group_writes,
+)
+from .defaults import DefaultsError
+
+# (key, value, value_type) tuples, as for defaults.write_many
+WriteItems = list[tuple[str, Any, str | None]]
+
+
+class Backend(Protocol):
+    """Reads and writes preference domains for the API functions."""
+
+    async def export(self, domain: str) -> dict[str, Any]:
+        """Return every key of a domain, or {} if it does not exist."""
+        ...
+
+    async def write_many(self, domain: str, items: WriteItems, previous: dict[str, Any]) -> None:
+        """Write keys of one domain; previous holds their current values."""
+        ...
+
+    async def restart_app(self, app_name: str) -> bool:
+        """Restart an application so it picks up changed settings.
+
+        Returns:
+            Whether the app was restarted (False if it was not running)
+        """
+        ...
+
+
+class SubprocessBackend:
+    """Runs `defaults` and `killall` as asyncio subprocesses.
+
+    Args:
+        max_concurrency: Most subprocesses running at once
+        prefix: Command run in front of each one, e.g. to run it as another user
+    """
+
+    def __init__(self, max_concurrency: int = 8, prefix: tuple[str, ...] = ()):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.prefix = prefix
+
+    async def _run(self, *cmd: str, input: bytes | None = None) -> tuple[int, bytes, bytes]:
+        async with self._semaphore:
+            if cmd[0] == "defaults":
+                defaults.stats["subprocesses"] += 1
+            # Shielded so a cancelled call still gets the process to kill it
+            spawn = asyncio.ensure_future(
+                asyncio.create_subprocess_exec(
+                    *self.prefix,
+                    *cmd,
+                    stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+            )
+            try:
+                proc = await asyncio.shield(spawn)
+                stdout, stderr = await proc.communicate(input)
+            except asyncio.CancelledError:
+                proc = await spawn
+                if proc.returncode is None:
+                    proc.kill()
+                # Drain the pipes so the transport closes with the process
+                await proc.communicate()
+                raise
+            return proc.returncode, stdout, stderr
+
+    async def export(self, domain: str) -> dict[str, Any]:
+        returncode, stdout, _ = await self._run("defaults", "export", domain, "-")
+        if returncode != 0:
+            return {}
+        try:
+            return plistlib.loads(stdout)
+        except plistlib.InvalidFileException:
+            return {}
+
+    async def write_many(self, domain: str, items: WriteItems, previous: dict[str, Any]) -> None:
+        # Same strategy as defaults.write_many: only the keys being set are
+        # written, so other changes to the domain are left alone
+        for key, value, value_type in items:
+            args = defaults.update_args(domain, key, value, value_type, previous.get(key))
+            returncode, _, stderr = await self._run("defaults", *args)
+            if returncode != 0:
+                raise DefaultsError(f"Failed to write {domain} {key}: {stderr.decode()}")
+
+    async def restart_app(self, app_name: str) -> bool:
+        returncode, _, _ = await self._run("killall", app_name)
+        if returncode == 0:
+            defaults.stats["restarts"] += 1
+        return returncode == 0
+
+
+class PlistFileBackend:
+    """Reads and writes the plist files in a Preferences directory directly.
+
+    For accounts without a login session, whose preferences no cfprefsd
+    caches. Files are read and written in a worker thread and, when uid is
+    given, handed to that user.
+
+    Run as root, the account can swap the directories below its home for
+    symlinks at any time. So the path below home is opened one directory at
+    a time without following symlinks, and files are only opened, created
+    and renamed relative to the directory opened that way.
+
+    Args:
+        directory: The account's Library/Preferences directory
+        uid: Owner of the files written (needs root for other users)
+        gid: Group of the files written
+        home: Directory above directory that the account cannot replace,
+            e.g. its home (default: directory itself)
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        uid: int | None = None,
+        gid: int | None = None,
+        home: str | None = None,
+    ):
+        self.store = prefs_helper.PlistDirStore(directory)
+        self.uid = uid
+        self.gid = gid
+        self.home = home if home is not None else directory
+        if os.path.relpath(directory, self.home).split(os.sep)[0] == os.pardir:
+            raise ValueError(f"{directory} is not inside {self.home}")
+
+    def _open_directory(self, create: bool) -> int | None:
+        """Open the Preferences directory; None if it does not exist and create is False."""
+        fd = os.open(self.home, os.O_RDONLY | os.O_DIRECTORY)
+        path = self.home
+        for name in os.path.relpath(self.store.directory, self.home).split(os.sep):
+            if name == os.curdir:
+                continue
+            path = os.path.join(path, name)
+            try:
+                try:
+                    child = os.open(name, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=fd)
+                except FileNotFoundError:
+                    if not create:
+                        return None
+                    os.mkdir(name, 0o700, dir_fd=fd)
+                    child = os.open(name, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW, dir_fd=fd)
+                    if self.uid is not None:
+                        try:
+                            os.fchown(child, self.uid, -1 if self.gid is None else self.gid)
+                        except OSError:
+                            os.close(child)
+                            raise
+                except OSError as e:
+                    if e.errno in (errno.ELOOP, errno.ENOTDIR):
+                        raise DefaultsError(f"Refusing to use {path}: not a directory or a symlink") from None
+                    raise
+            finally:
+                os.close(fd)
+            fd = child
+        return fd
+
+    def _load(self, dir_fd: int, domain: str) -> dict[str, Any]:
+        name = os.path.basename(self.store.path(domain))
+        try:
+            fd = os.open(name, os.O_RDONLY | os.O_NOFOLLOW, dir_fd=dir_fd)
+        except FileNotFoundError:
+            return {}
+        except OSError as e:
+            if e.errno == errno.ELOOP:
+                raise DefaultsError(f"Refusing to read {self.store.path(domain)}: it is a symlink") from None
+            raise
+        with os.fdopen(fd, "rb") as f:
+            if not stat.S_ISREG(os.fstat(f.fileno()).st_mode):
+                raise DefaultsError(f"Refusing to read {self.store.path(domain)}: not a regular file")
+            return plistlib.load(f)
+
+    def _export(self, domain: str) -> dict[str, Any]:
+        dir_fd = self._open_directory(create=False)
+        if dir_fd is None:
+            return {}
+        try:
+            return self._load(dir_fd, domain)
+        finally:
+            os.close(dir_fd)
+
+    def _write(self, domain: str, items: WriteItems) -> None:
+        dir_fd = self._open_directory(create=True)
+        try:
+            # Round-trip through plist so values are stored as `defaults` would
+            data = plistlib.loads(defaults.merge_payload(self._load(dir_fd, domain), items))
+            name = os.path.basename(self.store.path(domain))
+            tmp = f".mct-{secrets.token_hex(8)}"
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600, dir_fd=dir_fd)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    plistlib.dump(data, f, fmt=plistlib.FMT_BINARY)
+                    # Owned by the user before it appears under its real name
+                    if self.uid is not None:
+                        os.fchown(f.fileno(), self.uid, -1 if self.gid is None else self.gid)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, name, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+            except BaseException:
+                try:
+                    os.unlink(tmp, dir_fd=dir_fd)
+                except OSError:
+                    pass
+                raise
+        finally:
+            os.close(dir_fd)
+
+    async def export(self, domain: str) -> dict[str, Any]:
+        """Return every key of a domain, or {} if its file does not exist.
+
+        Raises:
+            DefaultsError: If the file cannot be read or is not a valid plist
+        """
+        try:
+            return await asyncio.to_thread(self._export, domain)
+        except (OSError, ValueError) as e:
+            # A corrupt file is not treated as empty: writing would wipe it
+            raise DefaultsError(f"Failed to read {self.store.path(domain)}: {e}") from None
+
+    async def write_many(self, domain: str, items: WriteItems, previous: dict[str, Any]) -> None:
+        try:
+            await asyncio.to_thread(self._write, domain, items)
+        except (OSError, ValueError) as e:
+            raise DefaultsError(f"Failed to write {self.store.path(domain)}: {e}") from None
+
+    async def restart_app(self, app_name: str) -> bool:
+        # No session, so nothing is running that could pick the change up
+        return False
+
+
+class MemoryBackend:
+    """Keeps domains in a dict, for tests and previews.
+
+    Args:
+        domains: Initial values by domain; modified in place by writes
+    """
+
+    def __init__(self, domains: dict[str, dict[str, Any]] | None = None):
+        self.domains = domains if domains is not None else {}
+        self.restarted: list[str] = []
+
+    async def export(self, domain: str) -> dict[str, Any]:
+        return copy.deepcopy(self.domains.get(domain, {}))
+
+    async def write_many(self, domain: str, items: WriteItems, previous: dict[str, Any]) -> None:
+        # Round-trip through plist so values are stored as a real domain would
+        payload = defaults.merge_payload(self.domains.get(domain, {}), items)
+        self.domains[domain] = plistlib.loads(payload)
+
+    async def restart_app(self, app_name: str) -> bool:
+        self.restarted.append(app_name)
+        return True
+
+
+async def _all(aws: Iterable[Awaitable[Any]]) -> list[Any]:
+    """Run awaitables concurrently; on the first failure, cancel the rest."""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def read_state(
+    keys: Iterable[str] | None = None,
+    backend: Backend | None = None,
+) -> dict[str, Any]:
+    """Read settings from the system, exporting their domains concurrently.
+
+    Args:
+        keys: Config keys to read (default: every supported setting)
+        backend: Where to read from (default: a new SubprocessBackend)
+
+    Returns:
+        Dict of config key -> current value, for settings that are set
+    """
+    backend = backend or SubprocessBackend()
+    by_domain: dict[str, list[str]] = {}
+    for key in SETTINGS if keys is None else keys:
+        by_domain.setdefault(SETTINGS[key].domain, []).append(key)
+
+    exported = await _all(backend.export(domain) for domain in by_domain)
+    state = {}
+    for domain_keys, values in zip(by_domain.values(), exported):
+        state.update(extract_state(domain_keys, values))
+    return state
+
+
+async def diff(config: dict[str, Any], backend: Backend | None = None) -> list[ConfigDiff]:
+    """Compute differences between a flattened config and the system.
+
+    Keys that are not supported settings are ignored.
+
+    Raises:
+        ValueError: If a setting's value does not have the setting's type
+    """
+    check_values(config)
+    current_state = await read_state((k for k in config if k in SETTINGS), backend)
+    return compute_diff(config, current_state)
+
+
+async def apply(
+    config: dict[str, Any],
+    dry_run: bool = False,
+    backend: Backend | None = None,
+    restarted: list[str] | None = None,
+) -> list[ConfigDiff]:
+    """Apply a flattened config to the system.
+
+    Domains are written concurrently, keys within a domain in order, and
+    affected apps are restarted once all writes have finished.
+
+    Args:
+        config: Flattened config dict
+        dry_run: If True, don't actually apply changes
+        backend: Where to read and write (default: a new SubprocessBackend)
+        restarted: If given, filled with the apps that were restarted
+
+    Returns:
+        List of changes that were (or would be) applied
+
+    Raises:
+        ValueError: If a setting's value does not have the setting's type
+        DefaultsError: If a write fails; writes still running are cancelled
+    """
+    backend = backend or SubprocessBackend()
+    diffs = await diff(config, backend)
+    if dry_run:
+        return diffs
+
+    await _all(
+        backend.write_many(
+            domain,
+            [(d.setting.key, d.desired, d.setting.value_type) for d in group],
+            {d.setting.key: d.current for d in group},
+        )
+        for domain, group in group_writes(diffs).items()
+    )
+    apps = apps_to_restart(diffs)
+    results = await _all(backend.restart_app(app) for app in apps)
+    if restarted is not None:
+        restarted.extend(app for app, ok in zip(apps, results) if ok)
+    return diffs
@@ -1,7 +1,11 @@
 import importlib.metadata
+import sys
+import time
+from pathlib import Path
 
 import typer
 
+from . import defaults, plugins, sysfiles
 from .commands.dock import dock_app
 from .commands.finder import finder_app
 from .commands.keyboard import keyboard_app
@@ -9,15 +13,24 @@ from .commands.screenshot import screenshot_app
 from .commands.system import system_app
 from .config import (
     CONFIG_PATH,
+    CUSTOM_SECTION,
     SETTINGS,
+    VALUE_TYPES,
+    WriteError,
     apply_config,
+    check_values,
     compute_diff,
     flatten_config,
     load_config,
+    parse_assignments,
+    parse_custom_settings,
     read_current_state,
+    register_settings,
     save_config,
     unflatten_config,
 )
+from .structure import describe, diff_value
+from .sysfiles import FILES, apply_file_diffs, compute_file_diffs
 
 app = typer.Typer()
 app.add_typer(dock_app, name="dock", help="Manage dock settings")
@@ -25,6 +38,8 @@ app.add_typer(finder_app, name="finder", help="Manage Finder settings")
 app.add_typer(keyboard_app, name="keyboard", help="Manage keyboard settings")
 app.add_typer(screenshot_app, name="screenshot", help="Manage screenshot settings")
 app.add_typer(system_app, name="system", help="Manage system settings")
+profile_app = typer.Typer()
+app.add_typer(profile_app, name="profile", help="Switch between named config profiles")
 
 
 def _version_callback(value: bool):
@@ -36,24 +51,77 @@ def _version_callback(value: bool):
 
 @app.callback()
 def callback(
+    ctx: typer.Context,
     version: bool = typer.Option(
         False, "--version", "-v", help="Show the version and exit.", callback=_version_callback
-    )
+    ),
+    no_restart: bool = typer.Option(
+        False,
+        "--no-restart",
+        help=f"Queue app restarts for 'mct restart-pending' (or set {defaults.DEFER_ENV}=1)",
+    ),
 ):
     """macOS Configuration Tools - Manage macOS system settings declaratively."""
-    pass
+    from . import history
 
+    if no_restart:
+        defaults.defer_restarts()
+    ctx.call_on_close(_echo_deferred)
+
+    # Every command's writes are recorded once it finishes
+    history.begin()
+    ctx.call_on_close(history.finish)
+
+
+def _echo_deferred() -> None:
+    if defaults.deferred:
+        typer.echo(
+            f"Restart pending: {', '.join(defaults.deferred)} (run 'mct restart-pending')",
+            err=True,
+        )
+
+
+def _fetch_remote(url: str):
+    """Fetch a remote config, falling back to the cached copy if the server is down."""
+    from . import remote
+
+    try:
+        fetched = remote.fetch(url)
+    except remote.RemoteConfigError as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(1)
+    if fetched.offline:
+        typer.echo(f"Warning: {url} is unreachable, using the cached copy", err=True)
+    return fetched
 
-@app.command()
-def apply(
-    dry_run: bool = typer.Option(False, "--dry-run", "-n", help="Show what would change without applying"),
-    config_file: str = typer.Option(None, "--config", "-c", help="Path to config file"),
-):
-    """Apply settings from config file to the system."""
-    path = config_file if config_file else CONFIG_PATH
 
-    if config_file:
-        from pathlib import Path
+def _mark_synced(fetched, config: dict) -> None:
+    """Record that the system now matches a remote config."""
+    domains = {SETTINGS[k].domain for k in config if k in SETTINGS}
+    files = {FILES[k].path for k in config if k in FILES}
+    try:
+        fetched.mark_synced(sorted(domains), sorted(files))
+    except OSError:
+        # Only costs a full diff next time
+        pass
+
+
+def _load_config_file(config_file: str | None, fetched=None) -> dict:
+    """Load the config at config_file (a path or URL), or the default config if not given.
+
+    Settings declared in the config's `custom:` section are registered.
+    """
+    from . import remote
+
+    if fetched is None and remote.is_url(config_file):
+        fetched = _fetch_remote(config_file)
+
+    if fetched is not None:
+        import yaml
+        config = yaml.safe_load(fetched.text) or {}
+    elif not config_file:
+        config = load_config()
+    else:
         path = Path(config_file)
         if not path.exists():
             typer.echo(f"Error: Config file not found: {path}")
@@ -61,8 +129,67 @@ def apply(
         import yaml
         with open(path) as f:
             config = yaml.safe_load(f) or {}
-    else:
-        config = load_config()
+
+    try:
+        register_settings(parse_custom_settings(config.get(CUSTOM_SECTION) or {}))
+    except ValueError as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(1)
+
+    # Import settings packs only for categories nothing else provides
+    known = {key.split(".")[0] for key in SETTINGS} | {key.split(".")[0] for key in FILES}
+    unknown = set(config) - known - {CUSTOM_SECTION}
+    if unknown:
+        plugins.load_categories(unknown)
+
+    try:
+        flat_config = flatten_config(config)
+        check_values(flat_config)
+        for key, value in flat_config.items():
+            if key in FILES:
+                sysfiles.enabled(key, value)
+    except ValueError as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(1)
+    return config
+
+
+@app.command()
+def apply(
+    ctx: typer.Context,
+    plan_file: str = typer.Argument(None, help="Plan file written by 'mct plan'"),
+    dry_run: bool = typer.Option(False, "--dry-run", "-n", help="Show what would change without applying"),
+    config_file: str = typer.Option(None, "--config", "-c", help="Path or http(s) URL of config file"),
+    timeout: float = typer.Option(None, "--timeout", "-t", help="Give up after this many seconds overall"),
+    latency: bool = typer.Option(False, "--latency", help="Print per-operation latency percentiles"),
+    users: str = typer.Option(
+        None, "--users", "-u", help="Apply to these accounts ('all' or user1,user2) instead; needs root"
+    ),
+):
+    """Apply settings from config file (or a saved plan) to the system."""
+    defaults.set_deadline(timeout)
+    if latency:
+        ctx.call_on_close(_echo_latency)
+
+    if plan_file:
+        if config_file or users:
+            typer.echo("Error: Cannot use --config or --users with a plan file")
+            raise typer.Exit(1)
+        _apply_plan(Path(plan_file), dry_run)
+        return
+
+    if not dry_run:
+        from . import history
+        history.keep()
+
+    from . import remote
+
+    fetched = _fetch_remote(config_file) if remote.is_url(config_file) else None
+    if fetched is not None and fetched.in_sync():
+        typer.echo("System is already in sync with config (not modified)")
+        return
+
+    config = _load_config_file(config_file, fetched)
 
     if not config:
         typer.echo(f"No config file found at {CONFIG_PATH}")
@@ -73,14 +200,102 @@ def apply(
 
     # Filter to only known settings
     valid_config = {k: v for k, v in flat_config.items() if k in SETTINGS}
-    unknown_keys = set(flat_config.keys()) - set(SETTINGS.keys())
+    file_config = {k: v for k, v in flat_config.items() if k in FILES}
+    unknown_keys = set(flat_config.keys()) - set(SETTINGS.keys()) - set(FILES.keys())
 
     if unknown_keys:
         typer.echo(f"Warning: Unknown settings will be ignored: {', '.join(sorted(unknown_keys))}")
 
-    diffs = apply_config(valid_config, dry_run=dry_run)
+    if users:
+        _apply_users(users, valid_config, file_config, dry_run)
+        return
 
-    if not diffs:
+    started = time.perf_counter()
+    try:
+        diffs = apply_config(valid_config, dry_run=dry_run)
+    except defaults.DeadlineExceeded as e:
+        _echo_deadline(e, timeout)
+        raise typer.Exit(1)
+    except WriteError as e:
+        _echo_outcomes(e)
+        raise typer.Exit(1)
+    except defaults.DefaultsError as e:
+        typer.echo(f"Error: {e}", err=True)
+        raise typer.Exit(1)
+    file_diffs = compute_file_diffs(file_config)
+
+    if not dry_run:
+        try:
+            apply_file_diffs(file_diffs)
+        except PermissionError as e:
+            typer.echo(f"Error: {e}", err=True)
+            raise typer.Exit(1)
+
+        from . import metrics
+        metrics.record_apply(
+            duration=time.perf_counter() - started,
+            changes=len(diffs) + len(file_diffs),
+            subprocesses=defaults.stats["subprocesses"],
+            restarts=defaults.stats["restarts"],
+        )
+
+    if fetched is not None and (not dry_run or not (diffs or file_diffs)):
+        _mark_synced(fetched, {**valid_config, **file_config})
+
+    _echo_changes([*diffs, *file_diffs], dry_run)
+
+
+def _apply_users(spec: str, config: dict, file_config: dict, dry_run: bool) -> None:
+    """Apply a config to several accounts concurrently and report per account."""
+    import asyncio
+
+    from . import users
+
+    try:
+        accounts = users.resolve(spec)
+    except (ValueError, OSError) as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(1)
+    if not accounts:
+        typer.echo("Error: No user accounts found")
+        raise typer.Exit(1)
+
+    results = asyncio.run(users.apply_users(accounts, config, dry_run=dry_run))
+
+    for result in results:
+        name = result.user.name
+        session = "logged in" if result.logged_in else "no session"
+        if result.error:
+            typer.echo(f"{name} ({session}): Error: {result.error}")
+            continue
+        if not result.changes:
+            typer.echo(f"{name} ({session}): in sync")
+            continue
+        verb = "would change" if dry_run else "changed"
+        restarted = f", restarted {', '.join(result.restarted)}" if result.restarted else ""
+        typer.echo(f"{name} ({session}): {len(result.changes)} setting(s) {verb}{restarted}")
+        for diff in result.changes:
+            _echo_change(diff)
+
+    # Managed system files are shared by all accounts, so they are applied once
+    file_diffs = compute_file_diffs(file_config)
+    if file_diffs:
+        if not dry_run:
+            try:
+                apply_file_diffs(file_diffs)
+            except PermissionError as e:
+                typer.echo(f"Error: {e}", err=True)
+                raise typer.Exit(1)
+        typer.echo("System files:")
+        for diff in file_diffs:
+            _echo_change(diff)
+
+    if any(result.error for result in results):
+        raise typer.Exit(1)
+
+
+def _echo_changes(changes: list, dry_run: bool) -> None:
+    if not changes:
         typer.echo("System is already in sync with config")
         return
 
@@ -89,23 +304,241 @@ def apply(
     else:
         typer.echo("Applied changes:")
 
-    for diff in diffs:
+    for diff in changes:
+        _echo_change(diff)
+
+    if dry_run:
+        typer.echo(f"\nRun without --dry-run to apply {len(changes)} change(s)")
+
+
+def _echo_deadline(e: defaults.DeadlineExceeded, timeout: float) -> None:
+    """Report what was done before the --timeout deadline passed."""
+    typer.echo(f"Error: {e} (--timeout {timeout:g}s)", err=True)
+    applied = {d.key for d in e.applied}
+    if e.applied:
+        typer.echo("Applied changes (apps not restarted):")
+        for d in e.applied:
+            _echo_change(d)
+    pending = [d for d in e.diffs if d.key not in applied]
+    if pending:
+        typer.echo("Differences not applied:")
+        for d in pending:
+            _echo_change(d)
+    if e.unchecked:
+        typer.echo(f"Not checked: {', '.join(e.unchecked)}")
+
+
+def _echo_outcomes(e: WriteError) -> None:
+    """Report which settings were written when writes to some domains failed."""
+    typer.echo("Error: Some settings could not be written", err=True)
+    for outcome in e.outcomes:
+        if outcome.written:
+            _echo_change(outcome.diff)
+        else:
+            typer.echo(f"  {outcome.diff.key}: FAILED ({outcome.error})")
+
+
+def _echo_latency() -> None:
+    """Print count, p50/p90/p99 and max latency of each kind of operation."""
+    summary = defaults.latency_percentiles()
+    if not summary:
+        return
+    typer.echo(f"\n{'operation':<20} {'count':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}", err=True)
+    for op, row in summary.items():
+        times = " ".join(f"{row[k] * 1000:>7.1f}ms" for k in ("p50", "p90", "p99", "max"))
+        typer.echo(f"{op:<20} {int(row['count']):>6} {times}", err=True)
+
+
+def _echo_change(diff) -> None:
+    """Print a change, element by element for arrays and dicts."""
+    changes = diff_value(diff.current, diff.desired)
+    if changes is None:
         current = diff.current if diff.current is not None else "(not set)"
         typer.echo(f"  {diff.key}: {current} -> {diff.desired}")
+        return
+    typer.echo(f"  {diff.key}: {len(changes)} element change(s)")
+    for change in changes:
+        typer.echo(f"    {describe(change)}")
 
-    if dry_run:
-        typer.echo(f"\nRun without --dry-run to apply {len(diffs)} change(s)")
+
+def _apply_plan(path: Path, dry_run: bool) -> None:
+    """Execute a saved plan, checking only that the domains it read are unchanged."""
+    from . import metrics
+    from . import plan as plans
+
+    if not path.exists():
+        typer.echo(f"Error: Plan file not found: {path}")
+        raise typer.Exit(1)
+    try:
+        saved = plans.load(path)
+    except ValueError as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(1)
+
+    if not dry_run:
+        from . import history
+        history.keep()
+
+        started = time.perf_counter()
+        try:
+            plans.execute(saved)
+        except plans.StalePlanError as e:
+            typer.echo(f"Error: {e}; run 'mct plan' again", err=True)
+            raise typer.Exit(1)
+        except WriteError as e:
+            _echo_outcomes(e)
+            raise typer.Exit(1)
+        except (defaults.DefaultsError, PermissionError) as e:
+            typer.echo(f"Error: {e}", err=True)
+            raise typer.Exit(1)
+
+        metrics.record_apply(
+            duration=time.perf_counter() - started,
+            changes=len(saved.changes) + len(saved.file_changes),
+            subprocesses=defaults.stats["subprocesses"],
+            restarts=defaults.stats["restarts"],
+        )
+
+    _echo_changes([*saved.changes, *saved.file_changes], dry_run)
+
+
+def _register_custom_settings(keys: set[str]) -> str | None:
+    """Register the custom settings of the default config that keys refer to.
+
+    Only the config's `custom:` section is read, and only the entries for
+    keys are checked, so a mistake elsewhere in the config does not get in
+    the way of `mct set`.
+
+    Returns:
+        Why the config could not be read, or None
+    """
+    import yaml
+
+    wanted = keys - SETTINGS.keys()
+    if not wanted:
+        return None
+    try:
+        config = load_config()
+    except (OSError, yaml.YAMLError) as e:
+        return str(e)
+    section = config.get(CUSTOM_SECTION) if isinstance(config, dict) else None
+    if not isinstance(section, dict):
+        return None
+
+    try:
+        register_settings(parse_custom_settings({k: v for k, v in section.items() if k in wanted}))
+    except ValueError as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(1)
+    return None
+
+
+@app.command("set")
+def set_values(
+    assignments: list[str] = typer.Argument(
+        None, help="Settings as key=value, e.g. dock.size=48 (default: read from stdin)"
+    ),
+    dry_run: bool = typer.Option(False, "--dry-run", "-n", help="Show what would change without applying"),
+):
+    """Set registry settings, writing each domain once and restarting each app once."""
+    import shlex
+
+    if not assignments or assignments == ["-"]:
+        # One or more assignments per line; '#' starts a comment
+        assignments = [
+            word
+            for line in sys.stdin
+            for word in shlex.split(line, comments=True)
+        ]
+    if not assignments:
+        typer.echo("Error: No settings given")
+        raise typer.Exit(1)
+
+    # Custom settings from the default config, and packs for other categories
+    keys = {a.partition("=")[0].strip() for a in assignments}
+    config_error = _register_custom_settings(keys)
+    known = {key.split(".")[0] for key in SETTINGS}
+    unknown = {key.split(".")[0] for key in keys} - known
+    if unknown:
+        plugins.load_categories(unknown)
+    if config_error and not keys <= SETTINGS.keys():
+        # One of the keys may be a custom setting the config failed to declare
+        typer.echo(f"Error: Cannot read custom settings from {CONFIG_PATH}: {config_error}")
+        raise typer.Exit(1)
+
+    try:
+        values = parse_assignments(assignments)
+    except ValueError as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(1)
+
+    if not dry_run:
+        from . import history
+        history.keep()
+
+    try:
+        diffs = apply_config(values, dry_run=dry_run)
+    except WriteError as e:
+        _echo_outcomes(e)
+        raise typer.Exit(1)
+    except defaults.DefaultsError as e:
+        typer.echo(f"Error: {e}", err=True)
+        raise typer.Exit(1)
+
+    _echo_changes(diffs, dry_run)
+
+
+@app.command()
+def plan(
+    output: str = typer.Option(None, "--output", "-o", help="Plan file path (default: stdout)"),
+    config_file: str = typer.Option(None, "--config", "-c", help="Path to config file"),
+):
+    """Save the changes 'mct apply' would make, to apply later with 'mct apply PLAN'."""
+    from . import plan as plans
+
+    config = _load_config_file(config_file)
+
+    if not config:
+        typer.echo(f"No config file found at {CONFIG_PATH}")
+        typer.echo("Run 'mct export' to create one from current settings")
+        raise typer.Exit(1)
+
+    flat_config = flatten_config(config)
+    valid_config = {k: v for k, v in flat_config.items() if k in SETTINGS}
+    file_config = {k: v for k, v in flat_config.items() if k in FILES}
+
+    saved = plans.make_plan(valid_config, file_config)
+    text = plans.dumps(saved)
+
+    if not output:
+        typer.echo(text)
+        return
+
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        f.write(text + "\n")
+
+    changes = [*saved.changes, *saved.file_changes]
+    for diff in changes:
+        _echo_change(diff)
+    if saved.restart:
+        typer.echo(f"Apps to restart: {', '.join(saved.restart)}")
+    typer.echo(f"Plan with {len(changes)} change(s) written to {output}")
+    typer.echo(f"Run 'mct apply {output}' to apply it")
 
 
 @app.command()
 def export(
     output: str = typer.Option(None, "--output", "-o", help="Output file path (default: stdout)"),
     save: bool = typer.Option(False, "--save", "-s", help=f"Save to {CONFIG_PATH}"),
+    include_all: bool = typer.Option(
+        False, "--all", "-a", help="Include settings the system keeps rewriting, e.g. dock.persistent_apps"
+    ),
 ):
     """Export current system settings to YAML."""
     import yaml
 
-    current_state = read_current_state()
+    current_state = read_current_state(k for k, s in SETTINGS.items() if include_all or not s.volatile)
     config = unflatten_config(current_state)
 
     yaml_output = yaml.dump(config, default_flow_style=False, sort_keys=False)
@@ -114,7 +547,6 @@ def export(
         save_config(config)
         typer.echo(f"Config saved to {CONFIG_PATH}")
     elif output:
-        from pathlib import Path
         Path(output).parent.mkdir(parents=True, exist_ok=True)
         with open(output, "w") as f:
             f.write(yaml_output)
@@ -125,20 +557,40 @@ def export(
 
 @app.command()
 def diff(
-    config_file: str = typer.Option(None, "--config", "-c", help="Path to config file"),
+    ctx: typer.Context,
+    config_files: list[str] = typer.Option(
+        None,
+        "--config",
+        "-c",
+        help="Path or http(s) URL of config file, or directory (repeat to compare profiles)",
+    ),
+    timeout: float = typer.Option(None, "--timeout", "-t", help="Give up after this many seconds overall"),
+    latency: bool = typer.Option(False, "--latency", help="Print per-operation latency percentiles"),
 ):
-    """Show differences between config file and current system state."""
-    if config_file:
-        from pathlib import Path
-        path = Path(config_file)
-        if not path.exists():
-            typer.echo(f"Error: Config file not found: {path}")
+    """Show differences between config file(s) and current system state."""
+    defaults.set_deadline(timeout)
+    if latency:
+        ctx.call_on_close(_echo_latency)
+
+    from . import remote
+
+    fetched = None
+    if any(remote.is_url(entry) for entry in config_files or []):
+        if len(config_files) > 1:
+            typer.echo("Error: Remote configs cannot be compared as profiles")
             raise typer.Exit(1)
-        import yaml
-        with open(path) as f:
-            config = yaml.safe_load(f) or {}
+        fetched = _fetch_remote(config_files[0])
+        if fetched.in_sync():
+            typer.echo("System is in sync with config (not modified)")
+            return
+        paths = []
     else:
-        config = load_config()
+        paths = _expand_config_paths(config_files or [])
+    if len(paths) > 1:
+        _diff_profiles(paths, timeout)
+        return
+
+    config = _load_config_file(str(paths[0]) if paths else None, fetched)
 
     if not config:
         typer.echo(f"No config file found at {CONFIG_PATH}")
@@ -147,30 +599,332 @@ def diff(
 
     flat_config = flatten_config(config)
     valid_config = {k: v for k, v in flat_config.items() if k in SETTINGS}
+    file_config = {k: v for k, v in flat_config.items() if k in FILES}
 
-    diffs = compute_diff(valid_config)
+    try:
+        diffs = [*compute_diff(valid_config), *compute_file_diffs(file_config)]
+    except defaults.DeadlineExceeded as e:
+        _echo_deadline(e, timeout)
+        raise typer.Exit(1)
 
     if not diffs:
+        if fetched is not None:
+            _mark_synced(fetched, {**valid_config, **file_config})
         typer.echo("System is in sync with config")
         return
 
     typer.echo(f"Found {len(diffs)} difference(s):\n")
     for d in diffs:
-        current = d.current if d.current is not None else "(not set)"
         typer.echo(f"  {d.key}:")
-        typer.echo(f"    current: {current}")
-        typer.echo(f"    config:  {d.desired}")
+        changes = diff_value(d.current, d.desired)
+        if changes is not None:
+            for change in changes:
+                typer.echo(f"    {describe(change)}")
+        else:
+            current = d.current if d.current is not None else "(not set)"
+            typer.echo(f"    current: {current}")
+            typer.echo(f"    config:  {d.desired}")
         typer.echo()
 
 
+def _expand_config_paths(config_files: list[str]) -> list[Path]:
+    """Resolve --config arguments to config files, expanding directories."""
+    paths: list[Path] = []
+    for entry in config_files:
+        path = Path(entry)
+        if path.is_dir():
+            found = sorted(p for p in path.iterdir() if p.suffix in (".yaml", ".yml"))
+            if not found:
+                typer.echo(f"Error: No .yaml files found in {path}")
+                raise typer.Exit(1)
+            paths.extend(found)
+        elif not path.exists():
+            typer.echo(f"Error: Config file not found: {path}")
+            raise typer.Exit(1)
+        else:
+            paths.append(path)
+    return paths
+
+
+def _diff_profiles(paths: list[Path], timeout: float | None = None) -> None:
+    """Compare several profiles against a single read of the system state."""
+    profiles: dict[str, dict] = {}
+    for path in paths:
+        name = path.stem if path.stem not in profiles else str(path)
+        flat_config = flatten_config(_load_config_file(str(path)))
+        profiles[name] = {k: v for k, v in flat_config.items() if k in SETTINGS or k in FILES}
+
+    needed = sorted(set().union(*profiles.values()))
+    try:
+        current_state = read_current_state([k for k in needed if k in SETTINGS])
+        violations = {
+            name: {
+                d.key
+                for d in [
+                    *compute_diff({k: v for k, v in profile.items() if k in SETTINGS}, current_state),
+                    *compute_file_diffs({k: v for k, v in profile.items() if k in FILES}),
+                ]
+            }
+            for name, profile in profiles.items()
+        }
+    except defaults.DeadlineExceeded as e:
+        _echo_deadline(e, timeout)
+        raise typer.Exit(1)
+
+    key_width = max([len("setting"), *(len(k) for k in needed)])
+    widths = {name: len(name) for name in profiles}
+    header = "  ".join(name.ljust(widths[name]) for name in profiles)
+    typer.echo(f"{'setting'.ljust(key_width)}  {header}".rstrip())
+    for key in needed:
+        cells = []
+        for name, profile in profiles.items():
+            if key not in profile:
+                cell = "-"
+            elif key in violations[name]:
+                cell = "✗"
+            else:
+                cell = "✓"
+            cells.append(cell.ljust(widths[name]))
+        typer.echo(f"{key.ljust(key_width)}  {'  '.join(cells)}".rstrip())
+
+    typer.echo()
+    for name, profile in profiles.items():
+        typer.echo(f"{name}: {len(violations[name])} of {len(profile)} setting(s) differ")
+
+    # Fewest violations wins; ties go to the profile that pins more settings
+    best = min(profiles, key=lambda name: (len(violations[name]), -len(profiles[name])))
+    typer.echo(f"\nBest match: {best}")
+
+
+@app.command()
+def metrics(
+    textfile: str = typer.Option(..., "--textfile", "-t", help="Path of the .prom file to write"),
+    config_file: str = typer.Option(None, "--config", "-c", help="Path to config file"),
+):
+    """Write Prometheus metrics for drift and apply cost to a textfile."""
+    from . import metrics as prom
+
+    config = _load_config_file(config_file)
+    if not config:
+        typer.echo(f"No config file found at {CONFIG_PATH}")
+        raise typer.Exit(1)
+
+    flat_config = flatten_config(config)
+    valid_config = {k: v for k, v in flat_config.items() if k in SETTINGS}
+
+    spawned = defaults.stats["subprocesses"]
+    try:
+        diffs = compute_diff(valid_config)
+    except defaults.DefaultsError as e:
+        # Leave the previous textfile alone; its age shows the scrape failed
+        typer.echo(f"Error: {e}", err=True)
+        raise typer.Exit(1)
+    text = prom.render(
+        valid_config,
+        diffs,
+        prom.load_last_apply(),
+        subprocesses=defaults.stats["subprocesses"] - spawned,
+    )
+    try:
+        prom.write_textfile(Path(textfile), text)
+    except OSError as e:
+        typer.echo(f"Error: Failed to write {textfile}: {e}", err=True)
+        raise typer.Exit(1)
+    typer.echo(f"Metrics written to {textfile}")
+
+
+@app.command()
+def index():
+    """Index every preference domain on the machine for 'mct search'."""
+    from . import prefindex
+
+    try:
+        stats = prefindex.refresh()
+    except defaults.DefaultsError as e:
+        typer.echo(f"Error: {e}", err=True)
+        raise typer.Exit(1)
+    typer.echo(
+        f"Indexed {stats.keys} key(s) in {stats.domains} domain(s) "
+        f"({stats.updated} updated, {stats.removed} removed) in {stats.duration:.2f}s"
+    )
+
+
+@app.command()
+def search(
+    term: str = typer.Argument(..., help="Text to find in domain names, keys or values"),
+    domain: str = typer.Option(None, "--domain", "-d", help="Only search this domain"),
+    limit: int = typer.Option(100, "--limit", "-l", help="Maximum number of results"),
+    as_custom: bool = typer.Option(
+        False, "--as-custom", help="Print unmanaged results as a config 'custom:' section"
+    ),
+):
+    """Search the preference index built by 'mct index'."""
+    from . import prefindex
+
+    if not prefindex.exists():
+        typer.echo("No index yet, building it (run 'mct index' to refresh it later)...")
+        index()
+
+    entries = prefindex.search(term, domain=domain, limit=limit)
+    if not entries:
+        typer.echo(f"No keys matching '{term}'")
+        return
+
+    managed = {(s.domain, s.key): config_key for config_key, s in SETTINGS.items()}
+    if as_custom:
+        import yaml
+
+        custom = {
+            f"{e.domain.split('.')[-1].lower()}.{e.key.replace('.', '_')}": {
+                "domain": e.domain,
+                "key": e.key,
+                "type": e.type,
+            }
+            for e in entries
+            if (e.domain, e.key) not in managed and e.type in VALUE_TYPES
+        }
+        typer.echo(yaml.dump({CUSTOM_SECTION: custom}, default_flow_style=False, sort_keys=False))
+        return
+
+    for e in entries:
+        config_key = managed.get((e.domain, e.key))
+        suffix = f"  [{config_key}]" if config_key else ""
+        typer.echo(f"{e.domain}  {e.key} ({e.type}) = {e.value}{suffix}")
+    if len(entries) == limit:
+        typer.echo(f"\n(showing the first {limit} results; use --limit for more)")
+
+
+@app.command("history")
+def show_history(
+    since: str = typer.Option(None, "--since", "-s", help="Only runs since e.g. '2h', '7d' or '2024-05-01'"),
+    until: str = typer.Option(None, "--until", "-u", help="Only runs before this time"),
+    key: str = typer.Option(None, "--key", "-k", help="Only changes to this key, e.g. 'dock.*'"),
+    limit: int = typer.Option(20, "--limit", "-n", help="Maximum number of runs"),
+):
+    """Show recent changes made by mct, with their cost."""
+    from datetime import datetime
+
+    from . import history
+
+    try:
+        start = history.parse_time(since) if since else None
+        end = history.parse_time(until) if until else None
+    except ValueError as e:
+        typer.echo(f"Error: {e}")
+        raise typer.Exit(1)
+
+    runs = history.query(since=start, until=end, key=key, limit=limit)
+    if not runs:
+        typer.echo("No matching history")
+        return
+
+    for run in runs:
+        when = datetime.fromtimestamp(run.timestamp).strftime("%Y-%m-%d %H:%M:%S")
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in sorted(run.phases.items()))
+        typer.echo(f"{when}  {run.command}")
+        typer.echo(
+            f"  {len(run.changes)} change(s), {run.subprocesses} subprocess(es), "
+            f"{run.restarts} restart(s), {run.duration:.2f}s" + (f" ({phases})" if phases else "")
+        )
+        for change in run.changes:
+            if change.old is defaults.MISSING:
+                old = "(unknown)"
+            else:
+                old = change.old if change.old is not None else "(not set)"
+            new = change.new if change.new is not None else "(deleted)"
+            typer.echo(f"    {change.key}: {old} -> {new}")
+
+
+def _load_profiles() -> dict[str, dict]:
+    from . import profiles
+
+    found = profiles.list_profiles()
+    if not found:
+        typer.echo(f"No profiles found in {profiles.PROFILES_DIR}")
+        typer.echo("Save configs there as <name>.yaml, e.g. presenting.yaml")
+        raise typer.Exit(1)
+    return {name: flatten_config(_load_config_file(str(path))) for name, path in found.items()}
+
+
+@profile_app.command("list")
+def list_profiles():
+    """List profiles, marking the active one."""
+    from . import profiles
+
+    found = profiles.list_profiles()
+    if not found:
+        typer.echo(f"No profiles found in {profiles.PROFILES_DIR}")
+        return
+    active = profiles.load_state().get("active")
+    for name, path in found.items():
+        marker = "*" if name == active else " "
+        typer.echo(f"{marker} {name}  ({path})")
+
+
+@profile_app.command()
+def switch(
+    name: str = typer.Argument(..., help="Profile to switch to"),
+    dry_run: bool = typer.Option(False, "--dry-run", "-n", help="Show what would change without applying"),
+):
+    """Switch to a profile, writing only the settings that differ from the active one."""
+    from . import profiles
+
+    configs = _load_profiles()
+    if name not in configs:
+        typer.echo(f"Error: Unknown profile '{name}'; available: {', '.join(configs)}")
+        raise typer.Exit(1)
+
+    if not dry_run:
+        from . import history
+        history.keep()
+
+    target = configs[name]
+    file_config = {k: v for k, v in target.items() if k in FILES}
+    try:
+        result = profiles.switch(name, configs, dry_run=dry_run)
+        file_diffs = compute_file_diffs(file_config)
+        if not dry_run:
+            apply_file_diffs(file_diffs)
+    except (defaults.DefaultsError, PermissionError) as e:
+        typer.echo(f"Error: {e}", err=True)
+        raise typer.Exit(1)
+
+    _echo_changes([*result.changes, *file_diffs], dry_run)
+    if result.restart:
+        if dry_run:
+            verb = "Would restart"
+        else:
+            verb = "Queued restart" if defaults.restarts_deferred() else "Restarted"
+        typer.echo(f"{verb}: {', '.join(result.restart)}")
+    if not dry_run:
+        typer.echo(f"Switched to profile '{name}'" + (f" from '{result.previous}'" if result.previous else ""))
+
+
+@app.command("restart-pending")
+def restart_pending():
+    """Restart each app queued by --no-restart or MCT_DEFER_RESTART, once."""
+    try:
+        restarted = defaults.restart_pending()
+    except defaults.DefaultsError as e:
+        typer.echo(f"Error: {e}", err=True)
+        raise typer.Exit(1)
+
+    if not restarted:
+        typer.echo("No restarts pending")
+        return
+    typer.echo(f"Restarted: {', '.join(restarted)}")
+
+
 @app.command()
 def settings():
     """List all available settings."""
+    plugins.load_all()
     typer.echo("Available settings:\n")
 
     # Group by category
+    registry = {**SETTINGS, **FILES}
     categories: dict[str, list[str]] = {}
-    for key in sorted(SETTINGS.keys()):
+    for key in sorted(registry.keys()):
         category = key.split(".")[0]
         if category not in categories:
             categories[category] = []
@@ -179,7 +933,7 @@ def settings():
     for category, keys in categories.items():
         typer.echo(f"{category}:")
         for key in keys:
-            setting = SETTINGS[key]
+            setting = registry[key]
             typer.echo(f"  {key}: {setting.description}")
         typer.echo()
 
@@ -217,6 +971,14 @@ def init():
 
 
 def main():
+    from . import completion
+
+    if completion.load() is None:
+        # Rebuilding the completion cache needs every pack's sub-command
+        plugins.mount(app, None)
+        completion.ensure_cache(app)
+    else:
+        plugins.mount(app, sys.argv[1:])
     app()
 
 
@@ -1,136 +1,126 @@
 import subprocess
+from pathlib import Path
+
 import typer
 
+from .. import privileged, sysfiles
+from ..privileged import PAM_BACKUP
+
+TOUCHID_KEY = "system.touchid_sudo"
+
 system_app = typer.Typer()
 
 
 def print_file_contents(file_path):
     """Print the contents of a file."""
     try:
-        result = subprocess.run(
-            ["sudo", "cat", file_path],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-        typer.echo("\nFile contents:")
-        typer.echo("=" * 50)
-        typer.echo(result.stdout)
-        typer.echo("=" * 50)
-    except subprocess.CalledProcessError as e:
-        typer.echo(f"Error reading file: {e}", err=True)
-
-
-@system_app.command()
-def touchid():
-    """Enable Touch ID authentication for sudo commands."""
-    try:
-        # Show initial warning and get confirmation
-        typer.echo("\n⚠️  This operation will:")
-        typer.echo("  1. Check if Touch ID is already enabled")
-        typer.echo(
-            "  2. Add a new authentication line to /etc/pam.d/sudo if needed"
-        )
-        typer.echo("  3. Create or update a backup of the original file")
-        typer.echo("  4. Require sudo privileges to make these changes")
-
-        if not typer.confirm("\nDo you want to proceed?", default=False):
-            typer.echo("Operation cancelled")
+        contents = Path(file_path).read_text()
+    except PermissionError:
+        try:
+            contents = subprocess.run(
+                ["sudo", "cat", file_path],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+        except subprocess.CalledProcessError as e:
+            typer.echo(f"Error reading file: {e}", err=True)
             return
+    except OSError as e:
+        typer.echo(f"Error reading file: {e}", err=True)
+        return
 
-        # Check if the line already exists
-        result = subprocess.run(
-            ["grep", "auth sufficient pam_tid.so", "/etc/pam.d/sudo"],
-            capture_output=True,
-            text=True,
-        )
+    typer.echo("\nFile contents:")
+    typer.echo("=" * 50)
+    typer.echo(contents)
+    typer.echo("=" * 50)
 
-        if result.returncode == 0:
-            typer.echo("Touch ID for sudo is already enabled")
-            return
 
-        # Check if backup exists
-        backup_exists = (
-            subprocess.run(
-                ["test", "-f", "/etc/pam.d/sudo.bak"],
-                capture_output=True,
-            ).returncode
-            == 0
-        )
+def touchid_enabled() -> bool:
+    """Check the sudo PAM file for Touch ID without elevating."""
+    try:
+        return not sysfiles.compute_file_diffs({TOUCHID_KEY: True})
+    except OSError:
+        return False
 
-        if backup_exists:
-            while True:
-                typer.echo(
-                    "\n⚠️  A backup file already exists at /etc/pam.d/sudo.bak"
-                )
-                typer.echo("\nPlease choose an option:")
-                typer.echo("0 - Do nothing and exit")
-                typer.echo("1 - View the backup file contents")
-                typer.echo("2 - Continue (will replace existing backup)")
-                typer.echo("3 - Restore backup and then enable Touch ID")
-
-                choice = typer.prompt(
-                    "\nEnter your choice (0-3)", type=int, default=0
-                )
 
-                if choice == 0:
-                    typer.echo("Operation cancelled")
-                    return
-                elif choice == 1:
-                    print_file_contents("/etc/pam.d/sudo.bak")
-                    continue
-                elif choice == 2:
-                    # Create a new backup of the current file
-                    subprocess.run(
-                        [
-                            "sudo",
-                            "cp",
-                            "/etc/pam.d/sudo",
-                            "/etc/pam.d/sudo.bak",
-                        ],
-                        check=True,
-                    )
-                    break
-                elif choice == 3:
-                    # Restore backup first
-                    subprocess.run(
-                        [
-                            "sudo",
-                            "cp",
-                            "/etc/pam.d/sudo.bak",
-                            "/etc/pam.d/sudo",
-                        ],
-                        check=True,
-                    )
-                    typer.echo("✓ Original sudo PAM file has been restored")
-                    break
-                else:
-                    typer.echo("Invalid choice, please try again")
-                    continue
-        else:
-            # Create a backup of the original file
-            subprocess.run(
-                ["sudo", "cp", "/etc/pam.d/sudo", "/etc/pam.d/sudo.bak"],
-                check=True,
+@system_app.command()
+def touchid():
+    """Enable Touch ID authentication for sudo commands."""
+    # Show initial warning and get confirmation
+    typer.echo("\n⚠️  This operation will:")
+    typer.echo("  1. Check if Touch ID is already enabled")
+    typer.echo(
+        "  2. Add a new authentication line to /etc/pam.d/sudo if needed"
+    )
+    typer.echo("  3. Create or update a backup of the original file")
+    typer.echo("  4. Require sudo privileges to make these changes")
+
+    if not typer.confirm("\nDo you want to proceed?", default=False):
+        typer.echo("Operation cancelled")
+        return
+
+    # The PAM file is world-readable, so checks happen before elevating
+    if touchid_enabled():
+        typer.echo("Touch ID for sudo is already enabled")
+        return
+
+    # Back up the current file unless the user picks the existing backup
+    backup = "save"
+
+    if Path(PAM_BACKUP).exists():
+        while True:
+            typer.echo(
+                f"\n⚠️  A backup file already exists at {PAM_BACKUP}"
+            )
+            typer.echo("\nPlease choose an option:")
+            typer.echo("0 - Do nothing and exit")
+            typer.echo("1 - View the backup file contents")
+            typer.echo("2 - Continue (will replace existing backup)")
+            typer.echo("3 - Restore backup and then enable Touch ID")
+
+            choice = typer.prompt(
+                "\nEnter your choice (0-3)", type=int, default=0
             )
 
-        # Add the line at the top of the sudo PAM file using a temporary file
-        subprocess.run(
-            [
-                "sudo",
-                "sh",
-                "-c",
-                'echo "auth sufficient pam_tid.so" | cat - /etc/pam.d/sudo > /tmp/sudo.pam && sudo mv /tmp/sudo.pam /etc/pam.d/sudo',
-            ],
-            check=True,
-        )
-        typer.echo("✓ Touch ID for sudo has been enabled")
-        typer.echo("✓ Original file backed up as /etc/pam.d/sudo.bak")
-
-    except subprocess.CalledProcessError as e:
+            if choice == 0:
+                typer.echo("Operation cancelled")
+                return
+            elif choice == 1:
+                print_file_contents(PAM_BACKUP)
+                continue
+            elif choice == 2:
+                backup = "save"
+                break
+            elif choice == 3:
+                backup = "restore"
+                break
+            else:
+                typer.echo("Invalid choice, please try again")
+                continue
+
+    if backup == "restore":
+        result = privileged.run("restore-backup")
+        if not result.ok:
+            typer.echo(f"Error enabling Touch ID for sudo: {result.message}", err=True)
+            raise typer.Exit(1)
+        typer.echo("✓ Original sudo PAM file has been restored")
+
+    # The backup, edit and verification run in a single sudo invocation
+    try:
+        diffs = sysfiles.compute_file_diffs({TOUCHID_KEY: True})
+        sysfiles.apply_file_diffs(diffs, backup=backup == "save")
+    except OSError as e:
         typer.echo(f"Error enabling Touch ID for sudo: {e}", err=True)
         raise typer.Exit(1)
 
+    if not diffs:
+        typer.echo("Touch ID for sudo is already enabled")
+        return
+    typer.echo("✓ Touch ID for sudo has been enabled")
+    if backup == "save" and diffs[0].existed:
+        typer.echo(f"✓ Original file backed up as {PAM_BACKUP}")
+
 
 @system_app.command()
 def reset(
@@ -146,93 +136,56 @@ def reset(
         typer.echo("Error: Must specify either -t (touchid) or -a (all)")
         raise typer.Exit(1)
 
-    try:
-        if touchid or all:
-            # Show warning and get confirmation first
-            typer.echo("\n⚠️  This operation will:")
-            typer.echo("  1. Remove Touch ID authentication from sudo")
-            typer.echo("  2. Require sudo privileges to make these changes")
-
-            if not typer.confirm("\nDo you want to proceed?", default=False):
-                typer.echo("Operation cancelled")
-                return
-
-            # Check if Touch ID is enabled
-            result = subprocess.run(
-                ["grep", "auth sufficient pam_tid.so", "/etc/pam.d/sudo"],
-                capture_output=True,
-                text=True,
-            )
-
-            if result.returncode != 0:
-                typer.echo("Touch ID is not enabled in sudo configuration")
-                return
+    if touchid or all:
+        # Show warning and get confirmation first
+        typer.echo("\n⚠️  This operation will:")
+        typer.echo("  1. Remove Touch ID authentication from sudo")
+        typer.echo("  2. Require sudo privileges to make these changes")
 
-            while True:
-                typer.echo("\nPlease choose an option:")
-                typer.echo("0 - Do nothing and exit")
-                typer.echo("1 - View the backup file contents")
-                typer.echo("2 - Restore from stored backup")
+        if not typer.confirm("\nDo you want to proceed?", default=False):
+            typer.echo("Operation cancelled")
+            return
 
-                choice = typer.prompt(
-                    "\nEnter your choice (0-2)", type=int, default=0
-                )
+        # Check if Touch ID is enabled
+        if not touchid_enabled():
+            typer.echo("Touch ID is not enabled in sudo configuration")
+            return
 
-                if choice == 0:
-                    typer.echo("Operation cancelled")
-                    return
-                elif choice == 1:
-                    # Check if backup exists
-                    result = subprocess.run(
-                        ["test", "-f", "/etc/pam.d/sudo.bak"],
-                        capture_output=True,
-                        text=True,
-                    )
+        while True:
+            typer.echo("\nPlease choose an option:")
+            typer.echo("0 - Do nothing and exit")
+            typer.echo("1 - View the backup file contents")
+            typer.echo("2 - Restore from stored backup")
 
-                    if result.returncode != 0:
-                        typer.echo(
-                            "No backup file found at /etc/pam.d/sudo.bak"
-                        )
-                        return
-
-                    print_file_contents("/etc/pam.d/sudo.bak")
-                    continue
-                elif choice == 2:
-                    # Check if backup exists
-                    result = subprocess.run(
-                        ["test", "-f", "/etc/pam.d/sudo.bak"],
-                        capture_output=True,
-                        text=True,
-                    )
+            choice = typer.prompt(
+                "\nEnter your choice (0-2)", type=int, default=0
+            )
 
-                    if result.returncode != 0:
-                        typer.echo(
-                            "No backup file found at /etc/pam.d/sudo.bak"
-                        )
-                        return
-
-                    # Restore the backup file
-                    subprocess.run(
-                        [
-                            "sudo",
-                            "cp",
-                            "/etc/pam.d/sudo.bak",
-                            "/etc/pam.d/sudo",
-                        ],
-                        check=True,
-                    )
+            if choice == 0:
+                typer.echo("Operation cancelled")
+                return
+            elif choice in (1, 2) and not Path(PAM_BACKUP).exists():
+                typer.echo(f"No backup file found at {PAM_BACKUP}")
+                return
+            elif choice == 1:
+                print_file_contents(PAM_BACKUP)
+                continue
+            elif choice == 2:
+                # Restore and verify in a single sudo invocation
+                result = privileged.run("restore-backup")
+                if not result.ok:
                     typer.echo(
-                        "✓ Touch ID sudo configuration has been reset from backup"
+                        f"Error resetting system settings: {result.message}", err=True
                     )
-                    break
-                else:
-                    typer.echo("Invalid choice, please try again")
-                    continue
-
-        if all:
-            # Add more system settings here as they are implemented
-            pass
-
-    except subprocess.CalledProcessError as e:
-        typer.echo(f"Error resetting system settings: {e}", err=True)
-        raise typer.Exit(1)
+                    raise typer.Exit(1)
+                typer.echo(
+                    "✓ Touch ID sudo configuration has been reset from backup"
+                )
+                break
+            else:
+                typer.echo("Invalid choice, please try again")
+                continue
+
+    if all:
+        # Add more system settings here as they are implemented
+        pass
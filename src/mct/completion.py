@@ -0,0 +1,318 @@
+"""Cached shell completion that avoids importing the full CLI.
+
+Completion data for the command tree, setting keys and their values is built
+once from the Typer app and written to a cache file. Completion requests are
+then answered from that file, without importing typer, yaml or the command
+modules. Keep the module-level imports here to the standard library.
+"""
+
+import json
+import os
+import shlex
+import sys
+
+# os.path rather than pathlib, and no typing import: both are measurable
+# on a path that runs on every keypress
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "mct", "completion.json")
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Help text the category commands use for on/off arguments
+BOOL_ARGUMENT_HELP = "on/off"
+
+
+def fingerprint() -> list[list]:
+    """Identify the installed mct sources and packages, so changes invalidate the cache.
+
+    The sys.path directories cover installed settings packs; see plugins.fingerprint().
+    """
+    entries = []
+    for directory in (PACKAGE_DIR, os.path.join(PACKAGE_DIR, "commands")):
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.endswith(".py"):
+                    st = entry.stat()
+                    entries.append([entry.path, st.st_mtime_ns, st.st_size])
+    for path in sys.path:
+        try:
+            entries.append([path, os.stat(path or ".").st_mtime_ns, 0])
+        except OSError:
+            continue
+    return sorted(entries)
+
+
+def _argument_values() -> dict[str, list[str]]:
+    """Values offered for positional arguments, by command path."""
+    from .commands import dock, finder, keyboard, screenshot
+
+    values = {
+        "dock position": list(dock.POSITIONS),
+        "finder view": list(finder.VIEW_STYLES),
+        "screenshot format": list(screenshot.FORMATS),
+    }
+    for name, module in (
+        ("dock", dock),
+        ("finder", finder),
+        ("keyboard", keyboard),
+        ("screenshot", screenshot),
+    ):
+        values[f"{name} reset"] = list(module.SETTINGS_MAP)
+    return values
+
+
+def _setting_values() -> dict[str, dict]:
+    """Value type and known values for each registry setting."""
+    from .commands import dock, finder, screenshot
+    from .config import SETTINGS
+
+    known = {
+        "dock.orientation": list(dock.POSITIONS),
+        "finder.default_view": list(finder.VIEW_STYLES.values()),
+        "screenshot.format": list(screenshot.FORMATS),
+    }
+    result = {}
+    for key, setting in SETTINGS.items():
+        values = known.get(key, ["true", "false"] if setting.value_type == "bool" else [])
+        result[key] = {
+            "type": setting.value_type,
+            "values": values,
+            "help": setting.description,
+        }
+    return result
+
+
+def build(app) -> dict:
+    """Build completion data from the Typer app."""
+    import typer
+
+    argument_values = _argument_values()
+    commands: dict[str, dict] = {}
+
+    # Duck-typed so this works with click and with Typer's vendored copy of it
+    def walk(command, path: str) -> None:
+        node: dict = {"options": {}, "arguments": [], "children": {}}
+        for param in command.params:
+            if param.param_type_name == "option":
+                if param.hidden:
+                    continue
+                takes_value = not param.is_flag and not param.count
+                for opt in [*param.opts, *param.secondary_opts]:
+                    node["options"][opt] = {"help": param.help or "", "value": takes_value}
+            elif param.param_type_name == "argument":
+                choices = getattr(param.type, "choices", None)
+                if choices:
+                    values = [str(c) for c in choices]
+                elif param.name and getattr(param, "help", None) == BOOL_ARGUMENT_HELP:
+                    values = ["on", "off"]
+                else:
+                    values = argument_values.get(path, [])
+                node["arguments"].append(values)
+        node["options"]["--help"] = {"help": "Show this message and exit.", "value": False}
+
+        if hasattr(command, "commands"):
+            for name, sub in command.commands.items():
+                if sub.hidden:
+                    continue
+                node["children"][name] = sub.get_short_help_str(limit=150)
+                walk(sub, f"{path} {name}".strip())
+        commands[path] = node
+
+    walk(typer.main.get_command(app), "")
+    return {
+        "fingerprint": fingerprint(),
+        "commands": commands,
+        "settings": _setting_values(),
+    }
+
+
+def save(data: dict) -> None:
+    """Write the cache atomically so concurrent shells never see a partial file."""
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    tmp = f"{CACHE_PATH}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp, CACHE_PATH)
+
+
+def load() -> dict | None:
+    """Load the cache, or None if it is missing or out of date."""
+    try:
+        with open(CACHE_PATH) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("fingerprint") != fingerprint():
+        return None
+    return data
+
+
+def ensure_cache(app) -> dict:
+    """Return current completion data, rebuilding the cache if needed."""
+    data = load()
+    if data is None:
+        data = build(app)
+        try:
+            save(data)
+        except OSError:
+            pass
+    return data
+
+
+def complete(data: dict, args: list[str], incomplete: str) -> list[tuple[str, str]]:
+    """Return (value, help) completions for the incomplete word."""
+    commands = data["commands"]
+    path = ""
+    positional = 0
+    expecting_value = False
+
+    for arg in args:
+        node = commands[path]
+        if expecting_value:
+            expecting_value = False
+        elif arg.startswith("-"):
+            option = node["options"].get(arg.partition("=")[0])
+            expecting_value = bool(option and option["value"] and "=" not in arg)
+        elif arg in node["children"]:
+            path = f"{path} {arg}".strip()
+            positional = 0
+        else:
+            positional += 1
+
+    node = commands[path]
+    if expecting_value:
+        return []
+    if incomplete.startswith("-"):
+        return [(opt, info["help"]) for opt, info in node["options"].items() if opt.startswith(incomplete)]
+    if node["children"]:
+        return [(name, help_text) for name, help_text in node["children"].items() if name.startswith(incomplete)]
+    if path == "set":
+        return _complete_assignment(data["settings"], incomplete)
+    if positional < len(node["arguments"]):
+        return [(value, "") for value in node["arguments"][positional] if value.startswith(incomplete)]
+    return []
+
+
+def _complete_assignment(settings: dict, incomplete: str) -> list[tuple[str, str]]:
+    """Complete 'key=' from the setting keys, then 'key=value' from its known values."""
+    key, sep, value = incomplete.partition("=")
+    if not sep:
+        return [(f"{k}=", info["help"]) for k, info in settings.items() if k.startswith(key)]
+    info = settings.get(key)
+    if info is None:
+        return []
+    return [(f"{key}={v}", "") for v in info["values"] if v.startswith(value)]
+
+
+def _split(line: str) -> list[str]:
+    try:
+        return shlex.split(line)
+    except ValueError:
+        return line.split()
+
+
+def _join_assignments(words: list[str], cword: int) -> tuple[list[str], int]:
+    """Undo bash splitting 'key=value' into 'key', '=', 'value' words.
+
+    '=' is in COMP_WORDBREAKS, so bash hands over the pieces as separate
+    words. Returns the rejoined words and the index of the current one.
+    """
+    joined: list[str] = []
+    current = None
+    glue = False
+    for i, word in enumerate(words):
+        if word == "=" and i > 1:
+            joined[-1] += word
+            glue = True
+        elif glue:
+            joined[-1] += word
+            glue = False
+        else:
+            joined.append(word)
+        if i == cword:
+            current = len(joined) - 1
+    return joined, len(joined) if current is None else current
+
+
+def _completion_args(shell: str) -> tuple[list[str], str]:
+    """Read the words being completed the same way Typer's shell classes do."""
+    if shell == "bash":
+        words = _split(os.environ.get("COMP_WORDS", ""))
+        cword = int(os.environ.get("COMP_CWORD", "0"))
+        words, cword = _join_assignments(words, cword)
+        return words[1:cword], words[cword] if cword < len(words) else ""
+
+    line = os.environ.get("_TYPER_COMPLETE_ARGS", "")
+    words = _split(line)
+    if shell in ("powershell", "pwsh"):
+        incomplete = os.environ.get("_TYPER_COMPLETE_WORD_TO_COMPLETE", "")
+        return (words[1:-1] if incomplete else words[1:]), incomplete
+    args = words[1:]
+    if args and not line.endswith(" "):
+        return args[:-1], args[-1]
+    return args, ""
+
+
+def _format(shell: str, items: list[tuple[str, str]]) -> str:
+    if shell == "zsh":
+        if not items:
+            return "_files"
+
+        def escape(s: str) -> str:
+            return (
+                s.replace('"', '""')
+                .replace("'", "''")
+                .replace("$", "\\$")
+                .replace("`", "\\`")
+                .replace(":", r"\\:")
+            )
+
+        lines = [
+            f'"{escape(value)}":"{escape(help_text)}"' if help_text else f'"{escape(value)}"'
+            for value, help_text in items
+        ]
+        return "_arguments '*: :((" + "\n".join(lines) + "))'"
+    if shell == "fish":
+        return "\n".join(
+            f"{value}\t{' '.join(help_text.split())}" if help_text else value
+            for value, help_text in items
+        )
+    if shell in ("powershell", "pwsh"):
+        return "\n".join(f"{value}:::{help_text or ' '}" for value, help_text in items)
+    return "\n".join(value for value, _ in items)
+
+
+def serve(instruction: str) -> bool:
+    """Answer a completion request from the cache.
+
+    Args:
+        instruction: Value of _MCT_COMPLETE, e.g. 'complete_zsh'
+
+    Returns:
+        False if the request is not a completion request (e.g. 'source_bash')
+        and should be handled by Typer instead
+    """
+    action, _, shell = instruction.partition("_")
+    if action != "complete":
+        return False
+
+    data = load()
+    if data is None:
+        from . import plugins
+        from .cli import app
+
+        plugins.mount(app, None)
+        data = ensure_cache(app)
+
+    args, incomplete = _completion_args(shell)
+    items = complete(data, args, incomplete)
+    if shell == "bash" and "=" in incomplete:
+        # Bash only replaces the text after the last '=', like
+        # __ltrim_colon_completions does for ':'
+        prefix = incomplete[: incomplete.rindex("=") + 1]
+        items = [(value[len(prefix):], help_text) for value, help_text in items if value.startswith(prefix)]
+    if shell == "fish" and os.environ.get("_TYPER_COMPLETE_FISH_ACTION") == "is-args":
+        sys.exit(0 if items else 1)
+
+    output = _format(shell, items)
+    if output:
+        sys.stdout.write(output + "\n")
+    return True
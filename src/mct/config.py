@@ -1,5 +1,8 @@
 """Configuration management for declarative macOS settings."""
 
+import math
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any
@@ -7,9 +10,20 @@ from typing import Any
 import yaml
 
 from . import defaults
+from .defaults import FALSE_STRINGS, TRUE_STRINGS
 
 
 CONFIG_PATH = Path.home() / ".config" / "mct" / "config.yaml"
+STATE_DIR = Path.home() / ".local" / "state" / "mct"
+
+# Top-level config section declaring user-defined settings
+CUSTOM_SECTION = "custom"
+VALUE_TYPES = ("bool", "int", "float", "string", "array", "dict")
+
+# Float settings that round-trip through `defaults` can change in the last
+# digits, so they are compared with a tolerance
+FLOAT_REL_TOL = 1e-6
+FLOAT_ABS_TOL = 1e-9
 
 
 @dataclass
@@ -18,9 +32,12 @@ class Setting:
 
     domain: str
     key: str
-    value_type: str  # 'bool', 'int', 'float', 'string'
+    value_type: str  # 'bool', 'int', 'float', 'string', 'array', 'dict'
     restart_app: str | None = None  # App to restart after changing
     description: str = ""
+    # The system rewrites parts of the value on its own (ids, timestamps), so
+    # `mct export` leaves it out unless asked to
+    volatile: bool = False
 
 
 # Registry of all supported settings
@@ -90,6 +107,14 @@ SETTINGS: dict[str, Setting] = {
         restart_app="Dock",
         description="Show recent applications in Dock",
     ),
+    "dock.persistent_apps": Setting(
+        domain="com.apple.dock",
+        key="persistent-apps",
+        value_type="array",
+        restart_app="Dock",
+        description="Apps pinned to the Dock, in order",
+        volatile=True,
+    ),
     "dock.static_only": Setting(
         domain="com.apple.dock",
         key="static-only",
@@ -292,6 +317,35 @@ class ConfigDiff:
     setting: Setting
 
 
+@dataclass
+class WriteOutcome:
+    """What happened to one diff in write_diffs()."""
+
+    diff: ConfigDiff
+    written: bool = False
+    error: str | None = None  # Why the write failed, or was not attempted
+
+
+class WriteError(defaults.DefaultsError):
+    """Writes to some domains failed; other domains were still written.
+
+    Attributes:
+        outcomes: The outcome of every diff, in write order
+    """
+
+    def __init__(self, outcomes: list[WriteOutcome]):
+        failed = [o for o in outcomes if not o.written]
+        super().__init__(
+            f"Failed to write {len(failed)} of {len(outcomes)} setting(s): "
+            + "; ".join(f"{o.diff.key} ({o.error})" for o in failed)
+        )
+        self.outcomes = outcomes
+
+    @property
+    def applied(self) -> list[ConfigDiff]:
+        return [o.diff for o in self.outcomes if o.written]
+
+
 def load_config() -> dict[str, Any]:
     """Load configuration from YAML file.
 
@@ -312,15 +366,67 @@ def save_config(config: dict[str, Any]) -> None:
         yaml.dump(config, f, default_flow_style=False, sort_keys=False)
 
 
+# Config keys registered through register_settings()
+_custom_keys: set[str] = set()
+
+
+def parse_custom_settings(section: dict[str, Any]) -> dict[str, Setting]:
+    """Parse the `custom:` config section into Setting entries.
+
+    Example:
+        custom:
+          iterm.prompt_on_quit:
+            domain: com.googlecode.iterm2
+            key: PromptOnQuit
+            type: bool
+            restart_app: iTerm2
+
+    Raises:
+        ValueError: If an entry is malformed or shadows a built-in setting
+    """
+    custom = {}
+    for config_key, spec in (section or {}).items():
+        if config_key in SETTINGS and config_key not in _custom_keys:
+            raise ValueError(f"Custom setting '{config_key}' conflicts with a built-in setting")
+        if not isinstance(spec, dict) or "domain" not in spec or "key" not in spec:
+            raise ValueError(f"Custom setting '{config_key}' needs a domain and a key")
+        value_type = spec.get("type", "string")
+        if value_type not in VALUE_TYPES:
+            raise ValueError(
+                f"Custom setting '{config_key}' has unknown type '{value_type}' "
+                f"(use {', '.join(VALUE_TYPES)})"
+            )
+        custom[config_key] = Setting(
+            domain=spec["domain"],
+            key=spec["key"],
+            value_type=value_type,
+            restart_app=spec.get("restart_app"),
+            description=spec.get("description", ""),
+        )
+    return custom
+
+
+def register_settings(settings: dict[str, Setting]) -> None:
+    """Add settings to the registry alongside the built-in ones."""
+    SETTINGS.update(settings)
+    _custom_keys.update(settings)
+
+
 def flatten_config(config: dict[str, Any], prefix: str = "") -> dict[str, Any]:
     """Flatten nested config dict to dot-notation keys.
 
+    The top-level `custom:` section declares settings rather than values, so
+    it is left out. Values of dict settings are kept whole.
+
     Example: {'dock': {'size': 48}} -> {'dock.size': 48}
     """
     result = {}
     for key, value in config.items():
+        if not prefix and key == CUSTOM_SECTION:
+            continue
         full_key = f"{prefix}.{key}" if prefix else key
-        if isinstance(value, dict):
+        setting = SETTINGS.get(full_key)
+        if isinstance(value, dict) and not (setting and setting.value_type == "dict"):
             result.update(flatten_config(value, full_key))
         else:
             result[full_key] = value
@@ -344,40 +450,206 @@ def unflatten_config(flat: dict[str, Any]) -> dict[str, Any]:
     return result
 
 
-def read_current_state() -> dict[str, Any]:
-    """Read all supported settings from the system."""
+def read_current_state(
+    keys: Iterable[str] | None = None,
+    fingerprints: dict[str, str] | None = None,
+) -> dict[str, Any]:
+    """Read supported settings from the system.
+
+    Args:
+        keys: Config keys to read (default: every supported setting)
+        fingerprints: If given, filled with a hash of the values read from
+            each domain; see defaults.fingerprint()
+
+    Raises:
+        DeadlineExceeded: With the settings read so far and the unread keys
+    """
+    # One export per domain instead of one read per key
+    by_domain: dict[str, list[str]] = {}
+    for key in SETTINGS if keys is None else keys:
+        by_domain.setdefault(SETTINGS[key].domain, []).append(key)
+
     state = {}
-    for key, setting in SETTINGS.items():
-        value = defaults.read(setting.domain, setting.key)
-        if value is not None:
-            # Convert to proper type based on setting definition
-            if setting.value_type == "bool":
-                # macOS returns 0/1 for bools
-                value = bool(value) if isinstance(value, int) else value
-            state[key] = value
+    for domain, domain_keys in by_domain.items():
+        try:
+            values = defaults.export(domain, [SETTINGS[k].key for k in domain_keys])
+        except defaults.DeadlineExceeded as e:
+            e.state = state
+            e.unchecked = [k for keys in by_domain.values() for k in keys if k not in state]
+            raise
+        if fingerprints is not None:
+            fingerprints[domain] = defaults.fingerprint(values)
+        state.update(extract_state(domain_keys, values))
     return state
 
 
-def compute_diff(config: dict[str, Any]) -> list[ConfigDiff]:
+def extract_state(keys: Iterable[str], values: dict[str, Any]) -> dict[str, Any]:
+    """Pick the values of settings out of their domain's exported values.
+
+    Args:
+        keys: Config keys of settings that all live in the exported domain
+        values: The domain's exported values
+    """
+    state = {}
+    for key in keys:
+        state_value = _state_value(SETTINGS[key], values)
+        if state_value is not None:
+            state[key] = state_value
+    return state
+
+
+def _state_value(setting: Setting, values: dict[str, Any]) -> Any:
+    """Pick a setting's value out of its exported domain."""
+    return normalize(values.get(setting.key), setting.value_type)
+
+
+def normalize(value: Any, value_type: str) -> Any:
+    """Convert a config or system value to the Python type of a setting's value_type.
+
+    Bools written with -int are stored as 0/1, `defaults read` turns text
+    like "1" or "0.5" into numbers and YAML may quote numbers. Values that
+    cannot be converted are returned unchanged, so they still show up as
+    differences.
+    """
+    if value is None:
+        return None
+    if value_type == "bool":
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, (int, float)) and value in (0, 1):
+            return bool(value)
+        if isinstance(value, str) and value.strip().lower() in TRUE_STRINGS + FALSE_STRINGS:
+            return value.strip().lower() in TRUE_STRINGS
+    elif value_type == "int":
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, str):
+            try:
+                return int(value.strip())
+            except ValueError:
+                pass
+    elif value_type == "float":
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+        if isinstance(value, str):
+            try:
+                return float(value.strip())
+            except ValueError:
+                pass
+    elif value_type == "string":
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+    return value
+
+
+_PYTHON_TYPES = {"bool": bool, "int": int, "float": float, "string": str, "array": list, "dict": dict}
+
+
+def parse_value(text: str, value_type: str) -> Any:
+    """Convert command-line text, e.g. 'true' or '[a, b]', to a value of value_type.
+
+    Arrays and dicts are parsed as YAML flow collections.
+
+    Raises:
+        ValueError: If the text is not a valid value of that type
+    """
+    if value_type in ("array", "dict"):
+        try:
+            value = yaml.safe_load(text)
+        except yaml.YAMLError:
+            value = text
+    else:
+        value = normalize(text, value_type)
+    if not _has_type(value, value_type):
+        raise ValueError(f"expected {value_type}, got '{text}'")
+    return value
+
+
+def _has_type(value: Any, value_type: str) -> bool:
+    if value_type == "int" and isinstance(value, bool):
+        return False
+    return isinstance(value, _PYTHON_TYPES[value_type])
+
+
+def check_values(config: dict[str, Any]) -> None:
+    """Check that every registry setting in a flattened config has a value of its type.
+
+    Keys that are not registry settings are ignored.
+
+    Raises:
+        ValueError: Naming the first setting whose value cannot be converted
+    """
+    for key, value in config.items():
+        setting = SETTINGS.get(key)
+        if setting is not None and not _has_type(normalize(value, setting.value_type), setting.value_type):
+            raise ValueError(f"{key}: expected {setting.value_type}, got {value!r}")
+
+
+def parse_assignments(assignments: Iterable[str]) -> dict[str, Any]:
+    """Parse 'key=value' strings into a flattened config of registry settings.
+
+    Raises:
+        ValueError: On a malformed assignment, an unknown key or a bad value
+    """
+    config: dict[str, Any] = {}
+    for assignment in assignments:
+        key, sep, text = assignment.partition("=")
+        key = key.strip()
+        if not sep or not key:
+            raise ValueError(f"Expected key=value, got '{assignment}'")
+        if key not in SETTINGS:
+            raise ValueError(f"Unknown setting: {key} (see 'mct settings')")
+        try:
+            config[key] = parse_value(text, SETTINGS[key].value_type)
+        except ValueError as e:
+            raise ValueError(f"Invalid value for {key}: {e}") from None
+    return config
+
+
+def values_equal(a: Any, b: Any, value_type: str) -> bool:
+    """Whether two values of a setting are the same once normalized."""
+    a, b = normalize(a, value_type), normalize(b, value_type)
+    if value_type == "float" and isinstance(a, float) and isinstance(b, float):
+        return math.isclose(a, b, rel_tol=FLOAT_REL_TOL, abs_tol=FLOAT_ABS_TOL)
+    return a == b
+
+
+def compute_diff(
+    config: dict[str, Any], current_state: dict[str, Any] | None = None
+) -> list[ConfigDiff]:
     """Compute differences between config and current system state.
 
     Args:
         config: Flattened config dict
+        current_state: Previously read state to compare against; read from
+            the system when not given
 
     Returns:
         List of ConfigDiff for settings that differ
+
+    Raises:
+        DeadlineExceeded: With the differences among the settings read in time
     """
-    diffs = []
-    current_state = read_current_state()
+    if current_state is None:
+        try:
+            current_state = read_current_state(k for k in config if k in SETTINGS)
+        except defaults.DeadlineExceeded as e:
+            checked = {k: v for k, v in config.items() if k not in e.unchecked}
+            e.diffs = compute_diff(checked, e.state)
+            raise
 
+    diffs = []
     for key, desired in config.items():
         if key not in SETTINGS:
             continue
 
         setting = SETTINGS[key]
-        current = current_state.get(key)
+        current = normalize(current_state.get(key), setting.value_type)
+        desired = normalize(desired, setting.value_type)
 
-        if current != desired:
+        if not values_equal(current, desired, setting.value_type):
             diffs.append(
                 ConfigDiff(key=key, current=current, desired=desired, setting=setting)
             )
@@ -399,6 +671,14 @@ def apply_setting(key: str, value: Any) -> str | None:
     return setting.restart_app
 
 
+def group_writes(diffs: list[ConfigDiff]) -> dict[str, list[ConfigDiff]]:
+    """Group diffs by defaults domain, keeping their order within each domain."""
+    groups: dict[str, list[ConfigDiff]] = {}
+    for diff in diffs:
+        groups.setdefault(diff.setting.domain, []).append(diff)
+    return groups
+
+
 def apply_config(config: dict[str, Any], dry_run: bool = False) -> list[ConfigDiff]:
     """Apply configuration to the system.
 
@@ -408,21 +688,104 @@ def apply_config(config: dict[str, Any], dry_run: bool = False) -> list[ConfigDi
 
     Returns:
         List of changes that were (or would be) applied
+
+    Raises:
+        DeadlineExceeded: With the changes found and those applied in time;
+            apps are not restarted
+        WriteError: If writes to some domains failed, after the apps of the
+            other domains have been restarted
     """
     diffs = compute_diff(config)
 
     if dry_run:
         return diffs
 
-    apps_to_restart: set[str] = set()
-
-    for diff in diffs:
-        restart_app = apply_setting(diff.key, diff.desired)
-        if restart_app:
-            apps_to_restart.add(restart_app)
+    try:
+        write_diffs(group_writes(diffs))
+    except defaults.DeadlineExceeded as e:
+        e.diffs = diffs
+        raise
+    except WriteError as e:
+        # The domains that were written still need their apps restarted
+        for app in apps_to_restart(e.applied):
+            defaults.restart_app(app)
+        raise
 
     # Restart affected apps
-    for app in apps_to_restart:
+    for app in apps_to_restart(diffs):
         defaults.restart_app(app)
 
     return diffs
+
+
+# Most domains written at once by write_diffs() through `defaults` processes
+WRITE_WORKERS = 8
+
+
+def write_diffs(
+    groups: dict[str, list[ConfigDiff]],
+    workers: int = WRITE_WORKERS,
+) -> list[WriteOutcome]:
+    """Write grouped diffs with one batch per domain, domains concurrently.
+
+    Each domain's batch runs on its own worker, in order, so writes to one
+    domain never race each other in cfprefsd. A failure stops only the rest
+    of that domain's batch; other domains are still written.
+
+    Only `defaults` processes are worth overlapping: with the helper
+    co-process running, writes are in-process calls over its single pipe,
+    so domains are written one after another instead.
+
+    Args:
+        groups: Diffs by domain, as returned by group_writes()
+        workers: Most domains written at once
+
+    Returns:
+        The outcome of every diff, in the order of groups
+
+    Raises:
+        DeadlineExceeded: If the deadline passed, with the diffs written
+        WriteError: If any write failed, with every diff's outcome
+    """
+    def write_domain(
+        domain: str, group: list[ConfigDiff]
+    ) -> tuple[list[WriteOutcome], Exception | None]:
+        written: list[str] = []
+        error: Exception | None = None
+        try:
+            defaults.write_many(
+                domain,
+                [(d.setting.key, d.desired, d.setting.value_type) for d in group],
+                previous={d.setting.key: d.current for d in group},
+                written=written,
+            )
+        except defaults.DefaultsError as e:
+            error = e
+        outcomes = [WriteOutcome(d, written=d.setting.key in written) for d in group]
+        failed = [o for o in outcomes if not o.written]
+        if failed:
+            failed[0].error = str(error).strip()
+            for outcome in failed[1:]:
+                outcome.error = f"not written after an earlier failure in {domain}"
+        return outcomes, error
+
+    if len(groups) <= 1 or workers <= 1 or defaults.helper_running():
+        results = [write_domain(domain, group) for domain, group in groups.items()]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(groups))) as pool:
+            results = list(pool.map(write_domain, groups, groups.values()))
+
+    outcomes = [outcome for domain_outcomes, _ in results for outcome in domain_outcomes]
+    errors = [error for _, error in results if error is not None]
+    for error in errors:
+        if isinstance(error, defaults.DeadlineExceeded):
+            error.applied = [o.diff for o in outcomes if o.written]
+            raise error
+    if errors:
+        raise WriteError(outcomes)
+    return outcomes
+
+
+def apps_to_restart(diffs: list[ConfigDiff]) -> list[str]:
+    """Apps to restart after applying diffs, each listed once."""
+    return sorted({d.setting.restart_app for d in diffs if d.setting.restart_app})
@@ -1,8 +1,28 @@
 """Helper module for macOS defaults commands."""
 
+import atexit
+import fcntl
+import hashlib
+import json
+import math
+import os
+import plistlib
+import random
+import re
+import select
+import shlex
 import subprocess
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
 from typing import Any
 
+from . import plistreader, prefs_helper
+
 
 class DefaultsError(Exception):
     """Error when reading/writing macOS defaults."""
@@ -10,6 +30,281 @@ class DefaultsError(Exception):
     pass
 
 
+class DeadlineExceeded(DefaultsError):
+    """The overall deadline passed before an operation could run.
+
+    Callers that catch and re-raise it attach what they finished, so the
+    partial results can be reported.
+    """
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.state: dict[str, Any] = {}  # Settings read before the deadline
+        self.unchecked: list[str] = []  # Config keys that were not read
+        self.diffs: list[Any] = []  # Differences found among the keys read
+        self.applied: list[Any] = []  # Diffs written before the deadline
+
+
+# Strings that stand for a bool, in config files and values to write
+TRUE_STRINGS = ("1", "true", "yes", "on")
+FALSE_STRINGS = ("0", "false", "no", "off")
+
+# Counters for the current process, reported by `mct metrics`
+stats = {"subprocesses": 0, "restarts": 0}
+
+# Seconds spent reading, writing and restarting apps in the current process
+timings: dict[str, float] = {}
+
+# Duration of every operation in the current process, by operation name
+latencies: dict[str, list[float]] = {}
+
+# Seconds a single `defaults` or `killall` process may take. A helper request
+# and its fallback to `defaults` share one such budget.
+OP_TIMEOUT = 10.0
+# Share of that budget a helper request may use before falling back
+HELPER_TIMEOUT_SHARE = 0.5
+# Extra attempts after a timeout, spaced by jittered exponential backoff
+RETRIES = 2
+BACKOFF = 0.2
+
+_deadline: dict[str, float | None] = {"at": None}
+# Per thread: when the budget of an operation falling back from the helper
+# runs out (`at`), or None
+_fallback = threading.local()
+
+# Phase that each `defaults` subcommand (or helper operation) counts toward
+_PHASES = {
+    "read": "read",
+    "export": "read",
+    "domains": "read",
+    "write": "write",
+    "delete": "write",
+    "array-add": "write",
+    "dict-add": "write",
+}
+
+# Stands for a value the caller does not know
+MISSING = object()
+
+# Called as hook(domain, key, old, new) after each successful write or delete;
+# old is MISSING when the caller does not know it, and new is None for deletes
+write_hooks: list[Callable[[str, str, Any, Any], None]] = []
+
+
+@contextmanager
+def _timed(phase: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - started
+
+
+def _notify(domain: str, key: str, old: Any, new: Any) -> None:
+    for hook in write_hooks:
+        hook(domain, key, old, new)
+
+
+def set_deadline(seconds: float | None) -> None:
+    """Fail operations with DeadlineExceeded once seconds have passed (None: never)."""
+    _deadline["at"] = None if seconds is None else time.monotonic() + seconds
+
+
+def _timeout(what: str) -> float:
+    """Timeout for the next operation: OP_TIMEOUT, capped by the deadline.
+
+    After a failed helper request, the fallback only gets what is left of
+    the operation's OP_TIMEOUT.
+
+    Raises:
+        DeadlineExceeded: If the deadline has already passed
+        DefaultsError: If the operation's budget has run out
+    """
+    now = time.monotonic()
+    timeout = OP_TIMEOUT
+    at = _deadline["at"]
+    if at is not None:
+        if at <= now:
+            raise DeadlineExceeded(f"Deadline exceeded before {what}")
+        timeout = min(timeout, at - now)
+    op_at = getattr(_fallback, "at", None)
+    if op_at is not None:
+        if op_at <= now:
+            raise DefaultsError(f"'{what}' timed out after {OP_TIMEOUT:.1f}s")
+        timeout = min(timeout, op_at - now)
+    return timeout
+
+
+def _spawn(cmd: list[str], retry: bool = True, **kwargs: Any) -> subprocess.CompletedProcess:
+    """Run a command with a timeout, retrying timeouts with jittered backoff.
+
+    Args:
+        cmd: Command line
+        retry: Whether running the command twice is harmless
+        **kwargs: Passed to subprocess.run
+
+    Raises:
+        DefaultsError: If every attempt timed out
+        DeadlineExceeded: If the deadline passed first
+    """
+    what = " ".join(cmd[:3])
+    op = cmd[1] if cmd[0] == "defaults" else cmd[0]
+    attempts = 1 + RETRIES if retry else 1
+    try:
+        for attempt in range(attempts):
+            timeout = _timeout(what)
+            if cmd[0] == "defaults":
+                stats["subprocesses"] += 1
+            started = time.perf_counter()
+            try:
+                return subprocess.run(cmd, timeout=timeout, **kwargs)
+            except subprocess.TimeoutExpired:
+                if attempt + 1 == attempts:
+                    _timeout(what)
+                    raise DefaultsError(f"'{what}' timed out after {timeout:.1f}s") from None
+                # Full jitter, so stuck callers do not retry in lockstep
+                delay = random.uniform(0, BACKOFF * 2**attempt)
+                time.sleep(min(delay, _timeout(what)))
+            finally:
+                latencies.setdefault(op, []).append(time.perf_counter() - started)
+    finally:
+        # The operation is over, and with it any fallback budget
+        _fallback.at = None
+    raise AssertionError("unreachable")
+
+
+def _run(args: list[str], **kwargs: Any) -> subprocess.CompletedProcess:
+    """Run a `defaults` subcommand, counting the spawned process."""
+    with _timed(_PHASES.get(args[0], args[0])):
+        # Appending twice would duplicate elements
+        return _spawn(["defaults", *args], retry="-array-add" not in args, **kwargs)
+
+
+def latency_percentiles(percentiles: tuple[int, ...] = (50, 90, 99)) -> dict[str, dict[str, float]]:
+    """Per-operation latency summary: count, the given percentiles and max, in seconds."""
+    summary = {}
+    for op, samples in sorted(latencies.items()):
+        ordered = sorted(samples)
+        stats_for_op: dict[str, float] = {"count": len(ordered)}
+        for p in percentiles:
+            # Nearest-rank percentile
+            rank = max(1, math.ceil(p / 100 * len(ordered)))
+            stats_for_op[f"p{p}"] = ordered[rank - 1]
+        stats_for_op["max"] = ordered[-1]
+        summary[op] = stats_for_op
+    return summary
+
+
+# Command that starts the preferences co-process (see prefs_helper). 'off'
+# runs one `defaults` process per operation; when unset, macOS uses the
+# built-in helper.
+HELPER_ENV = "MCT_PREFS_HELPER"
+
+
+class _Helper:
+    """Connection to a running prefs_helper co-process.
+
+    Raises:
+        OSError: If the helper cannot be started or reports it cannot run
+    """
+
+    def __init__(self, cmd: list[str]):
+        stats["subprocesses"] += 1
+        self.proc = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1
+        )
+        # Requests from several threads (e.g. `mct index`) share the pipes
+        self.lock = threading.Lock()
+        greeting = self._receive(OP_TIMEOUT)
+        if not greeting.get("ok"):
+            self.close()
+            raise OSError(greeting.get("error", "preferences helper failed to start"))
+
+    def _receive(self, timeout: float) -> dict[str, Any]:
+        # Responses are single lines, so nothing is left buffered between them
+        ready, _, _ = select.select([self.proc.stdout], [], [], timeout)
+        if not ready:
+            raise OSError(f"preferences helper did not answer within {timeout:.1f}s")
+        line = self.proc.stdout.readline()
+        if not line:
+            raise OSError("preferences helper exited")
+        return json.loads(line, object_hook=prefs_helper.decode)
+
+    def call(self, request: dict[str, Any], timeout: float) -> dict[str, Any]:
+        with self.lock:
+            self.proc.stdin.write(json.dumps(request, default=prefs_helper.encode) + "\n")
+            self.proc.stdin.flush()
+            return self._receive(timeout)
+
+    def close(self) -> None:
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=1)
+        except OSError:
+            pass
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
+_helper: dict[str, Any] = {"connection": None, "started": False}
+# Domains may be written from several threads; only one may start the helper
+_helper_lock = threading.Lock()
+
+
+def _helper_command() -> list[str] | None:
+    command = os.environ.get(HELPER_ENV)
+    if command is not None:
+        return None if command.strip() in ("", "off", "0") else shlex.split(command)
+    if sys.platform == "darwin":
+        return [sys.executable, "-I", prefs_helper.__file__]
+    return None
+
+
+def _connection() -> _Helper | None:
+    """The helper co-process, started on first use; None if unavailable."""
+    if not _helper["started"]:
+        with _helper_lock:
+            if not _helper["started"]:
+                command = _helper_command()
+                if command:
+                    try:
+                        _helper["connection"] = _Helper(command)
+                        atexit.register(_helper["connection"].close)
+                    except (OSError, ValueError):
+                        pass
+                _helper["started"] = True
+    return _helper["connection"]
+
+
+def helper_running() -> bool:
+    """Whether operations go through the helper co-process, starting it if needed."""
+    return _connection() is not None
+
+
+def _call(op: str, **fields: Any) -> dict[str, Any] | None:
+    """Send a request to the helper; None means fall back to `defaults`."""
+    _fallback.at = None
+    connection = _connection()
+    if connection is None:
+        return None
+    budget = _timeout(f"helper {op}")
+    budget_at = time.monotonic() + budget
+    started = time.perf_counter()
+    try:
+        with _timed(_PHASES.get(op, op)):
+            return connection.call({"op": op, **fields}, budget * HELPER_TIMEOUT_SHARE)
+    except (OSError, ValueError):
+        # A helper that died, hung or garbled a response is not used again
+        connection.close()
+        _helper["connection"] = None
+        # The fallback to `defaults` gets the rest of the operation's budget
+        _fallback.at = budget_at
+        return None
+    finally:
+        latencies.setdefault(f"helper {op}", []).append(time.perf_counter() - started)
+
+
 def read(domain: str, key: str) -> Any:
     """Read a value from macOS defaults.
 
@@ -23,36 +318,130 @@ def read(domain: str, key: str) -> Any:
     Raises:
         DefaultsError: If there's an error reading the value
     """
+    response = _call("read", domain=domain, key=key)
+    if response is not None and response["ok"]:
+        value = response["value"]
+        # Match what parsing `defaults read` output gives
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, str):
+            return _parse_text(value)
+        return value
+
     try:
-        result = subprocess.run(
-            ["defaults", "read", domain, key],
+        result = _run(
+            ["read", domain, key],
             capture_output=True,
             text=True,
             check=True,
         )
-        value = result.stdout.strip()
+        return _parse_text(result.stdout.strip())
+    except subprocess.CalledProcessError:
+        return None
 
-        # Try to parse as int
-        try:
-            return int(value)
-        except ValueError:
-            pass
 
-        # Try to parse as float
+def _parse_text(value: str) -> Any:
+    """Convert `defaults read` output to int, float or bool where it looks like one."""
+    # Try to parse as int
+    try:
+        return int(value)
+    except ValueError:
+        pass
+
+    # Try to parse as float
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    # Handle boolean strings
+    if value in ("1", "true", "yes"):
+        return True
+    if value in ("0", "false", "no"):
+        return False
+
+    return value
+
+
+def export(domain: str, keys: Iterable[str] | None = None) -> dict[str, Any]:
+    """Read every key of a domain (or just some) in one call, as typed plist data.
+
+    Args:
+        domain: The defaults domain (e.g., 'com.apple.dock')
+        keys: Only read these keys; the domain is then streamed and parsing
+            stops once they have been found
+
+    Returns:
+        Dict of the domain's keys, or {} if the domain does not exist
+    """
+    wanted = None if keys is None else sorted(set(keys))
+    fields = {} if wanted is None else {"keys": wanted}
+    response = _call("export", domain=domain, **fields)
+    if response is not None and response["ok"]:
+        values = response["value"]
+        # Helpers that predate "keys" send the whole domain
+        return values if wanted is None else {k: values[k] for k in wanted if k in values}
+
+    if wanted is not None:
+        return _export_keys(domain, wanted)
+    try:
+        result = _run(["export", domain, "-"], capture_output=True, check=True)
+        return plistlib.loads(result.stdout)
+    except (subprocess.CalledProcessError, plistlib.InvalidFileException):
+        return {}
+
+
+def _export_keys(domain: str, keys: list[str]) -> dict[str, Any]:
+    """Stream `defaults export` through plistreader, stopping it once keys are read."""
+    what = f"defaults export {domain}"
+    timeout = _timeout(what)
+    _fallback.at = None
+    stats["subprocesses"] += 1
+    started = time.perf_counter()
+    with _timed("read"):
+        proc = subprocess.Popen(
+            ["defaults", "export", domain, "-"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        # A blocked read cannot time out by itself, so the process is killed
+        expired = threading.Event()
+
+        def kill() -> None:
+            expired.set()
+            proc.kill()
+
+        watchdog = threading.Timer(timeout, kill)
+        watchdog.start()
         try:
-            return float(value)
-        except ValueError:
-            pass
+            values = plistreader.read_keys(proc.stdout, keys)
+        except plistlib.InvalidFileException:
+            values = {}
+        finally:
+            watchdog.cancel()
+            # Done early: the rest of the domain is not needed
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            latencies.setdefault("export", []).append(time.perf_counter() - started)
+    if expired.is_set():
+        raise DefaultsError(f"'{what}' timed out after {timeout:.1f}s")
+    return values
 
-        # Handle boolean strings
-        if value in ("1", "true", "yes"):
-            return True
-        if value in ("0", "false", "no"):
-            return False
 
-        return value
-    except subprocess.CalledProcessError:
-        return None
+def domains() -> list[str]:
+    """List the domains `defaults domains` reports (not including the global one)."""
+    try:
+        result = _run(["domains"], capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        raise DefaultsError(f"Failed to list domains: {e.stderr}") from e
+    return [name.strip() for name in result.stdout.split(",") if name.strip()]
+
+
+def fingerprint(values: dict[str, Any]) -> str:
+    """Return a stable hash of exported values, of a whole domain or some of its keys."""
+    return hashlib.sha256(plistlib.dumps(values, sort_keys=True)).hexdigest()
 
 
 def read_global(key: str) -> Any:
@@ -60,33 +449,242 @@ def read_global(key: str) -> Any:
     return read("-g", key)
 
 
-def write(domain: str, key: str, value: Any, value_type: str | None = None) -> None:
+def write(
+    domain: str,
+    key: str,
+    value: Any,
+    value_type: str | None = None,
+    current: Any = MISSING,
+) -> None:
     """Write a value to macOS defaults.
 
     Args:
         domain: The defaults domain (e.g., 'com.apple.dock')
         key: The key to write
         value: The value to write
-        value_type: Optional type hint ('bool', 'int', 'float', 'string')
+        value_type: Optional type hint ('bool', 'int', 'float', 'string',
+            'array', 'dict')
+        current: The key's current value, if known, for write_hooks
 
     Raises:
         DefaultsError: If there's an error writing the value
     """
-    cmd = ["defaults", "write", domain, key]
+    _write(domain, key, value, value_type)
+    _notify(domain, key, current, value)
 
-    if value_type == "bool" or isinstance(value, bool):
-        cmd.extend(["-bool", "true" if value else "false"])
+
+def _write(domain: str, key: str, value: Any, value_type: str | None) -> None:
+    response = _call("write", domain=domain, key=key, value=_plist_value(value, value_type))
+    if response is not None:
+        if not response["ok"]:
+            raise DefaultsError(f"Failed to write {domain} {key}: {response['error']}")
+        return
+
+    try:
+        _run(write_args(domain, key, value, value_type), check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise DefaultsError(f"Failed to write {domain} {key}: {e.stderr}") from e
+
+
+def write_args(domain: str, key: str, value: Any, value_type: str | None = None) -> list[str]:
+    """Arguments of the `defaults write` command that sets a value."""
+    cmd = ["write", domain, key]
+
+    if value_type in ("array", "dict") or isinstance(value, (list, dict)):
+        cmd.append(_fragment(_typed(value, value_type)))
+    elif value_type == "bool" or isinstance(value, bool):
+        cmd.extend(["-bool", "true" if _typed(value, "bool") else "false"])
     elif value_type == "int" or isinstance(value, int):
         cmd.extend(["-int", str(value)])
     elif value_type == "float" or isinstance(value, float):
         cmd.extend(["-float", str(value)])
     else:
         cmd.append(str(value))
+    return cmd
+
+
+# A tag and the whitespace after it, up to the next tag
+_LAYOUT = re.compile(r"(<[^>]*>)\s+(?=<)")
+
+
+def _fragment(value: Any) -> str:
+    """Encode a value as the XML plist fragment `defaults write` accepts."""
+    text = plistlib.dumps(value, fmt=plistlib.FMT_XML).decode()
+    body = text.split("<plist version=\"1.0\">", 1)[1].rsplit("</plist>", 1)[0]
+    # Drop the indentation between elements but keep string content, which
+    # may itself be nothing but whitespace
+    return _LAYOUT.sub(
+        lambda m: m.group(0) if m.group(1) in ("<string>", "<key>") else m.group(1),
+        body.strip(),
+    )
+
+
+def update(
+    domain: str,
+    key: str,
+    value: Any,
+    value_type: str | None = None,
+    current: Any = MISSING,
+) -> None:
+    """Write a value, touching only the changed part of an array or dict.
+
+    Appending to an array and adding or replacing dict keys are done in place,
+    by the helper co-process or by `defaults write -array-add`/`-dict-add`.
+    Other changes to a structure, such as removing or moving elements,
+    rewrite the key.
+
+    Args:
+        domain: The defaults domain (e.g., 'com.apple.dock')
+        key: The key to write
+        value: The value to write
+        value_type: Optional type hint, as for write()
+        current: The key's current value, if known
+
+    Raises:
+        DefaultsError: If there's an error writing the value
+    """
+    edit = _structural_edit(value, current)
+    if edit is None:
+        _write(domain, key, value, value_type)
+        _notify(domain, key, current, value)
+        return
+
+    op, added = edit
+    response = _call(op, domain=domain, key=key, value=added)
+    if response is not None:
+        if not response["ok"]:
+            raise DefaultsError(f"Failed to write {domain} {key}: {response['error']}")
+    else:
+        cmd = update_args(domain, key, value, value_type, current)
+        try:
+            _run(cmd, check=True, capture_output=True, text=True)
+        except subprocess.CalledProcessError as e:
+            raise DefaultsError(f"Failed to write {domain} {key}: {e.stderr}") from e
+    _notify(domain, key, current, value)
+
+
+def _structural_edit(value: Any, current: Any) -> tuple[str, Any] | None:
+    """The in-place edit turning current into value, as (op, added part).
+
+    op is 'array-add' with the elements to append, or 'dict-add' with the
+    entries to add or replace; None means the whole value must be written.
+    """
+    if isinstance(current, list) and isinstance(value, list) and current == value[: len(current)]:
+        added: Any = value[len(current):]
+        op = "array-add"
+    elif isinstance(current, dict) and isinstance(value, dict) and current.keys() <= value.keys():
+        added = {k: v for k, v in value.items() if k not in current or current[k] != v}
+        op = "dict-add"
+    else:
+        return None
+    return (op, added) if added else None
+
+
+def update_args(
+    domain: str,
+    key: str,
+    value: Any,
+    value_type: str | None = None,
+    current: Any = None,
+) -> list[str]:
+    """Arguments of the `defaults write` command update() runs."""
+    edit = _structural_edit(value, current)
+    if edit is None:
+        return write_args(domain, key, value, value_type)
 
+    op, added = edit
+    cmd = ["write", domain, key, f"-{op}"]
+    if op == "array-add":
+        cmd.extend(_fragment(v) for v in added)
+    else:
+        for k, v in added.items():
+            cmd.extend([k, _fragment(v)])
+    return cmd
+
+
+def _plist_value(value: Any, value_type: str | None) -> Any:
+    """The plist value write() stores for a value and type hint."""
+    value = _typed(value, value_type)
+    if isinstance(value, (bool, int, float, list, dict, bytes, datetime)):
+        return value
+    return str(value)
+
+
+def _typed(value: Any, value_type: str | None) -> Any:
+    """Convert a value to the Python type plistlib writes as value_type.
+
+    Raises:
+        DefaultsError: If the value cannot be converted
+    """
     try:
-        subprocess.run(cmd, check=True, capture_output=True, text=True)
-    except subprocess.CalledProcessError as e:
-        raise DefaultsError(f"Failed to write {domain} {key}: {e.stderr}") from e
+        if value_type == "bool":
+            return _bool(value)
+        if value_type == "int":
+            return int(value)
+        if value_type == "float":
+            return float(value)
+        if value_type == "string":
+            return str(value)
+        if value_type == "array":
+            return list(value)
+        if value_type == "dict":
+            return dict(value)
+    except (TypeError, ValueError):
+        raise DefaultsError(f"Invalid {value_type} value: {value!r}") from None
+    return value
+
+
+def _bool(value: Any) -> bool:
+    """A bool, 0/1 or true/false string as a bool; same rules as config.normalize().
+
+    Raises:
+        ValueError: For any other value, rather than guessing from truthiness
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in TRUE_STRINGS + FALSE_STRINGS:
+        return value.strip().lower() in TRUE_STRINGS
+    raise ValueError(f"not a boolean: {value!r}")
+
+
+def merge_payload(data: dict[str, Any], items: list[tuple[str, Any, str | None]]) -> bytes:
+    """Binary plist of a domain's values with items merged in."""
+    merged = dict(data)
+    for key, value, value_type in items:
+        merged[key] = _typed(value, value_type)
+    return plistlib.dumps(merged, fmt=plistlib.FMT_BINARY)
+
+
+def write_many(
+    domain: str,
+    items: list[tuple[str, Any, str | None]],
+    previous: dict[str, Any] | None = None,
+    written: list[str] | None = None,
+) -> None:
+    """Write several keys of one domain, one key at a time.
+
+    Only the keys being set are written, so concurrent changes to other keys
+    of the domain are never reverted. With the helper co-process running,
+    each key is written in-process instead of by a `defaults` process.
+
+    Args:
+        domain: The defaults domain (e.g., 'com.apple.dock')
+        items: (key, value, value_type) tuples to write
+        previous: Current values of the keys being written, so arrays and
+            dicts can be updated in place (see update())
+        written: If given, filled with each key once it has been written, so
+            callers can tell which keys a failure left unwritten
+
+    Raises:
+        DefaultsError: If there's an error writing the values
+    """
+    written = written if written is not None else []
+    for key, value, value_type in items:
+        old = previous.get(key, MISSING) if previous is not None else MISSING
+        update(domain, key, value, value_type, current=old)
+        written.append(key)
 
 
 def write_global(key: str, value: Any, value_type: str | None = None) -> None:
@@ -96,29 +694,124 @@ def write_global(key: str, value: Any, value_type: str | None = None) -> None:
 
 def delete(domain: str, key: str) -> None:
     """Delete a key from macOS defaults."""
+    response = _call("delete", domain=domain, key=key)
+    if response is not None and response["ok"]:
+        _notify(domain, key, MISSING, None)
+        return
+
     try:
-        subprocess.run(
-            ["defaults", "delete", domain, key],
+        _run(
+            ["delete", domain, key],
             check=True,
             capture_output=True,
             text=True,
         )
     except subprocess.CalledProcessError:
-        pass  # Key might not exist
+        return  # Key might not exist
+    _notify(domain, key, MISSING, None)
+
+
+# Set to a true value ('1', 'yes', 'true') to queue restarts, like --no-restart
+DEFER_ENV = "MCT_DEFER_RESTART"
+# Apps waiting for `mct restart-pending`; lives with the rest of the state
+PENDING_RESTARTS = Path.home() / ".local" / "state" / "mct" / "pending_restarts.json"
+
+_defer: dict[str, bool | None] = {"restarts": None}
+
+# Apps queued by this process instead of being restarted
+deferred: list[str] = []
+
+
+def defer_restarts(defer: bool | None = True) -> None:
+    """Queue restarts instead of killing apps (None: follow MCT_DEFER_RESTART)."""
+    _defer["restarts"] = defer
+
+
+def restarts_deferred() -> bool:
+    if _defer["restarts"] is not None:
+        return _defer["restarts"]
+    return os.environ.get(DEFER_ENV, "").lower() in ("1", "true", "yes", "on")
+
+
+@contextmanager
+def _pending(path: Path) -> Iterator[list[str]]:
+    """Lock the pending-restart queue and yield it; changes are saved on exit, even on errors."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+") as f:
+        # Scripts may queue restarts from several mct processes at once
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        try:
+            queue = json.loads(f.read() or "[]")
+        except ValueError:
+            queue = []
+        try:
+            yield queue
+        finally:
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(queue))
+
+
+def queue_restart(app_name: str, path: Path = PENDING_RESTARTS) -> None:
+    """Add an app to the pending-restart queue, once."""
+    with _pending(path) as queue:
+        if app_name not in queue:
+            queue.append(app_name)
+    if app_name not in deferred:
+        deferred.append(app_name)
+
+
+def pending_restarts(path: Path = PENDING_RESTARTS) -> list[str]:
+    try:
+        return json.loads(path.read_text() or "[]")
+    except (OSError, ValueError):
+        return []
+
+
+def restart_pending(path: Path = PENDING_RESTARTS) -> list[str]:
+    """Restart each queued app once and empty the queue.
+
+    Returns:
+        The apps restarted, in the order they were queued
+
+    Raises:
+        DefaultsError: If a killall times out; apps not yet restarted stay queued
+    """
+    with _pending(path) as queue:
+        restarted = []
+        while queue:
+            _kill(queue[0])
+            restarted.append(queue.pop(0))
+    return restarted
 
 
 def restart_app(app_name: str) -> None:
-    """Restart an application to apply changes.
+    """Restart an application to apply changes, or queue it if restarts are deferred.
 
     Args:
         app_name: The application name (e.g., 'Dock', 'Finder', 'SystemUIServer')
+
+    Raises:
+        DefaultsError: If killall times out
     """
+    if restarts_deferred():
+        queue_restart(app_name)
+        return
+    _kill(app_name)
+
+
+def _kill(app_name: str) -> None:
     try:
-        subprocess.run(
-            ["killall", app_name],
-            check=True,
-            capture_output=True,
-            text=True,
-        )
+        with _timed("restart"):
+            # Not retried: a slow killall may still have restarted the app
+            _spawn(
+                ["killall", app_name],
+                retry=False,
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+        stats["restarts"] += 1
     except subprocess.CalledProcessError:
         pass  # App might not be running
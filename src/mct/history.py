@@ -0,0 +1,248 @@
+"""Append-only history of the changes mct makes, with run timings.
+
+Every command that writes or deletes a preference is recorded as a run in a
+SQLite database under the state directory: when it ran, the command line,
+each key's old and new value, the number of `defaults` processes spawned and
+the time spent per phase. Rows are only ever inserted.
+"""
+
+import json
+import shlex
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from . import defaults
+from .config import SETTINGS, STATE_DIR
+
+HISTORY_DB = STATE_DIR / "history.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    command TEXT NOT NULL,
+    subprocesses INTEGER NOT NULL,
+    restarts INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    phases TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    key TEXT NOT NULL,
+    old TEXT,
+    new TEXT,
+    old_known INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS runs_timestamp ON runs (timestamp);
+CREATE INDEX IF NOT EXISTS changes_key ON changes (key);
+CREATE INDEX IF NOT EXISTS changes_run ON changes (run_id);
+"""
+
+
+@dataclass
+class Change:
+    """A key that a run changed; None values mean unset or deleted.
+
+    old is defaults.MISSING when the writer did not know the previous value.
+    """
+
+    key: str
+    old: Any
+    new: Any
+
+
+@dataclass
+class Run:
+    """One recorded mct invocation."""
+
+    timestamp: float
+    command: str
+    subprocesses: int = 0
+    restarts: int = 0
+    duration: float = 0.0
+    phases: dict[str, float] = field(default_factory=dict)
+    changes: list[Change] = field(default_factory=list)
+
+
+# The run being recorded in this process
+_current: dict[str, Any] = {"run": None, "started": 0.0, "keep": False}
+# (domain, key) -> config key, rebuilt when settings are registered
+_config_keys: dict[str, Any] = {"size": -1, "keys": {}}
+
+
+def _config_key(domain: str, key: str) -> str:
+    """Config key of a registry setting, or 'domain:key' for other preferences."""
+    if _config_keys["size"] != len(SETTINGS):
+        keys = {}
+        for config_key, setting in SETTINGS.items():
+            keys.setdefault((setting.domain, setting.key), config_key)
+        _config_keys.update(size=len(SETTINGS), keys=keys)
+    return _config_keys["keys"].get((domain, key), f"{domain}:{key}")
+
+
+def _on_write(domain: str, key: str, old: Any, new: Any) -> None:
+    run = _current["run"]
+    if run is None or old == new:
+        return
+    run.changes.append(Change(_config_key(domain, key), old, new))
+
+
+def begin(argv: list[str] | None = None) -> None:
+    """Start recording the writes of this process as a run."""
+    argv = sys.argv[1:] if argv is None else argv
+    _current["run"] = Run(timestamp=time.time(), command=shlex.join(["mct", *argv]))
+    _current["started"] = time.perf_counter()
+    if _on_write not in defaults.write_hooks:
+        defaults.write_hooks.append(_on_write)
+
+
+def keep() -> None:
+    """Record the current run even if it changes nothing, e.g. a no-op apply."""
+    _current["keep"] = True
+
+
+def _dumps(value: Any) -> str | None:
+    return None if value is None or value is defaults.MISSING else json.dumps(value, default=repr)
+
+
+def finish(path: Path = HISTORY_DB) -> Run | None:
+    """Stop recording and store the run if it changed anything (or keep() was called)."""
+    run = _current["run"]
+    _current["run"] = None
+    if run is None or not (run.changes or _current["keep"]):
+        return None
+
+    run.duration = time.perf_counter() - _current["started"]
+    run.subprocesses = defaults.stats["subprocesses"]
+    run.restarts = defaults.stats["restarts"]
+    run.phases = dict(defaults.timings)
+
+    try:
+        conn = connect(path)
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO runs (timestamp, command, subprocesses, restarts, duration, phases)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    run.timestamp,
+                    run.command,
+                    run.subprocesses,
+                    run.restarts,
+                    run.duration,
+                    json.dumps(run.phases),
+                ),
+            )
+            conn.executemany(
+                "INSERT INTO changes (run_id, key, old, new, old_known) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (cursor.lastrowid, c.key, _dumps(c.old), _dumps(c.new), c.old is not defaults.MISSING)
+                    for c in run.changes
+                ],
+            )
+        conn.close()
+    except (OSError, sqlite3.Error):
+        # History must never make a command fail
+        return None
+    return run
+
+
+def connect(path: Path = HISTORY_DB) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=5)
+    conn.executescript(SCHEMA)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(changes)")}
+    if "old_known" not in columns:
+        # Databases from before old values could be unknown
+        conn.execute("ALTER TABLE changes ADD COLUMN old_known INTEGER NOT NULL DEFAULT 1")
+    return conn
+
+
+def _loads(text: str | None) -> Any:
+    return None if text is None else json.loads(text)
+
+
+def query(
+    since: float | None = None,
+    until: float | None = None,
+    key: str | None = None,
+    limit: int = 20,
+    path: Path = HISTORY_DB,
+) -> list[Run]:
+    """Return the most recent runs, newest first.
+
+    Args:
+        since: Only runs at or after this Unix time
+        until: Only runs before this Unix time
+        key: Only runs that changed this key ('*' matches any characters),
+            and only their matching changes
+        limit: Maximum number of runs
+        path: History database
+    """
+    if not path.exists():
+        return []
+
+    where = []
+    params: dict[str, Any] = {"limit": limit}
+    if since is not None:
+        where.append("runs.timestamp >= :since")
+        params["since"] = since
+    if until is not None:
+        where.append("runs.timestamp < :until")
+        params["until"] = until
+    if key:
+        where.append("changes.key GLOB :key")
+        params["key"] = key
+
+    sql = "SELECT DISTINCT runs.* FROM runs"
+    if key:
+        sql += " JOIN changes ON changes.run_id = runs.id"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY runs.timestamp DESC LIMIT :limit"
+
+    conn = connect(path)
+    try:
+        runs = []
+        for row in conn.execute(sql, params).fetchall():
+            run_id, timestamp, command, subprocesses, restarts, duration, phases = row
+            change_sql = "SELECT key, old, new, old_known FROM changes WHERE run_id = :id"
+            if key:
+                change_sql += " AND key GLOB :key"
+            changes = [
+                Change(k, _loads(old) if old_known else defaults.MISSING, _loads(new))
+                for k, old, new, old_known in conn.execute(change_sql, {"id": run_id, "key": key})
+            ]
+            runs.append(
+                Run(
+                    timestamp=timestamp,
+                    command=command,
+                    subprocesses=subprocesses,
+                    restarts=restarts,
+                    duration=duration,
+                    phases=json.loads(phases),
+                    changes=changes,
+                )
+            )
+        return runs
+    finally:
+        conn.close()
+
+
+def parse_time(text: str) -> float:
+    """Parse '30m', '2h', '7d' (ago) or an ISO date/time to a Unix time.
+
+    Raises:
+        ValueError: If the text is neither
+    """
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    if text[:-1].isdigit() and text[-1:] in units:
+        return time.time() - int(text[:-1]) * units[text[-1]]
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid time '{text}': use e.g. 30m, 2h, 7d or 2024-05-01") from None
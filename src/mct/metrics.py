@@ -0,0 +1,117 @@
+"""Prometheus textfile metrics for config drift and apply cost."""
+
+import json
+import time
+from pathlib import Path
+from typing import Any
+
+from . import privileged
+from .config import STATE_DIR, ConfigDiff
+
+LAST_APPLY_PATH = STATE_DIR / "last_apply.json"
+
+
+def record_apply(duration: float, changes: int, subprocesses: int, restarts: int) -> None:
+    """Persist the cost of the most recent `mct apply` for later scrapes."""
+    LAST_APPLY_PATH.parent.mkdir(parents=True, exist_ok=True)
+    data = {
+        "timestamp": time.time(),
+        "duration": duration,
+        "changes": changes,
+        "subprocesses": subprocesses,
+        "restarts": restarts,
+    }
+    privileged.write_atomic(str(LAST_APPLY_PATH), json.dumps(data))
+
+
+def load_last_apply() -> dict[str, Any]:
+    """Load the stats recorded by the last apply, or {} if there are none."""
+    try:
+        data = json.loads(LAST_APPLY_PATH.read_text())
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+# last_apply.json field, metric name, value format, help text
+_LAST_APPLY_GAUGES = [
+    ("timestamp", "mct_last_apply_timestamp_seconds", ".3f", "Unix time of the last mct apply."),
+    ("duration", "mct_last_apply_duration_seconds", ".6f", "Wall time of the last mct apply."),
+    ("changes", "mct_last_apply_changes", "", "Settings written by the last mct apply."),
+    (
+        "subprocesses",
+        "mct_last_apply_defaults_subprocesses",
+        "",
+        "defaults processes spawned by the last mct apply.",
+    ),
+    ("restarts", "mct_last_apply_app_restarts", "", "Applications restarted by the last mct apply."),
+]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _metric(lines: list[str], name: str, kind: str, help_text: str) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def render(
+    config: dict[str, Any],
+    diffs: list[ConfigDiff],
+    last_apply: dict[str, Any],
+    subprocesses: int = 0,
+) -> str:
+    """Render metrics in the Prometheus text exposition format.
+
+    Args:
+        config: Flattened config dict the diffs were computed from
+        diffs: Result of compute_diff() for that config
+        last_apply: Stats from load_last_apply()
+        subprocesses: `defaults` processes spawned while collecting
+
+    Returns:
+        The metrics text, ending in a newline
+    """
+    drifted = {d.key for d in diffs}
+    drift_by_category: dict[str, int] = {}
+    for key in config:
+        category = key.split(".")[0]
+        drift_by_category.setdefault(category, 0)
+        if key in drifted:
+            drift_by_category[category] += 1
+
+    lines: list[str] = []
+
+    _metric(lines, "mct_drift_settings", "gauge", "Number of settings that differ from config.")
+    for category, count in sorted(drift_by_category.items()):
+        lines.append(f'mct_drift_settings{{category="{_escape(category)}"}} {count}')
+
+    _metric(lines, "mct_setting_in_sync", "gauge", "1 if the setting matches config, else 0.")
+    for key in sorted(config):
+        in_sync = 0 if key in drifted else 1
+        lines.append(f'mct_setting_in_sync{{key="{_escape(key)}"}} {in_sync}')
+
+    _metric(
+        lines,
+        "mct_collect_defaults_subprocesses",
+        "gauge",
+        "defaults processes spawned while collecting these metrics.",
+    )
+    lines.append(f"mct_collect_defaults_subprocesses {subprocesses}")
+
+    for field, name, fmt, help_text in _LAST_APPLY_GAUGES:
+        value = last_apply.get(field)
+        # Files from older versions may lack a field; skip rather than guess
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            _metric(lines, name, "gauge", help_text)
+            lines.append(f"{name} {value:{fmt}}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: Path, text: str) -> None:
+    """Atomically write metrics so node_exporter never sees a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    privileged.write_atomic(str(path), text)
@@ -0,0 +1,155 @@
+"""Saved execution plans: `mct plan` computes changes, `mct apply PLAN` runs them.
+
+A plan records the diffs, the per-domain write batches, the apps to restart
+and a fingerprint of the keys it read from each defaults domain. Applying a
+plan only re-reads those keys to check the fingerprints; nothing is
+recomputed, and changes to other keys of the same domains do not make the
+plan stale.
+"""
+
+import json
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+from . import defaults, prefs_helper
+from .config import (
+    SETTINGS,
+    ConfigDiff,
+    Setting,
+    WriteError,
+    apps_to_restart,
+    compute_diff,
+    group_writes,
+    read_current_state,
+    write_diffs,
+)
+from .sysfiles import FileDiff, apply_file_diffs, compute_file_diffs
+
+PLAN_VERSION = 2
+
+
+class StalePlanError(Exception):
+    """A domain changed between planning and applying."""
+
+    pass
+
+
+@dataclass
+class Plan:
+    """Changes computed against a snapshot of the system."""
+
+    changes: list[ConfigDiff]
+    file_changes: list[FileDiff] = field(default_factory=list)
+    fingerprints: dict[str, str] = field(default_factory=dict)  # domain -> hash
+    read: dict[str, list[str]] = field(default_factory=dict)  # domain -> keys hashed
+    restart: list[str] = field(default_factory=list)
+    created: float = field(default_factory=time.time)
+
+    @property
+    def writes(self) -> dict[str, list[ConfigDiff]]:
+        return group_writes(self.changes)
+
+
+def make_plan(config: dict[str, Any], file_config: dict[str, Any]) -> Plan:
+    """Compute a plan for flattened config values.
+
+    Args:
+        config: Flattened config dict of registry settings
+        file_config: Flattened config dict of managed system files
+    """
+    keys = [k for k in config if k in SETTINGS]
+    read: dict[str, list[str]] = {}
+    for key in keys:
+        read.setdefault(SETTINGS[key].domain, []).append(SETTINGS[key].key)
+
+    fingerprints: dict[str, str] = {}
+    current_state = read_current_state(keys, fingerprints)
+    diffs = compute_diff(config, current_state)
+    return Plan(
+        changes=diffs,
+        file_changes=compute_file_diffs(file_config),
+        fingerprints=fingerprints,
+        read=read,
+        restart=apps_to_restart(diffs),
+    )
+
+
+def dumps(plan: Plan) -> str:
+    data = {
+        "version": PLAN_VERSION,
+        "created": plan.created,
+        "fingerprints": plan.fingerprints,
+        "read": plan.read,
+        "changes": [asdict(d) for d in plan.changes],
+        "writes": {domain: [d.key for d in group] for domain, group in plan.writes.items()},
+        "file_changes": [{**asdict(d), "path": str(d.path)} for d in plan.file_changes],
+        "restart": plan.restart,
+    }
+    return json.dumps(data, indent=2, default=prefs_helper.encode)
+
+
+def load(path: Path) -> Plan:
+    """Load a plan file written by dumps().
+
+    Raises:
+        ValueError: If the file is not a valid plan
+    """
+    try:
+        data = json.loads(path.read_text(), object_hook=prefs_helper.decode)
+        if data.get("version") != PLAN_VERSION:
+            raise ValueError(f"unsupported plan version {data.get('version')!r}")
+
+        changes = {
+            c["key"]: ConfigDiff(
+                key=c["key"],
+                current=c["current"],
+                desired=c["desired"],
+                setting=Setting(**c["setting"]),
+            )
+            for c in data["changes"]
+        }
+        # Keep the write order the plan was reviewed with
+        ordered = [changes[key] for keys in data["writes"].values() for key in keys]
+        file_changes = [
+            FileDiff(**{**c, "path": Path(c["path"])}) for c in data["file_changes"]
+        ]
+        return Plan(
+            changes=ordered,
+            file_changes=file_changes,
+            fingerprints=data["fingerprints"],
+            read=data["read"],
+            restart=data["restart"],
+            created=data["created"],
+        )
+    except (json.JSONDecodeError, KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid plan file {path}: {e}") from e
+
+
+def execute(plan: Plan) -> None:
+    """Apply a plan if the keys it read are unchanged.
+
+    Managed files are checked against their planned content hash when written.
+
+    Raises:
+        StalePlanError: If any domain's fingerprint no longer matches
+        WriteError: If writes to some domains failed, after the apps of the
+            other domains have been restarted
+        DefaultsError: If a write fails
+        PermissionError: If a managed file cannot be written
+    """
+    for domain, expected in plan.fingerprints.items():
+        if defaults.fingerprint(defaults.export(domain, plan.read[domain])) != expected:
+            raise StalePlanError(f"{domain} changed since the plan was made")
+
+    try:
+        write_diffs(plan.writes)
+    except WriteError as e:
+        # The domains that were written still need their apps restarted
+        for app in apps_to_restart(e.applied):
+            defaults.restart_app(app)
+        raise
+    apply_file_diffs(plan.file_changes)
+    for app in plan.restart:
+        defaults.restart_app(app)
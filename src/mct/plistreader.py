@@ -0,0 +1,100 @@
+"""Incremental reader for the top-level keys of an XML property list.
+
+`defaults export` writes a domain as one XML plist, which for domains such as
+com.apple.finder can be megabytes of recent folders and window state. To pick
+out a few registered settings, read_keys() parses the stream with iterparse
+and only builds values for the requested keys. Other values are discarded
+element by element as they are parsed, and reading stops as soon as every
+requested key has been seen. Memory use is bounded by the requested values
+and the nesting depth, not by the size of the domain.
+
+Binary plists cannot be read incrementally and are loaded whole.
+"""
+
+import base64
+import plistlib
+from collections.abc import Iterable
+from datetime import datetime
+from typing import IO, Any
+from xml.etree.ElementTree import Element, ParseError, iterparse
+
+
+def _value(element: Element) -> Any:
+    """Convert a plist value element, and its children, to Python."""
+    tag = element.tag
+    if tag == "dict":
+        children = list(element)
+        return {k.text or "": _value(v) for k, v in zip(children[::2], children[1::2])}
+    if tag == "array":
+        return [_value(child) for child in element]
+    if tag == "string":
+        return element.text or ""
+    if tag == "integer":
+        return int(element.text)
+    if tag == "real":
+        return float(element.text)
+    if tag == "true":
+        return True
+    if tag == "false":
+        return False
+    if tag == "data":
+        return base64.b64decode("".join((element.text or "").split()))
+    if tag == "date":
+        # Naive UTC, as plistlib returns it
+        return datetime.strptime(element.text.strip(), "%Y-%m-%dT%H:%M:%SZ")
+    raise ValueError(f"Unknown plist element <{tag}>")
+
+
+def read_keys(stream: IO[bytes], keys: Iterable[str]) -> dict[str, Any]:
+    """Read some top-level keys of a plist, stopping once they have all been found.
+
+    Args:
+        stream: Binary stream positioned at the start of the plist
+        keys: Top-level keys to read
+
+    Returns:
+        Dict of the keys that are present and their values
+
+    Raises:
+        plistlib.InvalidFileException: If the stream is not a valid plist
+    """
+    wanted = set(keys)
+    head = stream.peek(8)[:8] if hasattr(stream, "peek") else b""
+    if head.startswith(b"bplist"):
+        data = plistlib.load(stream)
+        return {k: data[k] for k in wanted if k in data}
+
+    found: dict[str, Any] = {}
+    if not wanted:
+        return found
+
+    # Open elements: <plist>, the top-level <dict>, then a value's subtree
+    stack: list[Element] = []
+    key: str | None = None
+    try:
+        for event, element in iterparse(stream, events=("start", "end")):
+            if event == "start":
+                stack.append(element)
+                continue
+
+            stack.pop()
+            depth = len(stack)
+            if depth == 2 and element.tag == "key":
+                key = element.text or ""
+            elif depth == 2:
+                if key in wanted:
+                    found[key] = _value(element)
+                    if len(found) == len(wanted):
+                        break
+                key = None
+            elif depth > 2 and key not in wanted:
+                # Drop the finished part of a value nobody asked for
+                stack[-1].remove(element)
+                continue
+            else:
+                continue
+            # Finished a top-level key or value: drop it from the dict
+            stack[-1].remove(element)
+    except (ParseError, ValueError, TypeError, AttributeError) as e:
+        raise plistlib.InvalidFileException(f"Invalid plist: {e}") from None
+    return found
@@ -0,0 +1,161 @@
+"""Third-party settings packs discovered through the `mct.settings` entry points.
+
+A pack is a module (or object) named by an entry point in the `mct.settings`
+group. It provides:
+
+    SETTINGS: dict[str, Setting]   # config_key -> Setting, like config.SETTINGS
+    app: typer.Typer               # optional sub-command, mounted as the entry point name
+    HELP: str                      # optional help text for the sub-command
+
+Scanning entry points and importing packs is slow, so what each pack provides
+is recorded in an index file the first time it is needed. After that a pack
+is imported only when one of its config categories or its sub-command is used.
+"""
+
+import importlib
+import json
+import os
+import re
+import sys
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+import typer
+
+from .config import register_settings
+
+ENTRY_POINT_GROUP = "mct.settings"
+INDEX_PATH = Path.home() / ".cache" / "mct" / "plugins.json"
+
+
+@dataclass
+class PackInfo:
+    """What a settings pack provides, as recorded in the index."""
+
+    name: str
+    value: str
+    categories: list[str]
+    has_app: bool = False
+    help: str = ""
+
+
+_index: dict[str, PackInfo] | None = None
+_loaded: dict[str, Any] = {}
+
+
+def fingerprint() -> list[list[Any]]:
+    """Identify the installed packages by the mtimes of the sys.path directories.
+
+    Installing or removing a distribution touches its site-packages directory,
+    which is far cheaper to stat than scanning every distribution's metadata.
+    """
+    entries = []
+    for entry in sys.path:
+        try:
+            entries.append([entry, os.stat(entry or ".").st_mtime_ns])
+        except OSError:
+            continue
+    return entries
+
+
+def _load_object(value: str) -> Any:
+    """Import the object an entry point value ('module:attr [extra]') names."""
+    value = re.sub(r"\[.*\]", "", value).strip()
+    module_name, _, attr = value.partition(":")
+    obj = importlib.import_module(module_name.strip())
+    for part in filter(None, attr.strip().split(".")):
+        obj = getattr(obj, part)
+    return obj
+
+
+def build_index() -> dict[str, PackInfo]:
+    """Scan the entry points and import each pack to record what it provides."""
+    from importlib.metadata import entry_points
+
+    index = {}
+    for ep in entry_points(group=ENTRY_POINT_GROUP):
+        try:
+            pack = _load_object(ep.value)
+        except Exception as e:
+            typer.echo(f"Warning: could not load settings pack '{ep.name}': {e}", err=True)
+            continue
+        _loaded[ep.name] = pack
+        settings = getattr(pack, "SETTINGS", {})
+        index[ep.name] = PackInfo(
+            name=ep.name,
+            value=ep.value,
+            categories=sorted({key.split(".")[0] for key in settings}),
+            has_app=getattr(pack, "app", None) is not None,
+            help=getattr(pack, "HELP", ""),
+        )
+    return index
+
+
+def index() -> dict[str, PackInfo]:
+    """Return the pack index, rebuilding the cached copy if it is stale."""
+    global _index
+    if _index is not None:
+        return _index
+
+    current = fingerprint()
+    try:
+        data = json.loads(INDEX_PATH.read_text())
+        if data["fingerprint"] == current:
+            _index = {name: PackInfo(**info) for name, info in data["packs"].items()}
+            return _index
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    _index = build_index()
+    try:
+        INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp = INDEX_PATH.with_suffix(f".{os.getpid()}.tmp")
+        packs = {name: asdict(info) for name, info in _index.items()}
+        tmp.write_text(json.dumps({"fingerprint": current, "packs": packs}))
+        tmp.replace(INDEX_PATH)
+    except OSError:
+        pass
+    return _index
+
+
+def load(name: str) -> Any:
+    """Import a pack and register its settings."""
+    if name not in _loaded:
+        _loaded[name] = _load_object(index()[name].value)
+    pack = _loaded[name]
+    register_settings(getattr(pack, "SETTINGS", {}))
+    return pack
+
+
+def load_categories(categories: Iterable[str]) -> None:
+    """Load the packs that provide settings for any of the given categories."""
+    wanted = set(categories)
+    for name, info in index().items():
+        if wanted.intersection(info.categories):
+            load(name)
+
+
+def load_all() -> None:
+    for name in index():
+        load(name)
+
+
+def mount(app: typer.Typer, argv: list[str] | None) -> None:
+    """Add pack sub-commands to the app.
+
+    Only the sub-command being invoked is imported; the others are mounted as
+    empty placeholders so they still show up in `mct --help`.
+
+    Args:
+        app: The main Typer app
+        argv: Command-line arguments, or None to import and mount every pack
+    """
+    invoked = next((arg for arg in argv if not arg.startswith("-")), None) if argv else None
+    for name, info in index().items():
+        if not info.has_app:
+            continue
+        real = argv is None or name == invoked
+        sub_app = load(name).app if real else typer.Typer()
+        app.add_typer(sub_app, name=name, help=info.help)
@@ -0,0 +1,252 @@
+"""Searchable index of every preference domain on the machine.
+
+`mct index` exports each domain listed by `defaults domains`, plus the global
+domain, in parallel and stores their top-level keys in a SQLite database.
+A domain is only exported again when its plist file's mtime changes, so
+refreshing the index after the first build is cheap. `mct search` queries
+the database without running `defaults` at all.
+
+Substring search goes through an FTS5 table with the trigram tokenizer, kept
+in sync with the entries table by triggers. SQLite builds without FTS5 (or
+terms shorter than a trigram) fall back to scanning the table with LIKE.
+"""
+
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from . import defaults
+
+INDEX_DB = Path.home() / ".cache" / "mct" / "index.db"
+GLOBAL_DOMAIN = "NSGlobalDomain"
+PREFERENCES_DIR = Path.home() / "Library" / "Preferences"
+CONTAINERS_DIR = Path.home() / "Library" / "Containers"
+
+# Bump when the schema changes; older index databases are rebuilt
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS domains (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    domain TEXT NOT NULL,
+    key TEXT NOT NULL,
+    type TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_domain ON entries (domain);
+"""
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE entries_fts USING fts5(
+    domain, key, value, content='entries', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER entries_fts_insert AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts (rowid, domain, key, value)
+    VALUES (new.id, new.domain, new.key, new.value);
+END;
+CREATE TRIGGER entries_fts_delete AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, domain, key, value)
+    VALUES ('delete', old.id, old.domain, old.key, old.value);
+END;
+"""
+# The trigram tokenizer cannot match anything shorter
+MIN_FTS_TERM = 3
+
+
+@dataclass
+class IndexStats:
+    """Outcome of an index refresh."""
+
+    domains: int
+    updated: int
+    removed: int
+    keys: int
+    duration: float
+
+
+@dataclass
+class Entry:
+    """A preference key found in the index."""
+
+    domain: str
+    key: str
+    type: str
+    value: str
+
+
+def list_domains() -> list[str]:
+    """Return every domain `defaults domains` knows about, plus the global one."""
+    return [GLOBAL_DOMAIN, *sorted(set(defaults.domains()) - {GLOBAL_DOMAIN})]
+
+
+def plist_mtime(domain: str) -> int | None:
+    """mtime of the plist backing a domain, or None if it cannot be found."""
+    name = ".GlobalPreferences" if domain == GLOBAL_DOMAIN else domain
+    for path in (
+        PREFERENCES_DIR / f"{name}.plist",
+        CONTAINERS_DIR / name / "Data" / "Library" / "Preferences" / f"{name}.plist",
+    ):
+        try:
+            return path.stat().st_mtime_ns
+        except OSError:
+            continue
+    return None
+
+
+def value_type(value: Any) -> str:
+    """Name of a plist value's type, using the Setting.value_type names."""
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, list):
+        return "array"
+    if isinstance(value, dict):
+        return "dict"
+    if isinstance(value, bytes):
+        return "data"
+    if isinstance(value, datetime):
+        return "date"
+    return type(value).__name__
+
+
+def _render(value: Any, limit: int = 200) -> str:
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    text = str(value)
+    return text if len(text) <= limit else text[: limit - 3] + "..."
+
+
+def connect(path: Path = INDEX_DB) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        # Only a cache: start over rather than migrate
+        conn.executescript(
+            "DROP TABLE IF EXISTS entries_fts; DROP TABLE IF EXISTS entries; DROP TABLE IF EXISTS domains;"
+        )
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.executescript(SCHEMA)
+    if not _has_fts(conn):
+        try:
+            with conn:
+                conn.executescript(f"BEGIN; {FTS_SCHEMA}")
+                # Entries indexed by a SQLite without FTS5
+                conn.execute("INSERT INTO entries_fts (entries_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError:
+            pass  # No FTS5 or trigram tokenizer; search() uses LIKE
+    return conn
+
+
+def _has_fts(conn: sqlite3.Connection) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'entries_fts'").fetchone()
+    return row is not None
+
+
+def refresh(path: Path = INDEX_DB, workers: int | None = None) -> IndexStats:
+    """Bring the index up to date, exporting only domains whose plist changed.
+
+    Args:
+        path: Index database
+        workers: Number of parallel `defaults export` processes
+
+    Raises:
+        DefaultsError: If the domains cannot be listed
+    """
+    started = time.perf_counter()
+    conn = connect(path)
+    known = dict(conn.execute("SELECT name, mtime_ns FROM domains"))
+
+    domains = list_domains()
+    mtimes = {domain: plist_mtime(domain) for domain in domains}
+    # Domains without a plist we can stat are always exported again
+    stale = [d for d in domains if mtimes[d] is None or known.get(d) != mtimes[d]]
+    removed = set(known) - set(domains)
+
+    workers = workers or min(16, (os.cpu_count() or 4) * 2)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        exported = dict(zip(stale, pool.map(defaults.export, stale)))
+
+    now = time.time()
+    with conn:
+        for domain in [*removed, *stale]:
+            conn.execute("DELETE FROM entries WHERE domain = ?", (domain,))
+            conn.execute("DELETE FROM domains WHERE name = ?", (domain,))
+        for domain, values in exported.items():
+            conn.executemany(
+                "INSERT INTO entries (domain, key, type, value) VALUES (?, ?, ?, ?)",
+                [(domain, key, value_type(v), _render(v)) for key, v in values.items()],
+            )
+            conn.execute(
+                "INSERT INTO domains (name, mtime_ns, indexed_at) VALUES (?, ?, ?)",
+                (domain, mtimes[domain], now),
+            )
+    keys = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+    conn.close()
+
+    return IndexStats(
+        domains=len(domains),
+        updated=len(stale),
+        removed=len(removed),
+        keys=keys,
+        duration=time.perf_counter() - started,
+    )
+
+
+def exists(path: Path = INDEX_DB) -> bool:
+    return path.exists()
+
+
+def search(
+    term: str,
+    domain: str | None = None,
+    limit: int = 100,
+    path: Path = INDEX_DB,
+) -> list[Entry]:
+    """Find keys whose domain, name or value contains term (case-insensitive).
+
+    Args:
+        term: Text to look for
+        domain: Only search this domain
+        limit: Maximum number of results
+        path: Index database
+    """
+    pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    match = "LIKE :pattern ESCAPE '\\'"
+    params = {"pattern": pattern, "domain": domain, "limit": limit}
+
+    conn = connect(path)
+    if _has_fts(conn) and len(term) >= MIN_FTS_TERM:
+        query = (
+            "SELECT e.domain, e.key, e.type, e.value FROM entries_fts"
+            " JOIN entries AS e ON e.id = entries_fts.rowid"
+            " WHERE entries_fts MATCH :phrase"
+        )
+        # A quoted phrase of trigrams matches the term anywhere in a column
+        params["phrase"] = '"' + term.replace('"', '""') + '"'
+    else:
+        query = (
+            "SELECT e.domain, e.key, e.type, e.value FROM entries AS e"
+            f" WHERE (e.key {match} OR e.value {match} OR e.domain {match})"
+        )
+    if domain:
+        query += " AND e.domain = :domain"
+    # Key-name matches first: they are usually what the user is after
+    query += f" ORDER BY e.key NOT {match}, e.domain, e.key LIMIT :limit"
+
+    try:
+        return [Entry(*row) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
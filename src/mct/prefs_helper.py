@@ -0,0 +1,322 @@
+"""Long-lived preferences helper, so a run forks one process instead of one per operation.
+
+The helper reads JSON requests from stdin, one per line, and answers each
+with one JSON line on stdout:
+
+    {"op": "read", "domain": "com.apple.dock", "key": "tilesize"}
+    {"ok": true, "value": 48}
+
+Operations are read, write (with "value"), delete, export (domain, and
+optionally "keys" to export only those), and array-add and dict-add, which
+like `defaults write -array-add`/`-dict-add` append the "value" list to an
+array or merge the "value" dict into a dict, creating it if missing.
+Values are plist values; data and dates are sent as {"$data": base64} and
+{"$date": iso-8601}. Failures are answered with {"ok": false, "error": ...}.
+Before the first request the helper writes a greeting line, {"ok": true,
+"version": 1}, or {"ok": false, "error": ...} if it cannot run here.
+
+By default operations go through CoreFoundation's CFPreferences API, the
+same store `defaults` uses. With ``--plist-dir DIR`` each domain is instead
+a plist file in DIR, which lets the protocol be exercised off macOS.
+
+defaults.py starts this module with ``python -I``, so it must stick to the
+standard library and avoid package-relative imports.
+"""
+
+import base64
+import ctypes
+import ctypes.util
+import json
+import os
+import plistlib
+import sys
+import tempfile
+from datetime import datetime
+from typing import Any
+
+PROTOCOL_VERSION = 1
+GLOBAL_DOMAINS = ("-g", "NSGlobalDomain", "Apple Global Domain")
+
+
+def encode(value: Any) -> dict[str, str]:
+    """json.dumps default= hook for the plist types JSON lacks."""
+    if isinstance(value, bytes):
+        return {"$data": base64.b64encode(value).decode()}
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def decode(obj: dict[str, Any]) -> Any:
+    """json.loads object_hook= counterpart of encode()."""
+    if obj.keys() == {"$data"}:
+        return base64.b64decode(obj["$data"])
+    if obj.keys() == {"$date"}:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+class PlistDirStore:
+    """Domains stored as <domain>.plist files in a directory."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, domain: str) -> str:
+        name = ".GlobalPreferences" if domain in GLOBAL_DOMAINS else domain
+        return os.path.join(self.directory, f"{name}.plist")
+
+    def export(self, domain: str, keys: list[str] | None = None) -> dict[str, Any]:
+        try:
+            with open(self.path(domain), "rb") as f:
+                data = plistlib.load(f)
+        except FileNotFoundError:
+            return {}
+        return data if keys is None else {k: data[k] for k in keys if k in data}
+
+    def save(self, domain: str, data: dict[str, Any]) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".mct-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                plistlib.dump(data, f, fmt=plistlib.FMT_BINARY)
+            os.replace(tmp, self.path(domain))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def read(self, domain: str, key: str) -> Any:
+        return self.export(domain).get(key)
+
+    def write(self, domain: str, key: str, value: Any) -> None:
+        data = self.export(domain)
+        data[key] = value
+        self.save(domain, data)
+
+    def delete(self, domain: str, key: str) -> None:
+        data = self.export(domain)
+        if data.pop(key, None) is not None:
+            self.save(domain, data)
+
+
+class CFPreferencesStore:
+    """Domains of the current user, read and written through CFPreferences.
+
+    Values cross the ctypes boundary as binary plist data, so plistlib does
+    all type conversion.
+
+    Raises:
+        OSError: If CoreFoundation cannot be loaded
+    """
+
+    UTF8 = 0x08000100  # kCFStringEncodingUTF8
+    BINARY_FORMAT = 200  # kCFPropertyListBinaryFormat_v1_0
+
+    def __init__(self):
+        path = ctypes.util.find_library("CoreFoundation")
+        if path is None:
+            raise OSError("CoreFoundation is not available")
+        cf = ctypes.CDLL(path)
+        ref = ctypes.c_void_p
+
+        signatures = {
+            "CFRelease": (None, [ref]),
+            "CFStringCreateWithCString": (ref, [ref, ctypes.c_char_p, ctypes.c_uint32]),
+            "CFDataCreate": (ref, [ref, ctypes.c_char_p, ctypes.c_long]),
+            "CFArrayCreate": (ref, [ref, ctypes.POINTER(ref), ctypes.c_long, ref]),
+            "CFDataGetLength": (ctypes.c_long, [ref]),
+            "CFDataGetBytePtr": (ref, [ref]),
+            "CFPropertyListCreateWithData": (ref, [ref, ref, ctypes.c_ulong, ref, ref]),
+            "CFPropertyListCreateData": (ref, [ref, ref, ctypes.c_long, ctypes.c_ulong, ref]),
+            "CFPreferencesCopyValue": (ref, [ref, ref, ref, ref]),
+            "CFPreferencesSetValue": (None, [ref, ref, ref, ref, ref]),
+            "CFPreferencesSynchronize": (ctypes.c_bool, [ref, ref, ref]),
+            "CFPreferencesCopyKeyList": (ref, [ref, ref, ref]),
+            "CFPreferencesCopyMultiple": (ref, [ref, ref, ref, ref]),
+        }
+        for name, (restype, argtypes) in signatures.items():
+            func = getattr(cf, name)
+            func.restype = restype
+            func.argtypes = argtypes
+
+        self.cf = cf
+        self.user = ref.in_dll(cf, "kCFPreferencesCurrentUser").value
+        self.host = ref.in_dll(cf, "kCFPreferencesAnyHost").value
+        self.any_app = ref.in_dll(cf, "kCFPreferencesAnyApplication").value
+        # A struct, so the functions take its address
+        self.array_callbacks = ctypes.addressof(ref.in_dll(cf, "kCFTypeArrayCallBacks"))
+
+    def _string(self, text: str) -> int:
+        return self.cf.CFStringCreateWithCString(None, text.encode(), self.UTF8)
+
+    def _app(self, domain: str) -> int | None:
+        """CFString for a domain; None for the global domain, which is a constant."""
+        return None if domain in GLOBAL_DOMAINS else self._string(domain)
+
+    def _to_cf(self, value: Any) -> int:
+        raw = plistlib.dumps(value, fmt=plistlib.FMT_BINARY)
+        data = self.cf.CFDataCreate(None, raw, len(raw))
+        try:
+            plist = self.cf.CFPropertyListCreateWithData(None, data, 0, None, None)
+        finally:
+            self.cf.CFRelease(data)
+        if not plist:
+            raise ValueError(f"Cannot convert {value!r} to a property list")
+        return plist
+
+    def _from_cf(self, plist: int) -> Any:
+        data = self.cf.CFPropertyListCreateData(None, plist, self.BINARY_FORMAT, 0, None)
+        if not data:
+            raise ValueError("Cannot serialise property list")
+        try:
+            raw = ctypes.string_at(self.cf.CFDataGetBytePtr(data), self.cf.CFDataGetLength(data))
+        finally:
+            self.cf.CFRelease(data)
+        return plistlib.loads(raw)
+
+    def _with_app(self, domain: str, action):
+        app = self._app(domain)
+        try:
+            return action(app or self.any_app)
+        finally:
+            if app:
+                self.cf.CFRelease(app)
+
+    def _with_key(self, key: str, action):
+        cf_key = self._string(key)
+        try:
+            return action(cf_key)
+        finally:
+            self.cf.CFRelease(cf_key)
+
+    def read(self, domain: str, key: str) -> Any:
+        def action(app):
+            value = self._with_key(
+                key, lambda cf_key: self.cf.CFPreferencesCopyValue(cf_key, app, self.user, self.host)
+            )
+            if not value:
+                return None
+            try:
+                return self._from_cf(value)
+            finally:
+                self.cf.CFRelease(value)
+
+        return self._with_app(domain, action)
+
+    def _set(self, domain: str, key: str, value: int | None) -> None:
+        def action(app):
+            self._with_key(
+                key, lambda cf_key: self.cf.CFPreferencesSetValue(cf_key, value, app, self.user, self.host)
+            )
+            if not self.cf.CFPreferencesSynchronize(app, self.user, self.host):
+                raise OSError(f"Failed to synchronize {domain}")
+
+        self._with_app(domain, action)
+
+    def write(self, domain: str, key: str, value: Any) -> None:
+        plist = self._to_cf(value)
+        try:
+            self._set(domain, key, plist)
+        finally:
+            self.cf.CFRelease(plist)
+
+    def delete(self, domain: str, key: str) -> None:
+        self._set(domain, key, None)
+
+    def _key_array(self, keys: list[str]) -> int:
+        strings = [self._string(key) for key in keys]
+        try:
+            items = (ctypes.c_void_p * len(strings))(*strings)
+            # The array retains the strings
+            return self.cf.CFArrayCreate(None, items, len(strings), self.array_callbacks)
+        finally:
+            for string in strings:
+                self.cf.CFRelease(string)
+
+    def export(self, domain: str, keys: list[str] | None = None) -> dict[str, Any]:
+        def action(app):
+            if keys is None:
+                cf_keys = self.cf.CFPreferencesCopyKeyList(app, self.user, self.host)
+            else:
+                cf_keys = self._key_array(keys)
+            if not cf_keys:
+                return {}
+            try:
+                values = self.cf.CFPreferencesCopyMultiple(cf_keys, app, self.user, self.host)
+            finally:
+                self.cf.CFRelease(cf_keys)
+            try:
+                return self._from_cf(values)
+            finally:
+                self.cf.CFRelease(values)
+
+        return self._with_app(domain, action)
+
+
+def _add(store, op: str, domain: str, key: str, value: Any) -> None:
+    """Append to an array or merge into a dict, as `defaults write -array-add`/`-dict-add` do."""
+    kind = list if op == "array-add" else dict
+    if not isinstance(value, kind):
+        raise ValueError(f"{op} needs a {kind.__name__} value")
+    current = store.read(domain, key)
+    if current is None:
+        current = kind()
+    if not isinstance(current, kind):
+        raise ValueError(f"{domain} {key} is not a {kind.__name__}")
+    store.write(domain, key, current + value if kind is list else {**current, **value})
+
+
+def handle(store, request: dict[str, Any]) -> dict[str, Any]:
+    """Perform one request against a store and build its response."""
+    op = request.get("op")
+    try:
+        if op == "read":
+            return {"ok": True, "value": store.read(request["domain"], request["key"])}
+        if op == "write":
+            store.write(request["domain"], request["key"], request["value"])
+            return {"ok": True}
+        if op == "delete":
+            store.delete(request["domain"], request["key"])
+            return {"ok": True}
+        if op == "export":
+            return {"ok": True, "value": store.export(request["domain"], request.get("keys"))}
+        if op in ("array-add", "dict-add"):
+            _add(store, op, request["domain"], request["key"], request["value"])
+            return {"ok": True}
+        return {"ok": False, "error": f"Unknown operation: {op!r}"}
+    except KeyError as e:
+        return {"ok": False, "error": f"Missing field {e}"}
+    except (OSError, ValueError, TypeError) as e:
+        return {"ok": False, "error": str(e)}
+
+
+def _send(response: dict[str, Any]) -> None:
+    sys.stdout.write(json.dumps(response, default=encode) + "\n")
+    sys.stdout.flush()
+
+
+def main(argv: list[str]) -> int:
+    try:
+        if argv[:1] == ["--plist-dir"] and len(argv) == 2:
+            store = PlistDirStore(argv[1])
+        elif not argv:
+            store = CFPreferencesStore()
+        else:
+            raise ValueError("usage: prefs_helper.py [--plist-dir DIR]")
+    except (OSError, ValueError) as e:
+        _send({"ok": False, "error": str(e)})
+        return 1
+
+    _send({"ok": True, "version": PROTOCOL_VERSION})
+    for line in sys.stdin:
+        try:
+            request = json.loads(line, object_hook=decode)
+        except json.JSONDecodeError as e:
+            _send({"ok": False, "error": f"Invalid request: {e}"})
+            continue
+        _send(handle(store, request))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
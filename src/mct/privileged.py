@@ -0,0 +1,147 @@
+"""Privileged helper for editing system files such as the sudo PAM config.
+
+The checks, backup, edit and verification for an operation all happen in one
+elevated process so that the user is prompted for sudo at most once. The
+module doubles as the helper script: run() re-executes this file under sudo
+with ``python -I``, so everything below must stick to the standard library and
+avoid package-relative imports.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from dataclasses import asdict, dataclass
+
+PAM_SUDO = "/etc/pam.d/sudo"
+PAM_BACKUP = "/etc/pam.d/sudo.bak"
+PAM_SUDO_LOCAL = "/etc/pam.d/sudo_local"
+TOUCHID_LINE = "auth sufficient pam_tid.so"
+
+
+@dataclass
+class Result:
+    """Outcome of a privileged operation."""
+
+    ok: bool
+    changed: bool = False
+    backed_up: bool = False
+    restored: bool = False
+    message: str = ""
+
+
+def _read(path: str) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+def sha256(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def write_atomic(path: str, text: str, like: str | None = None) -> None:
+    """Replace path with text via a temp file in the same directory.
+
+    The new file keeps the mode and owner of `like` (default: path itself),
+    or gets mode 0644 if that file does not exist.
+    """
+    like = like or path
+    st = os.stat(like) if os.path.exists(like) else None
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".mct-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            if st is not None:
+                os.fchmod(f.fileno(), st.st_mode & 0o7777)
+                if (st.st_uid, st.st_gid) != (os.geteuid(), os.getegid()):
+                    os.fchown(f.fileno(), st.st_uid, st.st_gid)
+            else:
+                os.fchmod(f.fileno(), 0o644)
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def restore_backup() -> Result:
+    """Restore the sudo PAM file from its backup and verify the copy."""
+    if not os.path.exists(PAM_BACKUP):
+        return Result(ok=False, message=f"No backup file found at {PAM_BACKUP}")
+
+    saved = _read(PAM_BACKUP)
+    write_atomic(PAM_SUDO, saved, like=PAM_SUDO)
+    if _read(PAM_SUDO) != saved:
+        return Result(ok=False, message="Verification failed")
+    return Result(ok=True, changed=True, restored=True)
+
+
+def write_file(path: str, expected: str, backup: str = "") -> Result:
+    """Replace path with the text on stdin if it still hashes to `expected`.
+
+    Args:
+        path: File to write
+        expected: SHA-256 of the content the caller planned against, or ''
+            if the file should not exist yet
+        backup: Where to copy the current content first, or '' for no backup
+    """
+    text = sys.stdin.read()
+    exists = os.path.exists(path)
+    old = _read(path) if exists else ""
+    if (sha256(old) if exists else "") != expected:
+        return Result(ok=False, message=f"{path} changed since it was read")
+
+    backed_up = bool(backup) and exists
+    if backed_up:
+        write_atomic(backup, old, like=path)
+    write_atomic(path, text)
+    if sha256(_read(path)) != sha256(text):
+        return Result(ok=False, backed_up=backed_up, message="Verification failed")
+    return Result(ok=True, changed=True, backed_up=backed_up)
+
+
+ACTIONS = {
+    "restore-backup": restore_backup,
+    "write-file": write_file,
+}
+
+
+def run(action: str, *args: str, input: str | None = None) -> Result:
+    """Run an action in a single elevated helper process.
+
+    Args:
+        action: One of ACTIONS
+        *args: Arguments passed through to the action
+        input: Text passed to the helper on stdin
+
+    Returns:
+        The helper's Result; ok is False if the helper could not run
+    """
+    cmd = [sys.executable, "-I", os.path.abspath(__file__), action, *args]
+    if os.geteuid() != 0:
+        cmd = ["sudo", *cmd]
+
+    proc = subprocess.run(cmd, input=input, capture_output=True, text=True)
+    try:
+        return Result(**json.loads(proc.stdout))
+    except (json.JSONDecodeError, TypeError):
+        message = proc.stderr.strip() or f"helper exited with status {proc.returncode}"
+        return Result(ok=False, message=message)
+
+
+def main(argv: list[str]) -> int:
+    action, *args = argv
+    try:
+        result = ACTIONS[action](*args)
+    except OSError as e:
+        result = Result(ok=False, message=str(e))
+    print(json.dumps(asdict(result)))
+    return 0 if result.ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,197 @@
+"""Named profiles and fast switching between them.
+
+Profiles are config files in ~/.config/mct/profiles, e.g. presenting.yaml,
+switched to with `mct profile switch presenting`. Switching does not diff the
+whole profile against the system. Instead:
+
+- The key-level delta between every pair of profiles is precomputed and kept
+  in the state file until a profile changes.
+- The state file also records the active profile, the values mct last saw or
+  wrote for profile settings, and the mtime of each domain's plist then.
+
+A switch from the active profile writes the keys in the precomputed delta,
+plus any key of the target profile whose domain's plist changed since it was
+recorded; only those domains are exported again. Apps are restarted only for
+keys that actually change.
+"""
+
+import hashlib
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from . import defaults, prefs_helper, privileged
+from .config import (
+    CONFIG_PATH,
+    SETTINGS,
+    STATE_DIR,
+    ConfigDiff,
+    WriteError,
+    apps_to_restart,
+    compute_diff,
+    group_writes,
+    read_current_state,
+    values_equal,
+    write_diffs,
+)
+from .prefindex import plist_mtime
+
+PROFILES_DIR = CONFIG_PATH.parent / "profiles"
+STATE_PATH = STATE_DIR / "profiles.json"
+
+
+@dataclass
+class Switch:
+    """Outcome of switching profiles."""
+
+    name: str
+    changes: list[ConfigDiff]
+    restart: list[str]
+    previous: str | None  # Profile that was active before
+    reread: list[str]  # Domains exported because they changed or were unknown
+
+
+def list_profiles(directory: Path = PROFILES_DIR) -> dict[str, Path]:
+    """Profile names and their files, sorted by name."""
+    if not directory.is_dir():
+        return {}
+    paths = sorted(p for p in directory.iterdir() if p.suffix in (".yaml", ".yml"))
+    return {p.stem: p for p in paths}
+
+
+def load_state(path: Path = STATE_PATH) -> dict[str, Any]:
+    try:
+        return json.loads(path.read_text(), object_hook=prefs_helper.decode)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state: dict[str, Any], path: Path = STATE_PATH) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    privileged.write_atomic(str(path), json.dumps(state, default=prefs_helper.encode))
+
+
+def _digest(config: dict[str, Any]) -> str:
+    text = json.dumps(config, sort_keys=True, default=prefs_helper.encode)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def delta(source: dict[str, Any], target: dict[str, Any]) -> dict[str, Any]:
+    """Values of target that switching from source has to write."""
+    return {
+        k: v
+        for k, v in target.items()
+        if k not in source or not values_equal(source[k], v, SETTINGS[k].value_type)
+    }
+
+
+def precompute(state: dict[str, Any], profiles: dict[str, dict[str, Any]]) -> None:
+    """Bring the pairwise deltas in state up to date with the profiles.
+
+    Args:
+        state: Profile state, updated in place
+        profiles: Flattened settings of every profile, by name
+    """
+    digests = {name: _digest(config) for name, config in profiles.items()}
+    if state.get("digests") == digests:
+        return
+    state["digests"] = digests
+    state["deltas"] = {
+        source: {
+            target: delta(profiles[source], profiles[target])
+            for target in profiles
+            if target != source
+        }
+        for source in profiles
+    }
+
+
+def switch(
+    name: str,
+    profiles: dict[str, dict[str, Any]],
+    dry_run: bool = False,
+    path: Path = STATE_PATH,
+) -> Switch:
+    """Make the system match a profile, writing as little as possible.
+
+    Args:
+        name: Profile to switch to
+        profiles: Flattened settings of every profile, by name; keys that
+            are not registry settings are ignored
+        dry_run: If True, work out the changes without writing them
+        path: State file
+
+    Raises:
+        KeyError: If there is no profile with that name
+        WriteError: If writes to some domains failed, after the apps of the
+            other domains have been restarted and the state file updated
+    """
+    profiles = {n: {k: v for k, v in c.items() if k in SETTINGS} for n, c in profiles.items()}
+    target = profiles[name]
+    state = load_state(path)
+    precompute(state, profiles)
+
+    active = state.get("active")
+    known: dict[str, Any] = state.get("values", {})
+    mtimes: dict[str, int | None] = state.get("mtimes", {})
+
+    by_domain: dict[str, list[str]] = {}
+    for key in target:
+        by_domain.setdefault(SETTINGS[key].domain, []).append(key)
+
+    # A domain is trusted if its plist is unchanged since it was recorded
+    current_mtimes = {domain: plist_mtime(domain) for domain in by_domain}
+    stale = [
+        domain
+        for domain, keys in by_domain.items()
+        if current_mtimes[domain] is None
+        or mtimes.get(domain) != current_mtimes[domain]
+        or any(k not in known for k in keys)
+    ]
+
+    if active in profiles and active != name:
+        candidates = set(state["deltas"][active][name])
+    else:
+        candidates = set(target)
+    candidates |= {k for domain in stale for k in by_domain[domain]}
+
+    stale_keys = [k for domain in stale for k in by_domain[domain]]
+    fresh = read_current_state(stale_keys)
+    # None records a setting known to be unset
+    known.update({k: fresh.get(k) for k in stale_keys})
+
+    diffs = compute_diff({k: v for k, v in target.items() if k in candidates}, known)
+    restart = apps_to_restart(diffs)
+    result = Switch(name=name, changes=diffs, restart=restart, previous=active, reread=stale)
+    if dry_run:
+        return result
+
+    applied = diffs
+    error: WriteError | None = None
+    try:
+        write_diffs(group_writes(diffs))
+    except WriteError as e:
+        applied, error = e.applied, e
+    # The domains that were written still need their apps restarted
+    for app in apps_to_restart(applied):
+        defaults.restart_app(app)
+
+    for d in applied:
+        known[d.key] = d.desired
+    if error is None:
+        state["active"] = name
+    else:
+        # Unwritten keys are read again next time, and with no profile active
+        # the next switch diffs every key of its target instead of a delta
+        written = {d.key for d in applied}
+        for d in diffs:
+            if d.key not in written:
+                known.pop(d.key, None)
+        state["active"] = None
+    state["values"] = known
+    state["mtimes"] = {**mtimes, **{domain: plist_mtime(domain) for domain in by_domain}}
+    save_state(state, path)
+    if error is not None:
+        raise error
+    return result
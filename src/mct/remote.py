@@ -0,0 +1,150 @@
+"""Configs fetched over HTTP(S), cached locally with conditional requests.
+
+Each URL's last response is kept under ~/.cache/mct/remote together with its
+ETag and Last-Modified headers. Later fetches send If-None-Match and
+If-Modified-Since, so an unchanged config costs one empty 304 response, and
+the cached copy is used when the server cannot be reached.
+
+After a config has been applied (or found in sync), the mtimes of the plist
+files and system files it covers are recorded. If the server then answers
+304 and none of those files has changed, the system is still in sync and
+the config need not be parsed or diffed at all.
+"""
+
+import hashlib
+import json
+import os
+import urllib.error
+import urllib.request
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from . import privileged
+from .prefindex import plist_mtime
+
+CACHE_DIR = Path.home() / ".cache" / "mct" / "remote"
+TIMEOUT = 10.0
+
+
+class RemoteConfigError(Exception):
+    """A remote config could not be fetched and no cached copy exists."""
+
+
+def is_url(location: str | None) -> bool:
+    return bool(location) and location.startswith(("http://", "https://"))
+
+
+@dataclass
+class RemoteConfig:
+    """The body of a remote config and where it came from."""
+
+    url: str
+    text: str
+    not_modified: bool = False  # The server confirmed the cached copy (304)
+    offline: bool = False  # The server was unreachable; text is the cached copy
+    meta: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def sha256(self) -> str:
+        return hashlib.sha256(self.text.encode()).hexdigest()
+
+    def in_sync(self) -> bool:
+        """Whether the system is known to match this config without diffing it.
+
+        True only for a 304 response when every file recorded by the last
+        mark_synced() for this exact body still has its recorded mtime.
+        """
+        synced = self.meta.get("synced")
+        if not self.not_modified or not synced or synced.get("sha256") != self.sha256:
+            return False
+        return synced["mtimes"] == _mtimes(synced["domains"], synced["files"])
+
+    def mark_synced(self, domains: list[str], files: list[str], cache_dir: Path = CACHE_DIR) -> None:
+        """Record that the system matches this config, for in_sync() to check later.
+
+        Args:
+            domains: Preference domains of the config's settings
+            files: Paths of the system files the config manages
+        """
+        mtimes = _mtimes(sorted(domains), sorted(files))
+        if None in mtimes.values():
+            # A file we cannot stat could change unnoticed
+            self.meta.pop("synced", None)
+        else:
+            self.meta["synced"] = {
+                "sha256": self.sha256,
+                "domains": sorted(domains),
+                "files": sorted(files),
+                "mtimes": mtimes,
+            }
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        privileged.write_atomic(str(_paths(self.url, cache_dir)[1]), json.dumps(self.meta))
+
+
+def _mtimes(domains: list[str], files: list[str]) -> dict[str, int | None]:
+    mtimes = {f"domain:{d}": plist_mtime(d) for d in domains}
+    for path in files:
+        try:
+            mtimes[f"file:{path}"] = os.stat(path).st_mtime_ns
+        except OSError:
+            mtimes[f"file:{path}"] = None
+    return mtimes
+
+
+def _paths(url: str, cache_dir: Path) -> tuple[Path, Path]:
+    """Cached body and metadata files of a URL."""
+    name = hashlib.sha256(url.encode()).hexdigest()[:24]
+    return cache_dir / f"{name}.yaml", cache_dir / f"{name}.json"
+
+
+def fetch(url: str, timeout: float = TIMEOUT, cache_dir: Path = CACHE_DIR) -> RemoteConfig:
+    """Fetch a config, revalidating the cached copy if there is one.
+
+    Args:
+        url: http:// or https:// URL of a YAML config
+        timeout: Seconds to wait for the server
+        cache_dir: Where responses are cached
+
+    Raises:
+        RemoteConfigError: If the server fails and nothing is cached
+    """
+    body_path, meta_path = _paths(url, cache_dir)
+    try:
+        meta = json.loads(meta_path.read_text())
+        cached = body_path.read_text()
+    except (OSError, ValueError):
+        meta, cached = {}, None
+
+    request = urllib.request.Request(url, headers={"Accept": "application/yaml, text/yaml, */*"})
+    if cached is not None:
+        if meta.get("etag"):
+            request.add_header("If-None-Match", meta["etag"])
+        if meta.get("last_modified"):
+            request.add_header("If-Modified-Since", meta["last_modified"])
+
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            text = response.read().decode()
+            headers = response.headers
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached is not None:
+            return RemoteConfig(url, cached, not_modified=True, meta=meta)
+        if cached is not None and e.code >= 500:
+            return RemoteConfig(url, cached, offline=True, meta=meta)
+        raise RemoteConfigError(f"Failed to fetch {url}: HTTP {e.code} {e.reason}") from None
+    except (urllib.error.URLError, OSError, UnicodeDecodeError) as e:
+        if cached is not None:
+            return RemoteConfig(url, cached, offline=True, meta=meta)
+        reason = getattr(e, "reason", e)
+        raise RemoteConfigError(f"Failed to fetch {url}: {reason}") from None
+
+    synced = meta.get("synced")
+    meta = {"url": url, "etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}
+    if synced and text == cached:
+        # Same body after all: what was recorded for it still holds
+        meta["synced"] = synced
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    privileged.write_atomic(str(body_path), text)
+    privileged.write_atomic(str(meta_path), json.dumps(meta))
+    return RemoteConfig(url, text, meta=meta)
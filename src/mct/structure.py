@@ -0,0 +1,94 @@
+"""Structural diffs of array and dict setting values.
+
+Arrays are compared element by element: elements only in the old array are
+removals, elements only in the new one are insertions, and an element that
+was removed in one place and inserted in another is a move. Dicts are
+compared key by key.
+"""
+
+import difflib
+import json
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass
+class Change:
+    """One element-level change between two arrays or dicts."""
+
+    op: str  # 'insert', 'remove' or 'move' for arrays; 'set' or 'delete' for dicts
+    key: Any  # Array index (in the new array for insert/move) or dict key
+    value: Any = None
+    old: Any = None  # Previous value, or previous index for a move
+
+
+def _canonical(value: Any) -> str:
+    """Hashable form of a plist value, so dict elements can be matched."""
+    return json.dumps(value, sort_keys=True, default=repr)
+
+
+def diff_array(old: list[Any], new: list[Any]) -> list[Change]:
+    """Return the insertions, removals and moves that turn old into new."""
+    a = [_canonical(v) for v in old]
+    b = [_canonical(v) for v in new]
+
+    removed: list[int] = []
+    inserted: list[int] = []
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag in ("delete", "replace"):
+            removed.extend(range(i1, i2))
+        if tag in ("insert", "replace"):
+            inserted.extend(range(j1, j2))
+
+    # An element removed in one place and inserted in another has moved
+    changes = []
+    for j in inserted:
+        source = next((i for i in removed if a[i] == b[j]), None)
+        if source is None:
+            changes.append(Change("insert", j, new[j]))
+        else:
+            removed.remove(source)
+            changes.append(Change("move", j, new[j], old=source))
+    changes.extend(Change("remove", i, old[i]) for i in removed)
+    return sorted(changes, key=lambda c: (c.op == "remove", c.key))
+
+
+def diff_dict(old: dict[str, Any], new: dict[str, Any]) -> list[Change]:
+    """Return the keys that were added, changed or deleted."""
+    changes = [
+        Change("set", key, value, old=old.get(key))
+        for key, value in new.items()
+        if key not in old or old[key] != value
+    ]
+    changes.extend(Change("delete", key, old=value) for key, value in old.items() if key not in new)
+    return changes
+
+
+def diff_value(old: Any, new: Any) -> list[Change] | None:
+    """Structural diff of two arrays or two dicts, or None for other values."""
+    if isinstance(old, list) and isinstance(new, list):
+        return diff_array(old, new)
+    if isinstance(old, dict) and isinstance(new, dict):
+        return diff_dict(old, new)
+    return None
+
+
+def _short(value: Any, limit: int = 60) -> str:
+    text = repr(value)
+    return text if len(text) <= limit else text[: limit - 3] + "..."
+
+
+def describe(change: Change) -> str:
+    """One-line description of a change, e.g. '+ [3] Safari'."""
+    if change.op == "insert":
+        return f"+ [{change.key}] {_short(change.value)}"
+    if change.op == "remove":
+        return f"- [{change.key}] {_short(change.value)}"
+    if change.op == "move":
+        return f"~ [{change.old}] -> [{change.key}] {_short(change.value)}"
+    if change.op == "delete":
+        return f"- {change.key}: {_short(change.old)}"
+    if change.old is None:
+        return f"+ {change.key}: {_short(change.value)}"
+    return f"~ {change.key}: {_short(change.old)} -> {_short(change.value)}"
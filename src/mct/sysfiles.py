@@ -0,0 +1,286 @@
+"""Declarative management of system files such as /etc/pam.d/sudo.
+
+Files are parsed in memory, line-level edits are applied to the parsed lines,
+and the result is written atomically next to the original. The hash of each
+file's content is recorded once it is known to satisfy its edits, so repeat
+runs skip reading and re-parsing files that have not changed.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+from . import privileged
+from .config import STATE_DIR, normalize
+
+HASHES_PATH = STATE_DIR / "files.json"
+
+
+@dataclass
+class LineEdit:
+    """A line that must be present in (or absent from) a file."""
+
+    line: str
+    present: bool = True
+    position: str = "top"  # Where to insert a missing line: 'top' or 'bottom'
+
+
+@dataclass
+class FileSetting:
+    """A boolean config setting backed by lines in a system file."""
+
+    path: str
+    lines: list[str]
+    position: str = "top"
+    description: str = ""
+
+    def edits(self, enabled: bool) -> list[LineEdit]:
+        """Edits that make the file match `enabled`."""
+        return [LineEdit(line, present=enabled, position=self.position) for line in self.lines]
+
+
+@dataclass
+class FileDiff:
+    """A managed file whose content differs from its config setting."""
+
+    key: str
+    path: Path
+    current: bool
+    desired: Any
+    old_text: str
+    new_text: str
+    existed: bool = True
+
+
+@dataclass
+class _Parsed:
+    """File content split into lines, with the tokens of each active line."""
+
+    lines: list[str] = field(default_factory=list)
+    tokens: list[tuple[str, ...]] = field(default_factory=list)
+
+
+# Registry of managed system files
+# Format: config_key -> FileSetting
+FILES: dict[str, FileSetting] = {
+    "system.touchid_sudo": FileSetting(
+        path=privileged.PAM_SUDO,
+        lines=[privileged.TOUCHID_LINE],
+        description="Allow Touch ID to authenticate sudo",
+    ),
+    # Included by /etc/pam.d/sudo since macOS 14 and kept across OS updates
+    "system.touchid_sudo_local": FileSetting(
+        path=privileged.PAM_SUDO_LOCAL,
+        lines=[privileged.TOUCHID_LINE],
+        description="Allow Touch ID to authenticate sudo via sudo_local (macOS 14+)",
+    ),
+}
+
+
+def enabled(key: str, value: Any) -> bool:
+    """The bool a file setting's config value stands for.
+
+    Raises:
+        ValueError: If the value is not a boolean such as true, "off" or 0
+    """
+    flag = normalize(value, "bool")
+    if not isinstance(flag, bool):
+        raise ValueError(f"{key} must be true or false, not {value!r}")
+    return flag
+
+
+def _tokens(line: str) -> tuple[str, ...]:
+    """Whitespace-insensitive form of a line; comments and blanks are empty."""
+    stripped = line.strip()
+    if not stripped or stripped.startswith("#"):
+        return ()
+    return tuple(stripped.split())
+
+
+def parse(text: str) -> _Parsed:
+    """Split file text into lines for editing."""
+    lines = text.splitlines()
+    return _Parsed(lines=lines, tokens=[_tokens(line) for line in lines])
+
+
+def render(parsed: _Parsed) -> str:
+    return "".join(f"{line}\n" for line in parsed.lines)
+
+
+def apply_edits(text: str, edits: list[LineEdit]) -> str:
+    """Return text with edits applied; the same text means nothing to do."""
+    parsed = parse(text)
+    changed = False
+    for edit in edits:
+        want = _tokens(edit.line)
+        matches = [i for i, tokens in enumerate(parsed.tokens) if tokens == want]
+        if edit.present and not matches:
+            index = 0 if edit.position == "top" else len(parsed.lines)
+            parsed.lines.insert(index, edit.line)
+            parsed.tokens.insert(index, want)
+            changed = True
+        elif not edit.present and matches:
+            for i in reversed(matches):
+                del parsed.lines[i]
+                del parsed.tokens[i]
+            changed = True
+    return render(parsed) if changed else text
+
+
+def _resolve(path: str, root: Path) -> Path:
+    return root / path.lstrip("/")
+
+
+def _spec_hash(edits: list[LineEdit]) -> str:
+    return hashlib.sha256(json.dumps([asdict(e) for e in edits]).encode()).hexdigest()
+
+
+def _load_hashes(state_path: Path) -> dict[str, dict[str, Any]]:
+    try:
+        return json.loads(state_path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_hashes(state_path: Path, hashes: dict[str, dict[str, Any]]) -> None:
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    privileged.write_atomic(str(state_path), json.dumps(hashes, indent=2, sort_keys=True))
+
+
+def _record(hashes: dict, path: Path, spec: str, text: str) -> None:
+    st = path.stat()
+    hashes[str(path)] = {
+        "spec": spec,
+        "sha256": privileged.sha256(text),
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+    }
+
+
+def compute_file_diffs(
+    config: dict[str, Any],
+    root: Path = Path("/"),
+    state_path: Path = HASHES_PATH,
+) -> list[FileDiff]:
+    """Compute differences between config and managed system files.
+
+    Args:
+        config: Flattened config dict; keys not in FILES are ignored
+        root: Directory that managed paths are relative to
+        state_path: Where content hashes are recorded
+
+    Returns:
+        List of FileDiff for files that need changes
+
+    Raises:
+        ValueError: If a setting's value is not a boolean
+    """
+    hashes = _load_hashes(state_path)
+    dirty = False
+    diffs = []
+
+    for key, desired in config.items():
+        if key not in FILES:
+            continue
+
+        setting = FILES[key]
+        path = _resolve(setting.path, root)
+        flag = enabled(key, desired)
+        edits = setting.edits(flag)
+        spec = _spec_hash(edits)
+        known = hashes.get(str(path))
+
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            st = None
+
+        # Unchanged since it was last known to be in sync: skip all work
+        if (
+            st is not None
+            and known is not None
+            and known["spec"] == spec
+            and (known["mtime_ns"], known["size"]) == (st.st_mtime_ns, st.st_size)
+        ):
+            continue
+
+        text = path.read_text() if st is not None else ""
+        if known is not None and known["spec"] == spec and known["sha256"] == privileged.sha256(text):
+            _record(hashes, path, spec, text)
+            dirty = True
+            continue
+
+        new_text = apply_edits(text, edits)
+        if new_text == text:
+            if st is not None:
+                _record(hashes, path, spec, text)
+                dirty = True
+            continue
+
+        current = not flag
+        diffs.append(
+            FileDiff(
+                key=key,
+                path=path,
+                current=current,
+                desired=desired,
+                old_text=text,
+                new_text=new_text,
+                existed=st is not None,
+            )
+        )
+
+    if dirty:
+        _save_hashes(state_path, hashes)
+    return diffs
+
+
+def backup_path(path: Path) -> Path:
+    """Where apply_file_diffs(backup=True) keeps the previous content of path."""
+    return path.with_name(f"{path.name}.bak")
+
+
+def apply_file_diffs(
+    diffs: list[FileDiff],
+    state_path: Path = HASHES_PATH,
+    backup: bool = False,
+) -> None:
+    """Write managed files, elevating through the privileged helper if needed.
+
+    Args:
+        diffs: Result of compute_file_diffs()
+        state_path: Where content hashes are recorded
+        backup: Copy each existing file to backup_path() before replacing it
+
+    Raises:
+        PermissionError: If the privileged helper fails to write a file
+    """
+    if not diffs:
+        return
+
+    hashes = _load_hashes(state_path)
+    for diff in diffs:
+        expected = privileged.sha256(diff.old_text) if diff.existed else ""
+        saved = str(backup_path(diff.path)) if backup and diff.existed else ""
+        if os.access(diff.path.parent, os.W_OK) and (
+            not diff.existed or os.access(diff.path, os.W_OK)
+        ):
+            current = privileged.sha256(diff.path.read_text()) if diff.path.exists() else ""
+            if current != expected:
+                raise PermissionError(f"Failed to write {diff.path}: changed since it was read")
+            if saved:
+                privileged.write_atomic(saved, diff.old_text, like=str(diff.path))
+            privileged.write_atomic(str(diff.path), diff.new_text)
+        else:
+            args = [str(diff.path), expected] + ([saved] if saved else [])
+            result = privileged.run("write-file", *args, input=diff.new_text)
+            if not result.ok:
+                raise PermissionError(f"Failed to write {diff.path}: {result.message}")
+
+        spec = _spec_hash(FILES[diff.key].edits(enabled(diff.key, diff.desired)))
+        _record(hashes, diff.path, spec, diff.new_text)
+
+    _save_hashes(state_path, hashes)
@@ -0,0 +1,156 @@
+"""Applying a config to several local user accounts at once.
+
+`mct apply --users all` (run as root) resolves each account's home, then
+applies the config to every account concurrently through the async API:
+
+- Accounts with a login session go through `defaults` run as that user
+  (`launchctl asuser UID sudo -u USER`), so their cfprefsd sees the change,
+  and their apps are restarted.
+- Accounts without a session have their plist files written directly, as
+  nothing is running that caches or uses them.
+"""
+
+import asyncio
+import os
+import pwd
+import subprocess
+import sys
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from . import api
+from .config import ConfigDiff
+
+USERS_DIR = Path("/Users")
+# macOS gives the first account created uid 501; lower ones are system accounts
+MIN_UID = 501
+WORKERS = 4
+
+
+@dataclass
+class User:
+    """A local account and where its preferences live."""
+
+    name: str
+    home: Path
+    uid: int
+    gid: int
+
+    @property
+    def preferences(self) -> Path:
+        return self.home / "Library" / "Preferences"
+
+
+@dataclass
+class UserResult:
+    """Outcome of applying a config to one account."""
+
+    user: User
+    changes: list[ConfigDiff] = field(default_factory=list)
+    restarted: list[str] = field(default_factory=list)
+    logged_in: bool = False
+    error: str | None = None
+
+
+def _from_home(home: Path) -> User:
+    info = home.stat()
+    return User(name=home.name, home=home, uid=info.st_uid, gid=info.st_gid)
+
+
+def resolve(spec: str, users_dir: Path = USERS_DIR) -> list[User]:
+    """Resolve 'all' or a comma-separated list of account names.
+
+    'all' means every home directory in users_dir owned by a regular
+    account. Named accounts are looked up in users_dir, then in the
+    password database.
+
+    Raises:
+        ValueError: If an account has no home directory
+    """
+    if spec == "all":
+        homes = sorted(p for p in users_dir.iterdir() if p.is_dir() and not p.name.startswith("."))
+        return [user for user in map(_from_home, homes) if user.uid >= MIN_UID]
+
+    users = []
+    for name in (n.strip() for n in spec.split(",")):
+        if not name:
+            continue
+        home = users_dir / name
+        if not home.is_dir():
+            try:
+                home = Path(pwd.getpwnam(name).pw_dir)
+            except KeyError:
+                raise ValueError(f"Unknown user: {name}") from None
+        if not home.is_dir():
+            raise ValueError(f"Home directory of {name} not found: {home}")
+        users.append(_from_home(home))
+    return users
+
+
+def sessions() -> set[str]:
+    """Names of accounts with a login session, i.e. running loginwindow."""
+    try:
+        result = subprocess.run(
+            ["ps", "-axo", "user=,comm="], capture_output=True, text=True, timeout=10
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return set()
+    return {
+        line.split(None, 1)[0]
+        for line in result.stdout.splitlines()
+        if line.rstrip().endswith("/loginwindow")
+    }
+
+
+def backend_for(user: User, logged_in: bool) -> api.Backend:
+    """`defaults` as the user for logged-in accounts on macOS, plist files otherwise."""
+    if logged_in and sys.platform == "darwin":
+        if os.getuid() == user.uid:
+            return api.SubprocessBackend()
+        prefix = ("launchctl", "asuser", str(user.uid), "sudo", "-u", user.name)
+        return api.SubprocessBackend(prefix=prefix)
+    owner = user.uid if os.getuid() == 0 else None
+    return api.PlistFileBackend(str(user.preferences), uid=owner, gid=user.gid, home=str(user.home))
+
+
+async def apply_users(
+    users: list[User],
+    config: dict[str, Any],
+    dry_run: bool = False,
+    workers: int = WORKERS,
+    logged_in: set[str] | None = None,
+    backend: Callable[[User, bool], api.Backend] = backend_for,
+) -> list[UserResult]:
+    """Apply a flattened config to every account, at most workers at a time.
+
+    A failure for one account is recorded in its result and does not stop
+    the others.
+
+    Args:
+        users: Accounts to apply to
+        config: Flattened config dict
+        dry_run: If True, only compute each account's changes
+        workers: Most accounts being applied at once
+        logged_in: Accounts with a session (default: detected with sessions())
+        backend: Picks the backend of an account, given whether it is logged in
+    """
+    logged_in = sessions() if logged_in is None else logged_in
+    semaphore = asyncio.Semaphore(workers)
+
+    async def one(user: User) -> UserResult:
+        result = UserResult(user, logged_in=user.name in logged_in)
+        async with semaphore:
+            try:
+                result.changes = await api.apply(
+                    config,
+                    dry_run=dry_run,
+                    backend=backend(user, result.logged_in),
+                    restarted=result.restarted,
+                )
+            except (api.DefaultsError, OSError, ValueError) as e:
+                result.error = str(e)
+        return result
+
+    return await asyncio.gather(*(one(user) for user in users))
@@ -0,0 +1,42 @@
+import pytest
+import typer
+
+from mct import cli, config
+
+CUSTOM = """
+custom:
+  iterm.prompt:
+    domain: com.googlecode.iterm2
+    key: PromptOnQuit
+    type: bool
+  broken.entry: 3
+dock:
+  size: huge
+"""
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    path = tmp_path / "config.yaml"
+    monkeypatch.setattr(config, "CONFIG_PATH", path)
+    yield path
+    config.SETTINGS.pop("iterm.prompt", None)
+    config._custom_keys.discard("iterm.prompt")
+
+
+def test_custom_settings_register_only_entries_in_use(config_file):
+    config_file.write_text(CUSTOM)
+    assert cli._register_custom_settings({"dock.size", "iterm.prompt"}) is None
+    assert config.SETTINGS["iterm.prompt"].key == "PromptOnQuit"
+
+
+def test_broken_custom_entry_in_use_is_an_error(config_file):
+    config_file.write_text(CUSTOM)
+    with pytest.raises(typer.Exit):
+        cli._register_custom_settings({"broken.entry"})
+
+
+def test_unreadable_config_is_ignored_for_built_in_keys(config_file):
+    config_file.write_text("dock: [\n")
+    assert cli._register_custom_settings({"dock.size"}) is None
+    assert cli._register_custom_settings({"iterm.prompt"})
@@ -0,0 +1,36 @@
+import pytest
+
+from mct import completion
+
+SETTINGS = {"dock.autohide": {"type": "bool", "values": ["true", "false"], "help": "Hide the Dock"}}
+
+
+@pytest.mark.parametrize(
+    ("words", "cword", "expected"),
+    [
+        ("mct set dock.autohide =", 3, (["set"], "dock.autohide=")),
+        ("mct set dock.autohide = t", 4, (["set"], "dock.autohide=t")),
+        ("mct set dock.autohide = true dock.", 5, (["set", "dock.autohide=true"], "dock.")),
+        ("mct set", 2, (["set"], "")),
+    ],
+)
+def test_bash_words_are_rejoined_at_equals(monkeypatch, words, cword, expected):
+    monkeypatch.setenv("COMP_WORDS", words)
+    monkeypatch.setenv("COMP_CWORD", str(cword))
+    assert completion._completion_args("bash") == expected
+
+
+def test_bash_completes_only_the_value(monkeypatch, capsys):
+    data = {
+        "commands": {
+            "": {"options": {}, "arguments": [], "children": {"set": ""}},
+            "set": {"options": {}, "arguments": [], "children": {}},
+        },
+        "settings": SETTINGS,
+    }
+    monkeypatch.setattr(completion, "load", lambda: data)
+    monkeypatch.setenv("COMP_WORDS", "mct set dock.autohide = f")
+    monkeypatch.setenv("COMP_CWORD", "4")
+
+    assert completion.serve("complete_bash")
+    assert capsys.readouterr().out == "false\n"
@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+
+from mct import defaults
+from mct.config import (
+    SETTINGS,
+    ConfigDiff,
+    check_values,
+    compute_diff,
+    group_writes,
+    normalize,
+    parse_value,
+    values_equal,
+    write_diffs,
+)
+
+
+@pytest.mark.parametrize(
+    ("value", "value_type", "expected"),
+    [
+        (1, "bool", True),
+        (0, "bool", False),
+        (" Off ", "bool", False),
+        ("yes", "bool", True),
+        ("48", "int", 48),
+        (48.0, "int", 48),
+        (True, "int", 1),
+        ("0.5", "float", 0.5),
+        (2, "float", 2.0),
+        (48, "string", "48"),
+        (None, "int", None),
+    ],
+)
+def test_normalize(value, value_type, expected):
+    result = normalize(value, value_type)
+    assert result == expected
+    assert type(result) is type(expected)
+
+
+@pytest.mark.parametrize(
+    ("value", "value_type"),
+    [("big", "int"), (2, "bool"), ("maybe", "bool"), (48.5, "int"), (True, "float"), ("x", "float")],
+)
+def test_normalize_leaves_unconvertible_values(value, value_type):
+    assert normalize(value, value_type) is value
+
+
+@pytest.mark.parametrize(
+    ("text", "value_type", "expected"),
+    [
+        ("true", "bool", True),
+        ("0", "bool", False),
+        ("36", "int", 36),
+        ("0.25", "float", 0.25),
+        ("left", "string", "left"),
+        ("[a, b]", "array", ["a", "b"]),
+        ("{show: true}", "dict", {"show": True}),
+    ],
+)
+def test_parse_value(text, value_type, expected):
+    assert parse_value(text, value_type) == expected
+
+
+@pytest.mark.parametrize(
+    ("text", "value_type"),
+    [("big", "int"), ("maybe", "bool"), ("fast", "float"), ("a, b", "array"), ("[a]", "dict")],
+)
+def test_parse_value_rejects_other_types(text, value_type):
+    with pytest.raises(ValueError, match=f"expected {value_type}"):
+        parse_value(text, value_type)
+
+
+def test_values_equal_tolerates_float_round_trips():
+    assert values_equal(0.1 + 0.2, "0.3", "float")
+    assert not values_equal(0.3, 0.31, "float")
+
+
+def test_compute_diff_ignores_representation_differences():
+    current = {"dock.size": "48", "dock.autohide": 1, "trackpad.tracking_speed": 0.50000001}
+    config = {"dock.size": 48, "dock.autohide": "true", "trackpad.tracking_speed": 0.5}
+    assert compute_diff(config, current) == []
+
+
+def test_check_values():
+    check_values({"dock.size": "48", "dock.autohide": "off", "unknown.key": object()})
+    with pytest.raises(ValueError, match="dock.size: expected int, got 'big'"):
+        check_values({"dock.size": "big"})
+    with pytest.raises(ValueError, match="dock.autohide"):
+        check_values({"dock.autohide": None})
+
+
+def test_unconvertible_write_value_is_a_defaults_error():
+    with pytest.raises(defaults.DefaultsError, match="Invalid int value"):
+        defaults.merge_payload({}, [("tilesize", "big", "int")])
+
+
+@pytest.mark.parametrize(("helper", "threaded"), [(False, True), (True, False)])
+def test_write_diffs_overlaps_domains_only_without_helper(monkeypatch, helper, threaded):
+    threads = set()
+
+    def write_many(domain, items, previous=None, written=None):
+        threads.add(threading.current_thread() is not threading.main_thread())
+        written.extend(key for key, _, _ in items)
+
+    monkeypatch.setattr(defaults, "write_many", write_many)
+    monkeypatch.setattr(defaults, "helper_running", lambda: helper)
+    diffs = [ConfigDiff(k, None, True, SETTINGS[k]) for k in ("dock.autohide", "finder.show_hidden")]
+
+    outcomes = write_diffs(group_writes(diffs))
+    assert all(o.written for o in outcomes)
+    assert threads == {threaded}
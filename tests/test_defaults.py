@@ -0,0 +1,176 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from mct import defaults
+
+
+class HungHelper:
+    """A helper connection whose requests all time out."""
+
+    def __init__(self):
+        self.timeouts = []
+
+    def call(self, request, timeout):
+        self.timeouts.append(timeout)
+        time.sleep(timeout)
+        raise OSError(f"preferences helper did not answer within {timeout:.1f}s")
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def hung(monkeypatch):
+    helper = HungHelper()
+    monkeypatch.setattr(defaults, "_helper", {"connection": helper, "started": True})
+    monkeypatch.setattr(defaults, "OP_TIMEOUT", 0.4)
+    monkeypatch.setattr(defaults, "BACKOFF", 0.0)
+    return helper
+
+
+def test_fallback_after_helper_timeout_stays_within_op_timeout(hung, monkeypatch):
+    timeouts = []
+
+    def run(cmd, timeout, **kwargs):
+        timeouts.append(timeout)
+        time.sleep(timeout)
+        raise subprocess.TimeoutExpired(cmd, timeout)
+
+    monkeypatch.setattr(subprocess, "run", run)
+    started = time.monotonic()
+    with pytest.raises(defaults.DefaultsError, match="timed out"):
+        defaults.write("com.apple.dock", "tilesize", 48, "int")
+    elapsed = time.monotonic() - started
+
+    assert hung.timeouts == [pytest.approx(0.2)]
+    assert timeouts and sum(timeouts) <= 0.2 + 0.05
+    assert elapsed < 0.4 + 0.1
+
+
+def test_fallback_budget_does_not_leak_into_later_operations(hung, monkeypatch):
+    timeouts = []
+
+    def run(cmd, timeout, **kwargs):
+        timeouts.append(timeout)
+        return subprocess.CompletedProcess(cmd, 0, stdout="", stderr="")
+
+    monkeypatch.setattr(subprocess, "run", run)
+    defaults.write("com.apple.dock", "tilesize", 48, "int")
+    time.sleep(0.25)
+    defaults.write("com.apple.dock", "tilesize", 36, "int")
+
+    assert timeouts[-1] == pytest.approx(0.4)
+
+
+def test_write_many_writes_only_the_keys_being_set(monkeypatch):
+    commands = []
+
+    def run(cmd, **kwargs):
+        commands.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0, stdout="", stderr="")
+
+    monkeypatch.setattr(defaults, "_run", run)
+    monkeypatch.setattr(defaults, "_connection", lambda: None)
+    items = [(f"Key{i}", i, "int") for i in range(20)]
+    written = []
+    defaults.write_many("com.example.app", items, written=written)
+
+    # A large batch must not export and re-import the domain, which would
+    # revert keys changed concurrently by the app
+    assert [cmd[:3] for cmd in commands] == [["write", "com.example.app", k] for k, _, _ in items]
+    assert written == [k for k, _, _ in items]
+
+
+DOCK = "com.apple.dock"
+
+
+@pytest.mark.parametrize(
+    ("value", "fragment"),
+    [
+        (["a", "b"], "<array><string>a</string><string>b</string></array>"),
+        ("a\n  b", "<string>a\n  b</string>"),
+        ("  ", "<string>  </string>"),
+        ({" k ": [1]}, "<dict><key> k </key><array><integer>1</integer></array></dict>"),
+    ],
+)
+def test_fragment_keeps_string_content(value, fragment):
+    assert defaults._fragment(value) == fragment
+
+
+def test_update_args_appends_to_arrays():
+    assert defaults.update_args(DOCK, "apps", ["a", "b", "c"], "array", ["a"]) == [
+        "write", DOCK, "apps", "-array-add", "<string>b</string>", "<string>c</string>",
+    ]
+
+
+def test_update_args_adds_dict_keys():
+    cmd = defaults.update_args(DOCK, "opts", {"a": 1, "b": 2, "c": "x"}, "dict", {"a": 1, "b": 1})
+    assert cmd == ["write", DOCK, "opts", "-dict-add", "b", "<integer>2</integer>", "c", "<string>x</string>"]
+
+
+@pytest.mark.parametrize(
+    ("current", "value"),
+    [
+        (["a", "b"], ["b", "a"]),  # A move cannot be expressed as an append
+        (["a", "b"], ["a"]),
+        ({"a": 1, "b": 2}, {"a": 1}),
+        (None, ["a"]),
+    ],
+)
+def test_update_args_rewrites_other_structural_changes(current, value):
+    value_type = "array" if isinstance(value, list) else "dict"
+    cmd = defaults.update_args(DOCK, "k", value, value_type, current)
+    assert cmd == defaults.write_args(DOCK, "k", value, value_type)
+
+
+@pytest.fixture
+def helper(tmp_path, monkeypatch):
+    """A real helper co-process storing domains as plist files in tmp_path."""
+    connection = defaults._Helper(
+        [sys.executable, "-I", defaults.prefs_helper.__file__, "--plist-dir", str(tmp_path)]
+    )
+    monkeypatch.setattr(defaults, "_helper", {"connection": connection, "started": True})
+    requests = []
+    call = connection.call
+
+    def recording(request, timeout):
+        requests.append(request)
+        return call(request, timeout)
+
+    monkeypatch.setattr(connection, "call", recording)
+    yield requests
+    connection.close()
+
+
+def test_update_sends_structural_edits_through_helper(helper):
+    defaults.write(DOCK, "apps", ["a"], "array")
+    defaults.write(DOCK, "opts", {"a": 1}, "dict")
+    helper.clear()
+
+    defaults.update(DOCK, "apps", ["a", "b"], "array", current=["a"])
+    defaults.update(DOCK, "opts", {"a": 1, "b": 2}, "dict", current={"a": 1})
+    assert [(r["op"], r["value"]) for r in helper] == [("array-add", ["b"]), ("dict-add", {"b": 2})]
+    assert defaults.export(DOCK) == {"apps": ["a", "b"], "opts": {"a": 1, "b": 2}}
+
+    defaults.update(DOCK, "apps", ["b", "a"], "array", current=["a", "b"])
+    assert helper[-1]["op"] == "write"
+    assert defaults.read(DOCK, "apps") == ["b", "a"]
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [(True, True), ("false", False), (" Yes ", True), ("off", False), (0, False), (1.0, True)],
+)
+def test_bool_values_are_normalized_like_config(value, expected):
+    assert defaults._typed(value, "bool") is expected
+    flag = "true" if expected else "false"
+    assert defaults.write_args(DOCK, "autohide", value, "bool") == ["write", DOCK, "autohide", "-bool", flag]
+
+
+@pytest.mark.parametrize("value", ["maybe", "", 2, None, [True]])
+def test_non_boolean_values_are_rejected(value):
+    with pytest.raises(defaults.DefaultsError, match="Invalid bool value"):
+        defaults._typed(value, "bool")
@@ -0,0 +1,64 @@
+import subprocess
+
+import pytest
+
+from mct import defaults, history
+
+
+@pytest.fixture
+def recording(tmp_path, monkeypatch):
+    """Record a run against a fake `defaults`; yields the commands it ran."""
+    commands = []
+    fail = set()
+
+    def run(args, **kwargs):
+        commands.append(args)
+        if args[0] == "export":
+            raise AssertionError("history must not export")
+        if args[2] in fail:
+            raise subprocess.CalledProcessError(1, args, stderr="write failed")
+        return subprocess.CompletedProcess(args, 0, stdout="", stderr="")
+
+    monkeypatch.setattr(defaults, "_run", run)
+    monkeypatch.setattr(defaults, "_connection", lambda: None)
+    history.begin(["apply"])
+    yield commands, fail, tmp_path / "history.db"
+    history.finish(tmp_path / "unused.db")
+
+
+def test_records_old_values_passed_by_the_writer(recording):
+    commands, _, path = recording
+    defaults.write_many(
+        "com.apple.dock",
+        [("tilesize", 48, "int"), ("autohide", True, "bool")],
+        previous={"tilesize": 36, "autohide": True},
+    )
+    run = history.finish(path)
+
+    assert [(c.key, c.old, c.new) for c in run.changes] == [("dock.size", 36, 48)]
+    assert len(commands) == 2
+    [stored] = history.query(path=path)
+    assert [(c.key, c.old, c.new) for c in stored.changes] == [("dock.size", 36, 48)]
+
+
+def test_failed_writes_are_not_recorded(recording):
+    _, fail, path = recording
+    fail.add("autohide")
+    with pytest.raises(defaults.DefaultsError):
+        defaults.write_many(
+            "com.apple.dock",
+            [("tilesize", 48, "int"), ("autohide", True, "bool")],
+            previous={"tilesize": 36, "autohide": False},
+        )
+    run = history.finish(path)
+
+    assert [c.key for c in run.changes] == ["dock.size"]
+
+
+def test_unknown_old_values_round_trip(recording):
+    _, _, path = recording
+    defaults.write("com.example.app", "Flag", True, "bool")
+    history.finish(path)
+
+    [stored] = history.query(path=path)
+    assert [(c.key, c.old, c.new) for c in stored.changes] == [("com.example.app:Flag", defaults.MISSING, True)]
@@ -0,0 +1,108 @@
+import json
+import os
+import stat
+
+import pytest
+
+from mct import metrics, privileged
+from mct.config import SETTINGS, ConfigDiff
+
+FULL = {"timestamp": 1700000000.5, "duration": 1.25, "changes": 3, "subprocesses": 7, "restarts": 1}
+
+
+def drift(key, current, desired):
+    return ConfigDiff(key=key, current=current, desired=desired, setting=SETTINGS[key])
+
+
+@pytest.fixture
+def last_apply_path(tmp_path, monkeypatch):
+    path = tmp_path / "last_apply.json"
+    monkeypatch.setattr(metrics, "LAST_APPLY_PATH", path)
+    return path
+
+
+def test_render_drift_and_last_apply():
+    config = {"dock.autohide": True, "dock.size": 48, "finder.show_extensions": True}
+    text = metrics.render(config, [drift("dock.size", 36, 48)], FULL, subprocesses=2)
+    lines = text.splitlines()
+    assert text.endswith("\n")
+    assert 'mct_drift_settings{category="dock"} 1' in lines
+    assert 'mct_drift_settings{category="finder"} 0' in lines
+    assert 'mct_setting_in_sync{key="dock.autohide"} 1' in lines
+    assert 'mct_setting_in_sync{key="dock.size"} 0' in lines
+    assert "mct_collect_defaults_subprocesses 2" in lines
+    assert "mct_last_apply_timestamp_seconds 1700000000.500" in lines
+    assert "mct_last_apply_duration_seconds 1.250000" in lines
+    assert "mct_last_apply_changes 3" in lines
+    assert "mct_last_apply_defaults_subprocesses 7" in lines
+    assert "mct_last_apply_app_restarts 1" in lines
+    assert "# TYPE mct_last_apply_app_restarts gauge" in lines
+
+
+def test_render_skips_missing_and_malformed_fields():
+    partial = {"timestamp": 1700000000, "changes": 2.0, "restarts": "x", "subprocesses": None}
+    text = metrics.render({}, [], partial)
+    assert "mct_last_apply_timestamp_seconds 1700000000.000" in text
+    assert "mct_last_apply_changes 2.0" in text
+    for absent in ("duration", "defaults_subprocesses", "app_restarts"):
+        assert f"mct_last_apply_{absent}" not in text
+
+
+def test_render_without_last_apply():
+    text = metrics.render({}, [], {})
+    assert "mct_last_apply" not in text
+    assert "mct_collect_defaults_subprocesses 0" in text
+
+
+def test_escape_label_values():
+    assert metrics._escape('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+
+@pytest.mark.parametrize("content", [None, "{not json", "[1, 2]"])
+def test_load_last_apply_unusable(last_apply_path, content):
+    if content is not None:
+        last_apply_path.write_text(content)
+    assert metrics.load_last_apply() == {}
+
+
+def test_load_last_apply_unreadable(last_apply_path):
+    last_apply_path.mkdir()
+    assert metrics.load_last_apply() == {}
+
+
+def test_record_apply_round_trip(last_apply_path):
+    metrics.record_apply(0.5, 4, 6, 2)
+    data = metrics.load_last_apply()
+    assert {k: data[k] for k in ("duration", "changes", "subprocesses", "restarts")} == {
+        "duration": 0.5,
+        "changes": 4,
+        "subprocesses": 6,
+        "restarts": 2,
+    }
+    assert json.loads(last_apply_path.read_text())["timestamp"] > 0
+
+
+def test_write_textfile_replaces_atomically(tmp_path):
+    path = tmp_path / "collector" / "mct.prom"
+    metrics.write_textfile(path, "old\n")
+    inode = path.stat().st_ino
+    metrics.write_textfile(path, "new\n")
+    assert path.read_text() == "new\n"
+    # A fresh inode means readers holding the old file never see a partial write
+    assert path.stat().st_ino != inode
+    assert stat.S_IMODE(path.stat().st_mode) == 0o644
+    assert os.listdir(path.parent) == ["mct.prom"]
+
+
+def test_write_textfile_failure_keeps_old_file(tmp_path, monkeypatch):
+    path = tmp_path / "mct.prom"
+    metrics.write_textfile(path, "old\n")
+
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(privileged.os, "replace", fail)
+    with pytest.raises(OSError):
+        metrics.write_textfile(path, "new\n")
+    assert path.read_text() == "old\n"
+    assert os.listdir(tmp_path) == ["mct.prom"]
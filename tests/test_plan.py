@@ -0,0 +1,75 @@
+import pytest
+
+from mct import defaults, plan
+from mct.config import SETTINGS, WriteError, WriteOutcome
+
+
+@pytest.fixture
+def system(monkeypatch):
+    """Fake defaults domains; records restarts and writes instead of running anything."""
+    domains = {
+        "com.apple.dock": {"tilesize": 36, "autohide": False, "recent-apps": ["a"]},
+        "com.apple.finder": {"AppleShowAllFiles": False},
+    }
+    restarted = []
+
+    def export(domain, keys=None):
+        values = domains.get(domain, {})
+        return dict(values) if keys is None else {k: values[k] for k in keys if k in values}
+
+    def write_many(domain, items, previous=None, written=None):
+        for key, value, _ in items:
+            domains.setdefault(domain, {})[key] = value
+            if written is not None:
+                written.append(key)
+
+    monkeypatch.setattr(defaults, "export", export)
+    monkeypatch.setattr(defaults, "write_many", write_many)
+    monkeypatch.setattr(defaults, "restart_app", restarted.append)
+    return domains, restarted
+
+
+CONFIG = {"dock.size": 48, "dock.autohide": True, "finder.show_hidden": True}
+
+
+def test_round_trip(system, tmp_path):
+    made = plan.make_plan(CONFIG, {})
+    path = tmp_path / "plan.json"
+    path.write_text(plan.dumps(made))
+
+    loaded = plan.load(path)
+    assert [d.key for d in loaded.changes] == [d.key for d in made.changes]
+    assert loaded.read == {"com.apple.dock": ["tilesize", "autohide"], "com.apple.finder": ["AppleShowAllFiles"]}
+
+
+def test_unrelated_keys_do_not_make_plan_stale(system):
+    domains, restarted = system
+    made = plan.make_plan(CONFIG, {})
+    domains["com.apple.dock"]["recent-apps"] = ["a", "b"]
+
+    plan.execute(made)
+    assert domains["com.apple.dock"]["tilesize"] == 48
+    assert restarted == ["Dock", "Finder"]
+
+
+def test_changed_key_makes_plan_stale(system):
+    domains, _ = system
+    made = plan.make_plan(CONFIG, {})
+    domains["com.apple.dock"]["tilesize"] = 40
+
+    with pytest.raises(plan.StalePlanError, match="com.apple.dock"):
+        plan.execute(made)
+
+
+def test_partial_failure_restarts_written_domains(system, monkeypatch):
+    _, restarted = system
+    made = plan.make_plan(CONFIG, {})
+
+    def write_diffs(groups):
+        diffs = [d for group in groups.values() for d in group]
+        raise WriteError([WriteOutcome(d, written=d.setting.domain == "com.apple.finder") for d in diffs])
+
+    monkeypatch.setattr(plan, "write_diffs", write_diffs)
+    with pytest.raises(WriteError):
+        plan.execute(made)
+    assert restarted == [SETTINGS["finder.show_hidden"].restart_app]
@@ -0,0 +1,112 @@
+import json
+import os
+import sys
+
+import pytest
+import typer
+
+from mct import config, plugins
+
+PACK = '''
+import typer
+
+from mct.config import Setting
+
+SETTINGS = {"demo.flag": Setting("com.example.demo", "Flag", "bool", description="A flag")}
+HELP = "Demo settings"
+app = typer.Typer()
+
+
+@app.command()
+def hello():
+    typer.echo("hello")
+'''
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    """A sys.path directory holding one installed settings pack, mctpack_demo."""
+    site = tmp_path / "site"
+    dist_info = site / "mctpack_demo-1.0.dist-info"
+    dist_info.mkdir(parents=True)
+    (dist_info / "METADATA").write_text("Metadata-Version: 2.1\nName: mctpack-demo\nVersion: 1.0\n")
+    (dist_info / "entry_points.txt").write_text(f"[{plugins.ENTRY_POINT_GROUP}]\ndemo = mctpack_demo\n")
+    (site / "mctpack_demo.py").write_text(PACK)
+
+    monkeypatch.syspath_prepend(str(site))
+    monkeypatch.setattr(plugins, "INDEX_PATH", tmp_path / "cache" / "plugins.json")
+    monkeypatch.setattr(plugins, "_index", None)
+    monkeypatch.setattr(plugins, "_loaded", {})
+    yield site
+    sys.modules.pop("mctpack_demo", None)
+    config.SETTINGS.pop("demo.flag", None)
+    config._custom_keys.discard("demo.flag")
+
+
+def fresh_process(monkeypatch):
+    """Forget everything a previous invocation loaded, keeping the index file."""
+    monkeypatch.setattr(plugins, "_index", None)
+    monkeypatch.setattr(plugins, "_loaded", {})
+    sys.modules.pop("mctpack_demo", None)
+    config.SETTINGS.pop("demo.flag", None)
+
+
+def test_index_records_what_packs_provide(site):
+    info = plugins.index()["demo"]
+    assert (info.categories, info.has_app, info.help) == (["demo"], True, "Demo settings")
+
+    cached = json.loads(plugins.INDEX_PATH.read_text())
+    assert cached["fingerprint"] == plugins.fingerprint()
+    assert cached["packs"]["demo"]["value"] == "mctpack_demo"
+
+
+def test_cached_index_is_used_without_scanning(site, monkeypatch):
+    built = plugins.index()
+    fresh_process(monkeypatch)
+
+    def scan():
+        raise AssertionError("entry points scanned although the index is fresh")
+
+    monkeypatch.setattr(plugins, "build_index", scan)
+    assert plugins.index() == built
+    assert "mctpack_demo" not in sys.modules
+
+
+def test_index_is_rebuilt_when_sys_path_changes(site, monkeypatch):
+    plugins.index()
+    fresh_process(monkeypatch)
+
+    # Installing or removing a distribution touches its site directory
+    (site / "mctpack_demo-1.0.dist-info" / "entry_points.txt").unlink()
+    stat = os.stat(site)
+    os.utime(site, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert plugins.index() == {}
+    assert json.loads(plugins.INDEX_PATH.read_text())["packs"] == {}
+
+
+def test_load_categories_imports_only_matching_packs(site, monkeypatch):
+    plugins.index()
+    fresh_process(monkeypatch)
+
+    plugins.load_categories(["dock"])
+    assert "mctpack_demo" not in sys.modules
+    assert "demo.flag" not in config.SETTINGS
+
+    plugins.load_categories(["dock", "demo"])
+    assert "mctpack_demo" in sys.modules
+    assert config.SETTINGS["demo.flag"].domain == "com.example.demo"
+
+
+@pytest.mark.parametrize(("argv", "imported"), [(["dock", "size"], False), (["demo", "hello"], True)])
+def test_mount_imports_only_the_invoked_pack(site, monkeypatch, argv, imported):
+    plugins.index()
+    fresh_process(monkeypatch)
+
+    app = typer.Typer()
+    plugins.mount(app, argv)
+    [group] = app.registered_groups
+    assert (group.name, group.help) == ("demo", "Demo settings")
+    assert ("mctpack_demo" in sys.modules) is imported
+    # A placeholder still lists the sub-command in --help, with no commands
+    assert bool(group.typer_instance.registered_commands) is imported
@@ -0,0 +1,68 @@
+import pytest
+
+from mct import defaults, prefindex
+
+DOMAINS = {
+    "NSGlobalDomain": {"AppleInterfaceStyle": "Dark", "com.apple.trackpad.scaling": 0.5},
+    "com.apple.finder": {"AppleShowAllFiles": True, "FXPreferredViewStyle": "Nlsv"},
+    "com.apple.dock": {"tilesize": 48, "autohide": True},
+}
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    domains = {name: dict(values) for name, values in DOMAINS.items()}
+    monkeypatch.setattr(defaults, "domains", lambda: list(domains))
+    monkeypatch.setattr(defaults, "export", lambda domain: dict(domains.get(domain, {})))
+    monkeypatch.setattr(prefindex, "plist_mtime", lambda domain: None)
+    path = tmp_path / "index.db"
+    prefindex.refresh(path, workers=2)
+    return path, domains
+
+
+def keys(entries):
+    return [(e.domain, e.key) for e in entries]
+
+
+def test_search_matches_substrings_case_insensitively(index):
+    path, _ = index
+    assert prefindex._has_fts(prefindex.connect(path))
+    assert keys(prefindex.search("showall", path=path)) == [("com.apple.finder", "AppleShowAllFiles")]
+    assert keys(prefindex.search("DARK", path=path)) == [("NSGlobalDomain", "AppleInterfaceStyle")]
+
+
+def test_key_matches_come_first(index):
+    path, _ = index
+    found = keys(prefindex.search("apple", path=path))
+    assert found[:3] == [
+        ("NSGlobalDomain", "AppleInterfaceStyle"),
+        ("NSGlobalDomain", "com.apple.trackpad.scaling"),
+        ("com.apple.finder", "AppleShowAllFiles"),
+    ]
+    assert len(found) == 6
+
+
+def test_domain_filter_and_short_terms(index):
+    path, _ = index
+    assert keys(prefindex.search("ti", domain="com.apple.dock", path=path)) == [("com.apple.dock", "tilesize")]
+
+
+def test_reindexed_domains_replace_their_entries(index):
+    path, domains = index
+    domains["com.apple.dock"] = {"orientation": "left"}
+    prefindex.refresh(path, workers=2)
+
+    assert prefindex.search("tilesize", path=path) == []
+    assert keys(prefindex.search("left", path=path)) == [("com.apple.dock", "orientation")]
+
+
+def test_like_fallback_without_fts(tmp_path, monkeypatch):
+    monkeypatch.setattr(prefindex, "FTS_SCHEMA", "CREATE VIRTUAL TABLE entries_fts USING no_such_module(a);")
+    monkeypatch.setattr(defaults, "domains", lambda: list(DOMAINS))
+    monkeypatch.setattr(defaults, "export", lambda domain: DOMAINS.get(domain, {}))
+    monkeypatch.setattr(prefindex, "plist_mtime", lambda domain: None)
+    path = tmp_path / "index.db"
+    prefindex.refresh(path, workers=2)
+
+    assert not prefindex._has_fts(prefindex.connect(path))
+    assert keys(prefindex.search("showall", path=path)) == [("com.apple.finder", "AppleShowAllFiles")]
@@ -0,0 +1,146 @@
+import pytest
+
+from mct import defaults, profiles
+from mct.config import WriteError, WriteOutcome
+
+DOCK = "com.apple.dock"
+GLOBAL = "NSGlobalDomain"
+
+PROFILES = {
+    "work": {"dock.size": 48, "dock.autohide": False, "finder.show_extensions": True},
+    "presenting": {"dock.size": 64, "dock.autohide": True, "finder.show_extensions": True},
+}
+
+
+@pytest.fixture
+def system(tmp_path, monkeypatch):
+    """Stand-in for the preferences store: values by config key, plist mtimes by domain."""
+    state = {
+        "values": {"dock.size": 36, "dock.autohide": False, "finder.show_extensions": False},
+        "mtimes": {DOCK: 1, GLOBAL: 1},
+        "reads": [],
+        "writes": [],
+        "fail": set(),
+        "restarted": [],
+        "path": tmp_path / "profiles.json",
+    }
+
+    def read_current_state(keys):
+        keys = list(keys)
+        state["reads"].append(sorted(keys))
+        return {k: state["values"][k] for k in keys if k in state["values"]}
+
+    def write_diffs(groups):
+        outcomes = []
+        for domain, group in groups.items():
+            for diff in group:
+                written = diff.key not in state["fail"]
+                if written:
+                    state["values"][diff.key] = diff.desired
+                    state["mtimes"][domain] += 1
+                    state["writes"].append(diff.key)
+                outcomes.append(WriteOutcome(diff, written=written, error=None if written else "denied"))
+        if state["fail"]:
+            raise WriteError(outcomes)
+        return outcomes
+
+    monkeypatch.setattr(profiles, "read_current_state", read_current_state)
+    monkeypatch.setattr(profiles, "write_diffs", write_diffs)
+    monkeypatch.setattr(profiles, "plist_mtime", lambda domain: state["mtimes"].get(domain))
+    monkeypatch.setattr(defaults, "restart_app", state["restarted"].append)
+    return state
+
+
+def switch(system, name):
+    system["reads"].clear()
+    system["writes"].clear()
+    system["restarted"].clear()
+    return profiles.switch(name, PROFILES, path=system["path"])
+
+
+def test_delta_holds_only_values_that_differ():
+    assert profiles.delta(PROFILES["work"], PROFILES["presenting"]) == {
+        "dock.size": 64,
+        "dock.autohide": True,
+    }
+    assert profiles.delta({}, {"dock.size": 48}) == {"dock.size": 48}
+    assert profiles.delta({"dock.autohide": True}, {"dock.autohide": "yes"}) == {}
+
+
+def test_precompute_only_when_profiles_change():
+    state = {}
+    profiles.precompute(state, PROFILES)
+    assert state["deltas"]["work"]["presenting"] == {"dock.size": 64, "dock.autohide": True}
+    assert state["deltas"]["presenting"]["work"] == {"dock.size": 48, "dock.autohide": False}
+
+    state["deltas"] = "kept"
+    profiles.precompute(state, PROFILES)
+    assert state["deltas"] == "kept"
+
+    changed = {**PROFILES, "work": {**PROFILES["work"], "finder.show_extensions": False}}
+    profiles.precompute(state, changed)
+    assert state["deltas"]["presenting"]["work"] == {
+        "dock.size": 48,
+        "dock.autohide": False,
+        "finder.show_extensions": False,
+    }
+
+
+def test_first_switch_reads_and_diffs_every_key(system):
+    result = switch(system, "work")
+    assert sorted(result.reread) == sorted([DOCK, GLOBAL])
+    assert system["reads"] == [sorted(PROFILES["work"])]
+    assert sorted(system["writes"]) == ["dock.size", "finder.show_extensions"]
+    assert result.restart == ["Dock", "Finder"]
+    assert profiles.load_state(system["path"])["active"] == "work"
+
+
+def test_switch_from_active_profile_writes_only_the_delta(system):
+    switch(system, "work")
+    result = switch(system, "presenting")
+
+    assert result.previous == "work"
+    assert result.reread == []
+    assert system["reads"] == [[]]
+    assert sorted(system["writes"]) == ["dock.autohide", "dock.size"]
+    assert system["restarted"] == ["Dock"]
+
+
+def test_changed_plist_makes_its_domain_keys_candidates(system):
+    switch(system, "work")
+    # Changed outside mct: not in the work -> presenting delta
+    system["values"]["finder.show_extensions"] = False
+    system["mtimes"][GLOBAL] += 1
+
+    result = switch(system, "presenting")
+    assert result.reread == [GLOBAL]
+    assert system["reads"] == [["finder.show_extensions"]]
+    assert sorted(system["writes"]) == ["dock.autohide", "dock.size", "finder.show_extensions"]
+    assert system["restarted"] == ["Dock", "Finder"]
+
+
+def test_switch_to_active_profile_with_nothing_changed_writes_nothing(system):
+    switch(system, "work")
+    result = switch(system, "work")
+    assert (result.changes, result.reread, system["writes"]) == ([], [], [])
+
+
+def test_partial_failure_restarts_written_apps_and_saves_state(system):
+    switch(system, "work")
+    system["fail"].add("dock.autohide")
+
+    with pytest.raises(WriteError):
+        switch(system, "presenting")
+
+    assert system["writes"] == ["dock.size"]
+    assert system["restarted"] == ["Dock"]
+    state = profiles.load_state(system["path"])
+    assert state["active"] is None
+    assert state["values"]["dock.size"] == 64
+    assert "dock.autohide" not in state["values"]
+
+    # The next switch re-reads the domain it could not write and retries
+    system["fail"].clear()
+    result = switch(system, "presenting")
+    assert result.reread == [DOCK]
+    assert system["writes"] == ["dock.autohide"]
@@ -0,0 +1,88 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from mct import remote
+
+BODY = "dock:\n  size: 48\n"
+
+
+@pytest.fixture
+def server():
+    """Serve BODY with an ETag; state['body'] and state['status'] can be changed."""
+    state = {"body": BODY, "status": 200, "requests": []}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state["requests"].append(dict(self.headers))
+            etag = f'"{hash(state["body"])}"'
+            if state["status"] != 200:
+                self.send_error(state["status"])
+                return
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            data = state["body"].encode()
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    state["url"] = f"http://127.0.0.1:{httpd.server_port}/mac.yaml"
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_revalidates_cached_copy(server, tmp_path):
+    first = remote.fetch(server["url"], cache_dir=tmp_path)
+    assert (first.text, first.not_modified) == (BODY, False)
+
+    second = remote.fetch(server["url"], cache_dir=tmp_path)
+    assert (second.text, second.not_modified) == (BODY, True)
+    assert server["requests"][1]["If-None-Match"] == first.meta["etag"]
+
+
+def test_changed_body_replaces_cache(server, tmp_path):
+    remote.fetch(server["url"], cache_dir=tmp_path)
+    server["body"] = "dock:\n  size: 36\n"
+
+    fetched = remote.fetch(server["url"], cache_dir=tmp_path)
+    assert (fetched.text, fetched.not_modified) == (server["body"], False)
+
+
+def test_server_errors_fall_back_to_cache(server, tmp_path):
+    remote.fetch(server["url"], cache_dir=tmp_path)
+    server["status"] = 503
+
+    fetched = remote.fetch(server["url"], cache_dir=tmp_path)
+    assert (fetched.text, fetched.offline) == (BODY, True)
+
+
+def test_failure_without_cache_raises(server, tmp_path):
+    server["status"] = 404
+    with pytest.raises(remote.RemoteConfigError, match="HTTP 404"):
+        remote.fetch(server["url"], cache_dir=tmp_path)
+
+
+def test_in_sync_needs_304_and_unchanged_files(server, tmp_path, monkeypatch):
+    mtimes = {"com.apple.dock": 1}
+    monkeypatch.setattr(remote, "plist_mtime", mtimes.get)
+
+    fetched = remote.fetch(server["url"], cache_dir=tmp_path)
+    fetched.mark_synced(["com.apple.dock"], [], cache_dir=tmp_path)
+    assert not fetched.in_sync()  # Not confirmed by a 304
+
+    assert remote.fetch(server["url"], cache_dir=tmp_path).in_sync()
+
+    mtimes["com.apple.dock"] = 2
+    assert not remote.fetch(server["url"], cache_dir=tmp_path).in_sync()
@@ -0,0 +1,56 @@
+import pytest
+
+from mct.structure import Change, describe, diff_array, diff_dict, diff_value
+
+
+def test_diff_array_insert_and_remove():
+    assert diff_array(["a", "b", "c"], ["a", "x", "c", "d"]) == [
+        Change("insert", 1, "x"),
+        Change("insert", 3, "d"),
+        Change("remove", 1, "b"),
+    ]
+
+
+def test_diff_array_detects_moves():
+    assert diff_array(["a", "b", "c"], ["c", "a", "b"]) == [Change("move", 0, "c", old=2)]
+
+
+def test_diff_array_matches_dict_elements_by_value():
+    old = [{"tile": "Safari", "pos": 1}, {"tile": "Mail"}]
+    new = [{"tile": "Mail"}, {"pos": 1, "tile": "Safari"}]
+    assert [c.op for c in diff_array(old, new)] == ["move"]
+
+
+def test_diff_array_of_equal_arrays_is_empty():
+    assert diff_array([1, 2, 3], [1, 2, 3]) == []
+
+
+def test_diff_dict():
+    old = {"a": 1, "b": 2, "c": 3}
+    new = {"a": 1, "b": 20, "d": 4}
+    assert diff_dict(old, new) == [
+        Change("set", "b", 20, old=2),
+        Change("set", "d", 4),
+        Change("delete", "c", old=3),
+    ]
+
+
+@pytest.mark.parametrize(("old", "new"), [(1, 2), ([1], {"a": 1}), ("a", ["a"])])
+def test_diff_value_only_compares_like_structures(old, new):
+    assert diff_value(old, new) is None
+
+
+@pytest.mark.parametrize(
+    ("change", "text"),
+    [
+        (Change("insert", 3, "Safari"), "+ [3] 'Safari'"),
+        (Change("remove", 0, "Mail"), "- [0] 'Mail'"),
+        (Change("move", 0, "c", old=2), "~ [2] -> [0] 'c'"),
+        (Change("delete", "c", old=3), "- c: 3"),
+        (Change("set", "d", 4), "+ d: 4"),
+        (Change("set", "b", 20, old=2), "~ b: 2 -> 20"),
+        (Change("insert", 0, "x" * 100), f"+ [0] '{'x' * 56}..."),
+    ],
+)
+def test_describe(change, text):
+    assert describe(change) == text
@@ -0,0 +1,111 @@
+import pytest
+
+from mct import privileged, sysfiles
+
+KEY = "system.touchid_sudo"
+PAM = "auth       required       pam_opendirectory.so\n"
+
+
+@pytest.fixture
+def root(tmp_path):
+    pam = tmp_path / privileged.PAM_SUDO.lstrip("/")
+    pam.parent.mkdir(parents=True)
+    pam.write_text(PAM)
+    return tmp_path
+
+
+@pytest.fixture
+def state(tmp_path):
+    return tmp_path / "state" / "files.json"
+
+
+def pam_text(root):
+    return (root / privileged.PAM_SUDO.lstrip("/")).read_text()
+
+
+def test_apply_edits_inserts_missing_line_at_top():
+    edits = [sysfiles.LineEdit("auth sufficient pam_tid.so")]
+    assert sysfiles.apply_edits(PAM, edits) == f"auth sufficient pam_tid.so\n{PAM}"
+
+
+def test_apply_edits_ignores_whitespace_and_comments():
+    text = "# auth sufficient pam_tid.so\nauth   sufficient\tpam_tid.so\n"
+    assert sysfiles.apply_edits(text, [sysfiles.LineEdit("auth sufficient pam_tid.so")]) == text
+
+    removed = sysfiles.apply_edits(text, [sysfiles.LineEdit("auth sufficient pam_tid.so", present=False)])
+    assert removed == "# auth sufficient pam_tid.so\n"
+
+
+def test_enable_then_in_sync(root, state):
+    diffs = sysfiles.compute_file_diffs({KEY: True}, root=root, state_path=state)
+    assert [(d.key, d.current, d.desired) for d in diffs] == [(KEY, False, True)]
+
+    sysfiles.apply_file_diffs(diffs, state_path=state)
+    assert pam_text(root).startswith(f"{privileged.TOUCHID_LINE}\n")
+    assert sysfiles.compute_file_diffs({KEY: True}, root=root, state_path=state) == []
+
+
+def test_recorded_hash_skips_reading_unchanged_file(root, state, monkeypatch):
+    sysfiles.compute_file_diffs({KEY: False}, root=root, state_path=state)
+    assert state.exists()
+
+    pam = root / privileged.PAM_SUDO.lstrip("/")
+    read_text = sysfiles.Path.read_text
+
+    def guarded(path, *args, **kwargs):
+        assert path != pam, "file read although unchanged"
+        return read_text(path, *args, **kwargs)
+
+    monkeypatch.setattr(sysfiles.Path, "read_text", guarded)
+    assert sysfiles.compute_file_diffs({KEY: False}, root=root, state_path=state) == []
+
+
+def test_edit_outside_mct_is_detected(root, state):
+    sysfiles.compute_file_diffs({KEY: False}, root=root, state_path=state)
+    pam = root / privileged.PAM_SUDO.lstrip("/")
+    pam.write_text(f"{privileged.TOUCHID_LINE}\n{PAM}")
+
+    diffs = sysfiles.compute_file_diffs({KEY: False}, root=root, state_path=state)
+    assert [d.new_text for d in diffs] == [PAM]
+
+
+def test_file_changed_since_read_is_not_overwritten(root, state):
+    diffs = sysfiles.compute_file_diffs({KEY: True}, root=root, state_path=state)
+    (root / privileged.PAM_SUDO.lstrip("/")).write_text("auth required pam_deny.so\n")
+
+    with pytest.raises(PermissionError, match="changed since it was read"):
+        sysfiles.apply_file_diffs(diffs, state_path=state)
+
+
+@pytest.mark.parametrize("value", ["false", "off", 0, False])
+def test_false_strings_disable(root, state, value):
+    assert sysfiles.compute_file_diffs({KEY: value}, root=root, state_path=state) == []
+    assert privileged.TOUCHID_LINE not in pam_text(root)
+
+
+@pytest.mark.parametrize("value", ["maybe", 2, [True]])
+def test_non_boolean_values_are_rejected(root, state, value):
+    with pytest.raises(ValueError, match=KEY):
+        sysfiles.compute_file_diffs({KEY: value}, root=root, state_path=state)
+
+
+def test_backup_keeps_previous_content(root, state):
+    diffs = sysfiles.compute_file_diffs({KEY: True}, root=root, state_path=state)
+    sysfiles.apply_file_diffs(diffs, state_path=state, backup=True)
+
+    pam = root / privileged.PAM_SUDO.lstrip("/")
+    assert sysfiles.backup_path(pam) == root / privileged.PAM_BACKUP.lstrip("/")
+    assert sysfiles.backup_path(pam).read_text() == PAM
+    assert pam_text(root).startswith(f"{privileged.TOUCHID_LINE}\n")
+
+
+def test_sudo_local_is_created_when_missing(root, state):
+    key = "system.touchid_sudo_local"
+    diffs = sysfiles.compute_file_diffs({key: True}, root=root, state_path=state)
+    assert [(d.key, d.existed) for d in diffs] == [(key, False)]
+
+    sysfiles.apply_file_diffs(diffs, state_path=state, backup=True)
+    local = root / privileged.PAM_SUDO_LOCAL.lstrip("/")
+    assert local.read_text() == f"{privileged.TOUCHID_LINE}\n"
+    assert not sysfiles.backup_path(local).exists()
+    assert sysfiles.compute_file_diffs({key: True}, root=root, state_path=state) == []
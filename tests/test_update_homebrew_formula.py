@@ -0,0 +1,179 @@
+import importlib.util
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+SCRIPT = Path(__file__).resolve().parent.parent / "scripts" / "update_homebrew_formula.py"
+LOCK = Path(__file__).resolve().parent / "fixtures" / "uv.lock"
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location("update_homebrew_formula", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+formula = load_script()
+
+ENV = {**formula.MARKER_ENV, "python_version": "3.12"}
+
+
+@pytest.mark.parametrize(
+    "marker, expected",
+    [
+        ("sys_platform == 'darwin'", True),
+        ("sys_platform == 'win32'", False),
+        ("python_version >= '3.11'", True),
+        ("python_version < '3.10'", False),
+        ("python_version ~= '3.10'", True),
+        ("python_version ~= '3.11.0'", False),
+        ("python_version ~= '3.12.0'", True),
+        ("'3.12' ~= '3.13'", False),
+        ("extra == 'socks'", False),
+        ("sys_platform == 'win32' or (python_version >= '3.12' and os_name == 'posix')", True),
+        ("platform_system in 'Darwin Linux'", True),
+        ("sys_platform not in 'win32 cygwin'", True),
+    ],
+)
+def test_marker_matches(marker, expected):
+    assert formula.marker_matches(marker, ENV) is expected
+
+
+@pytest.mark.parametrize(
+    "marker",
+    [
+        "platform_machine == 'arm64'",
+        "python_version >= '3.12'",  # The formula's Python is unknown
+        "python_version ~= '3'",
+        "(sys_platform == 'darwin'",
+        "sys_platform ==",
+    ],
+)
+def test_marker_matches_rejects_what_it_cannot_decide(marker):
+    with pytest.raises(ValueError):
+        formula.marker_matches(marker)
+
+
+def test_formula_python_version(tmp_path):
+    rb = tmp_path / "mct-cli.rb"
+    rb.write_text('class MctCli < Formula\n  depends_on "python@3.13"\nend\n')
+    assert formula.formula_python_version(rb) == "3.13"
+    rb.write_text("class MctCli < Formula\nend\n")
+    assert formula.formula_python_version(rb) is None
+
+
+@pytest.fixture
+def index():
+    """Local stand-in for the PyPI JSON API; counts requests and connections."""
+    state = {"requests": [], "connections": 0, "etag": '"v1"'}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            state["connections"] += 1
+
+        def do_GET(self):
+            state["requests"].append(self.path)
+            name, version = self.path.split("/")[2:4]
+            if self.headers.get("If-None-Match") == state["etag"]:
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            sdist = {
+                "packagetype": "sdist",
+                "url": f"https://files.example/{name}-{version}.tar.gz",
+                "digests": {"sha256": f"{name}-sha"},
+            }
+            data = json.dumps({"urls": [sdist]}).encode()
+            self.send_response(200)
+            self.send_header("ETag", state["etag"])
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    state["url"] = f"http://127.0.0.1:{httpd.server_port}/pypi"
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_resolver_against_stand_in_index(index, tmp_path):
+    deps = {"click": "8.1.7", "PyYAML": "6.0.2", "rich": "13.9.4"}
+    resolver = formula.PyPIResolver(base_url=index["url"], cache_dir=tmp_path, workers=1)
+    assert resolver.resolve(deps) == {
+        name: (f"https://files.example/{name}-{ver}.tar.gz", f"{name}-sha")
+        for name, ver in deps.items()
+    }
+    assert sorted(index["requests"]) == sorted(f"/pypi/{n}/{v}/json" for n, v in deps.items())
+    # One worker reuses its keep-alive connection for every lookup
+    assert index["connections"] == 1
+    assert (tmp_path / "pyyaml-6.0.2.json").exists()
+
+
+def test_resolver_revalidates_cache_with_etag(index, tmp_path):
+    first = formula.PyPIResolver(base_url=index["url"], cache_dir=tmp_path)
+    expected = first.sdist_url_sha256("click", "8.1.7")
+
+    again = formula.PyPIResolver(base_url=index["url"], cache_dir=tmp_path)
+    assert again.sdist_url_sha256("click", "8.1.7") == expected
+    assert len(index["requests"]) == 2
+    assert "etag" in json.loads((tmp_path / "click-8.1.7.json").read_text())
+
+
+def test_base_url_from_environment(index, tmp_path, monkeypatch):
+    monkeypatch.setenv("PYPI_BASE_URL", index["url"])
+    monkeypatch.setenv("PYPI_CACHE_DIR", str(tmp_path))
+    module = load_script()
+    assert module.sdist_url_sha256("rich", "13.9.4")[1] == "rich-sha"
+    assert index["requests"] == ["/pypi/rich/13.9.4/json"]
+
+
+def test_deps_from_lock_follow_runtime_closure():
+    deps = formula.get_deps_from_lock("mct-cli", "1.0.0", LOCK, python_version="3.12")
+    assert deps == {
+        "pyyaml": ("6.0.2", "https://files.example/pyyaml-6.0.2.tar.gz", "pyyaml"),
+        "typer": ("0.15.1", "https://files.example/typer-0.15.1.tar.gz", "typer"),
+        # Wheel-only in the lock: left for the PyPI resolver
+        "shellingham": ("1.5.4", None, None),
+        # Pinned by version although the lock holds two
+        "typing-extensions": (
+            "4.12.2",
+            "https://files.example/typing_extensions-4.12.2.tar.gz",
+            "te-new",
+        ),
+    }
+
+
+def test_deps_from_lock_apply_python_markers():
+    deps = formula.get_deps_from_lock("mct-cli", "1.0.0", LOCK, python_version="3.10")
+    assert deps["tomli"] == ("2.2.1", "https://files.example/tomli-2.2.1.tar.gz", "tomli")
+    assert "colorama" not in deps
+    assert "pysocks" not in deps
+
+
+def test_deps_from_lock_need_python_version_for_python_markers():
+    with pytest.raises(ValueError, match="python_version"):
+        formula.get_deps_from_lock("mct-cli", "1.0.0", LOCK)
+
+
+@pytest.mark.parametrize("version", ["0.9.0", "1.0.1"])
+def test_deps_from_lock_fall_back_when_lock_pins_another_version(version):
+    assert formula.get_deps_from_lock("mct-cli", version, LOCK, python_version="3.12") is None
+
+
+def test_deps_from_lock_fall_back_without_lock(tmp_path):
+    missing = tmp_path / "uv.lock"
+    assert formula.get_deps_from_lock("mct-cli", "1.0.0", missing, python_version="3.12") is None
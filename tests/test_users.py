@@ -0,0 +1,140 @@
+import asyncio
+import os
+import plistlib
+
+import pytest
+
+from mct import api, users
+
+CONFIG = {"dock.size": 48, "dock.autohide": True, "finder.show_hidden": True}
+
+
+def make_users(tmp_path, *names):
+    accounts = []
+    for uid, name in enumerate(names, start=users.MIN_UID):
+        home = tmp_path / name
+        home.mkdir()
+        accounts.append(users.User(name=name, home=home, uid=uid, gid=20))
+    return accounts
+
+
+def plist_backend(user, logged_in):
+    return api.PlistFileBackend(str(user.preferences), home=str(user.home))
+
+
+def apply(accounts, backend, **kwargs):
+    return asyncio.run(users.apply_users(accounts, CONFIG, logged_in=set(), backend=backend, **kwargs))
+
+
+def read(user, domain):
+    with open(user.preferences / f"{domain}.plist", "rb") as f:
+        return plistlib.load(f)
+
+
+def test_memory_backends_per_account(tmp_path):
+    accounts = make_users(tmp_path, "alice", "bob")
+    stores = {
+        "alice": api.MemoryBackend({"com.apple.dock": {"tilesize": 48, "autohide": True}}),
+        "bob": api.MemoryBackend(),
+    }
+    results = asyncio.run(
+        users.apply_users(
+            accounts, CONFIG, logged_in={"bob"}, backend=lambda user, logged_in: stores[user.name]
+        )
+    )
+
+    assert [[d.key for d in r.changes] for r in results] == [
+        ["finder.show_hidden"],
+        ["dock.size", "dock.autohide", "finder.show_hidden"],
+    ]
+    assert stores["bob"].domains["com.apple.dock"] == {"tilesize": 48, "autohide": True}
+    assert [r.restarted for r in results] == [["Finder"], ["Dock", "Finder"]]
+
+
+def test_plist_files_are_written_and_merged(tmp_path):
+    [alice] = make_users(tmp_path, "alice")
+    alice.preferences.mkdir(parents=True)
+    (alice.preferences / "com.apple.dock.plist").write_bytes(plistlib.dumps({"orientation": "left"}))
+
+    [result] = apply([alice], plist_backend)
+
+    assert result.error is None
+    assert read(alice, "com.apple.dock") == {"orientation": "left", "tilesize": 48, "autohide": True}
+    assert read(alice, "com.apple.finder") == {"AppleShowAllFiles": True}
+    # Nothing runs without a session, so nothing was restarted
+    assert result.restarted == []
+
+
+def test_missing_preferences_directory_is_created(tmp_path):
+    [alice] = make_users(tmp_path, "alice")
+    [result] = apply([alice], plist_backend)
+
+    assert result.error is None
+    assert oct(alice.preferences.stat().st_mode & 0o777) == oct(0o700)
+
+
+def test_corrupt_plist_fails_only_its_account(tmp_path):
+    alice, bob = make_users(tmp_path, "alice", "bob")
+    bob.preferences.mkdir(parents=True)
+    corrupt = b"bplist00 this is not a plist"
+    (bob.preferences / "com.apple.dock.plist").write_bytes(corrupt)
+
+    results = apply([alice, bob], plist_backend)
+
+    assert results[0].error is None
+    assert "com.apple.dock.plist" in results[1].error
+    assert (bob.preferences / "com.apple.dock.plist").read_bytes() == corrupt
+
+
+def test_symlinked_preferences_directory_is_refused(tmp_path):
+    [mallory] = make_users(tmp_path, "mallory")
+    target = tmp_path / "elsewhere"
+    target.mkdir()
+    (mallory.home / "Library").mkdir()
+    mallory.preferences.symlink_to(target)
+
+    [result] = apply([mallory], plist_backend)
+
+    assert "Refusing" in result.error
+    assert list(target.iterdir()) == []
+
+
+def test_symlinked_plist_is_refused(tmp_path):
+    [mallory] = make_users(tmp_path, "mallory")
+    secret = tmp_path / "secret.plist"
+    secret.write_bytes(plistlib.dumps({"password": "hunter2"}))
+    mallory.preferences.mkdir(parents=True)
+    (mallory.preferences / "com.apple.dock.plist").symlink_to(secret)
+
+    [result] = apply([mallory], plist_backend)
+
+    assert "symlink" in result.error
+    assert plistlib.loads(secret.read_bytes()) == {"password": "hunter2"}
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="needs root to hand files to another user")
+def test_files_are_owned_by_the_account(tmp_path):
+    [alice] = make_users(tmp_path, "alice")
+
+    def owned(user, logged_in):
+        return api.PlistFileBackend(str(user.preferences), uid=user.uid, gid=user.gid, home=str(user.home))
+
+    [result] = apply([alice], owned)
+
+    assert result.error is None
+    for path in [alice.home / "Library", alice.preferences, *alice.preferences.iterdir()]:
+        assert (path.stat().st_uid, path.stat().st_gid) == (alice.uid, alice.gid)
+
+
+def test_only_successful_restarts_are_reported(tmp_path):
+    [alice] = make_users(tmp_path, "alice")
+
+    class NotRunning(api.MemoryBackend):
+        async def restart_app(self, app_name):
+            await super().restart_app(app_name)
+            return app_name != "Dock"
+
+    results = asyncio.run(
+        users.apply_users([alice], CONFIG, logged_in={"alice"}, backend=lambda user, logged_in: NotRunning())
+    )
+    assert results[0].restarted == ["Finder"]